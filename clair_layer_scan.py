@@ -0,0 +1,329 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import tarfile
+import argparse
+import logging
+import tempfile
+import threading
+import subprocess
+from junit_xml import TestSuite
+from clair_to_junit_parser import ReportIndex, load_whitelist, read_setup_errors
+try:
+    from urllib.request import urlopen, Request
+    from urllib.error import HTTPError
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+except ImportError:
+    from urllib2 import urlopen, Request, HTTPError
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+
+logger = logging.getLogger('clair_layer_scan')
+logger.setLevel(logging.INFO)
+console_logger = logging.StreamHandler()
+console_logger.setLevel(logging.INFO)
+formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+console_logger.setFormatter(formatter)
+logger.addHandler(console_logger)
+
+CLAIR_TIMEOUT = 600
+COPY_CHUNK = 1024 * 1024
+
+
+def chain_ids(diff_ids):
+    '''
+    Docker's chain IDs for the layers of an image. Clair analyzes a layer on top of its parents, so a layer's
+    result only carries over to another image that has the same layers underneath it, which is what a chain ID is.
+    '''
+    chain = []
+    for diff_id in diff_ids:
+        if chain:
+            diff_id = "sha256:" + hashlib.sha256("{} {}".format(chain[-1], diff_id).encode("utf-8")).hexdigest()
+        chain.append(diff_id)
+    return chain
+
+def layer_name(chain_id):
+    return chain_id.split(":", 1)[-1]
+
+def feature_key(feature):
+    return "{}|{}|{}".format(feature.get("NamespaceName"), feature.get("Name"), feature.get("Version"))
+
+def flatten(features):
+    '''
+    Clair features as the vulnerability list of a clair-scanner report
+    '''
+    vulnerabilities = []
+    for feature in features:
+        for vuln in feature.get("Vulnerabilities") or []:
+            vulnerabilities.append({
+                "featurename": feature.get("Name"),
+                "featureversion": feature.get("Version"),
+                "vulnerability": vuln.get("Name"),
+                "namespace": vuln.get("NamespaceName"),
+                "description": vuln.get("Description", ""),
+                "link": vuln.get("Link", ""),
+                "severity": vuln.get("Severity"),
+                "fixedby": vuln.get("FixedBy", "")
+            })
+    return vulnerabilities
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LayerHandler(BaseHTTPRequestHandler):
+    """
+    Serves the layer tarballs straight out of the `docker save` archive, so that they never have to be extracted
+    """
+
+    def do_GET(self):
+        member = self.server.members.get(self.path.lstrip("/"))
+        if member is None:
+            self.send_error(404)
+            return
+        offset, size = member
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-tar")
+        self.send_header("Content-Length", str(size))
+        self.end_headers()
+        with open(self.server.archive, "rb") as f:
+            f.seek(offset)
+            while size > 0:
+                chunk = f.read(min(COPY_CHUNK, size))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                size -= len(chunk)
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class LayerScanner(object):
+    """
+    Scans the layers of several images with a clair v2 server, analyzing every unique layer once. The features
+    each layer adds are cached by chain ID under `cache_dir`, and per-image reports are composed from the cache.
+    """
+
+    def __init__(self, clair_url, cache_dir, layer_url):
+        self.clair_url = clair_url.rstrip("/")
+        self.cache_dir = cache_dir
+        self.layer_url = layer_url.rstrip("/")
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.posted = set()
+        self.cache_hits = 0
+        self.analyzed = 0
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def clair(self, method, path, body=None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = Request("{}{}".format(self.clair_url, path), data=data, headers={"Content-Type": "application/json"})
+        request.get_method = lambda: method
+        try:
+            response = urlopen(request, timeout=CLAIR_TIMEOUT)
+        except HTTPError as e:
+            raise RuntimeError("Clair {} {} returned {}: {}".format(method, path, e.code, e.read()))
+        return json.loads(response.read().decode("utf-8") or "{}")
+
+    def cache_file(self, chain_id):
+        return os.path.join(self.cache_dir, "{}.json".format(layer_name(chain_id)))
+
+    def cached(self, chain_id):
+        try:
+            with open(self.cache_file(chain_id), "r") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def post(self, image, index):
+        '''
+        Have clair analyze a layer and its parents, unless they were posted during this run already
+        '''
+        chain, layers = image["chain"], image["layers"]
+        for i in range(index + 1):
+            with self.lock:
+                if chain[i] in self.posted:
+                    continue
+            self.clair("POST", "/v1/layers", {"Layer": {
+                "Name": layer_name(chain[i]),
+                "Path": "{}/{}".format(self.layer_url, layers[i]),
+                "ParentName": layer_name(chain[i - 1]) if i else "",
+                "Format": "Docker"
+            }})
+            with self.lock:
+                self.posted.add(chain[i])
+
+    def layer(self, image, index):
+        '''
+        Features added by, and present at, a layer of `image`; analyzed once no matter how many images share it
+        '''
+        chain_id = image["chain"][index]
+        with self.lock:
+            event = self.pending.get(chain_id)
+            owner = event is None
+            if owner:
+                event = self.pending[chain_id] = threading.Event()
+        if not owner:
+            event.wait()
+            result = self.cached(chain_id)
+            if result is None:
+                raise RuntimeError("Layer {} failed to scan".format(chain_id))
+            return result
+        try:
+            result = self.cached(chain_id)
+            if result is not None:
+                with self.lock:
+                    self.cache_hits += 1
+                return result
+            self.post(image, index)
+            layer = self.clair("GET", "/v1/layers/{}?features&vulnerabilities".format(layer_name(chain_id)))["Layer"]
+            features = layer.get("Features") or []
+            result = {
+                "chain_id": chain_id,
+                "namespace": layer.get("NamespaceName"),
+                "added": [feature for feature in features if feature.get("AddedBy") == layer_name(chain_id)],
+                "present": [feature_key(feature) for feature in features]
+            }
+            # Written under a temporary name and renamed, so a cancelled scan never leaves a partial entry
+            partial = "{}.{}.partial".format(self.cache_file(chain_id), os.getpid())
+            with open(partial, "w") as f:
+                json.dump(result, f)
+            os.rename(partial, self.cache_file(chain_id))
+            with self.lock:
+                self.analyzed += 1
+            return result
+        finally:
+            event.set()
+
+    def scan(self, image):
+        '''
+        Vulnerabilities of an image, composed from the cached results of its layers
+        '''
+        features = {}
+        present = []
+        for index in range(len(image["chain"])):
+            result = self.layer(image, index)
+            for feature in result["added"]:
+                features[feature_key(feature)] = feature
+            present = result["present"]
+        # A package removed by a later layer is no longer present at the top layer
+        return flatten([features[key] for key in present if key in features])
+
+
+def image_exists(image):
+    with open(os.devnull, "w") as devnull:
+        return subprocess.call(["docker", "image", "inspect", image], stdout=devnull, stderr=devnull) == 0
+
+def save_images(images, archive):
+    '''
+    Save all images into one archive, where layers shared by several images are stored once
+    '''
+    subprocess.check_call(["docker", "save", "-o", archive] + images)
+    members = {}
+    with tarfile.open(archive, "r") as tar:
+        for member in tar.getmembers():
+            if member.isfile():
+                members[member.name] = (member.offset_data, member.size)
+        manifest = json.load(tar.extractfile("manifest.json"))
+        scanned = []
+        for entry in manifest:
+            config = json.loads(tar.extractfile(entry["Config"]).read().decode("utf-8"))
+            for tag in entry.get("RepoTags") or []:
+                if tag in images:
+                    scanned.append({"image": tag, "layers": entry["Layers"], "chain": chain_ids(config["rootfs"]["diff_ids"])})
+    return scanned, members
+
+def run_concurrently(target, items, workers):
+    lock = threading.Lock()
+    pending = list(items)
+    def worker():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                item = pending.pop(0)
+            target(item)
+    threads = [threading.Thread(target=worker) for _ in range(min(workers, len(pending)))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Scan images with clair one unique layer at a time, and convert the results to junit")
+    parser.add_argument("images", type=str, nargs="+", help="Images to scan")
+    parser.add_argument("--tag", type=str, default="latest", help="Tag of the images to scan (default: latest)")
+    parser.add_argument("--clair", type=str, default="http://0.0.0.0:6060", help="URL of the clair v2 API (default: http://0.0.0.0:6060)")
+    parser.add_argument("--ip", type=str, required=True, help="Address of this host that clair can reach to download the layers")
+    parser.add_argument("--port", type=int, default=9279, help="Port the layers are served on (default: 9279)")
+    parser.add_argument("--cache", type=str, default="clair-scanner-cache", help="Directory of cached layer results (default: clair-scanner-cache)")
+    parser.add_argument("--db-version", type=str, default="latest", help="Version of the clair vulnerability database; layer results are cached per version (default: latest)")
+    parser.add_argument("--workers", type=int, default=4, help="Number of images scanned in parallel (default: 4)")
+    parser.add_argument("--whitelist", type=str, default="clair-whitelist.yml", help="clair-scanner whitelist of approved CVEs (default: clair-whitelist.yml)")
+    parser.add_argument("--reports-dir", type=str, default="test-results", help="Per-image reports go to <reports-dir>/clair-scanner-<image>/results.json (default: test-results)")
+    parser.add_argument("--output", type=str, default=os.path.join("test-results", "clair-scanner-results.xml"), help="junit file for all images (default: test-results/clair-scanner-results.xml)")
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    start = time.time()
+    images = ["{}:{}".format(image, args.tag) for image in args.images]
+    general_whitelist, image_whitelists = load_whitelist(args.whitelist)
+    index = ReportIndex(general_whitelist, image_whitelists)
+    workdir = tempfile.mkdtemp(prefix="clair-layer-scan-")
+    server = None
+    try:
+        archive = os.path.join(workdir, "images.tar")
+        scanned, members = save_images([image for image in images if image_exists(image)], archive)
+        for missing in sorted(set(images) - set(entry["image"] for entry in scanned)):
+            index.errors.append((missing, "Image {} was not found".format(missing)))
+        server = ThreadingHTTPServer(("0.0.0.0", args.port), LayerHandler)
+        server.archive, server.members = archive, members
+        threading.Thread(target=server.serve_forever).start()
+        scanner = LayerScanner(args.clair, os.path.join(args.cache, args.db_version), "http://{}:{}".format(args.ip, args.port))
+        reports = {}
+        def scan(entry):
+            try:
+                reports[entry["image"]] = scanner.scan(entry)
+            except Exception as e:
+                logger.exception("Failed to scan {}".format(entry["image"]))
+                reports[entry["image"]] = e
+        run_concurrently(scan, scanned, args.workers)
+        for entry in scanned:
+            image = entry["image"]
+            if isinstance(reports[image], Exception):
+                index.errors.append((image, "Failed to scan {}: {}".format(image, reports[image])))
+                continue
+            whitelist = index.whitelist_for(image)
+            report = {
+                "image": image,
+                "unapproved": sorted(set(vuln["vulnerability"] for vuln in reports[image] if vuln["vulnerability"] not in whitelist)),
+                "vulnerabilities": reports[image]
+            }
+            directory = os.path.join(args.reports_dir, "clair-scanner-{}".format(image.rsplit(":", 1)[0]))
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            with open(os.path.join(directory, "results.json"), "w") as f:
+                json.dump(report, f, indent=2)
+            index.add_image(image, reports[image])
+        unique_layers = len(set(chain_id for entry in scanned for chain_id in entry["chain"]))
+        total_layers = sum(len(entry["chain"]) for entry in scanned)
+        logger.info("Scanned {} images: {} layers, {} unique, {} analyzed, {} from cache in {:.1f}s".format(
+            len(scanned), total_layers, unique_layers, scanner.analyzed, scanner.cache_hits, time.time() - start))
+    finally:
+        if server:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    with open(args.output, "w") as outfile:
+        outfile.write(TestSuite.to_xml_string(index.test_suites(read_setup_errors())))
+
+
+if __name__ == "__main__":
+    main()
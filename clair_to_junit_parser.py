@@ -1,6 +1,7 @@
 import json
 from junit_xml import TestSuite, TestCase
 import os
+import yaml
 import argparse
 import logging
 
@@ -12,61 +13,268 @@ formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(messag
 console_logger.setFormatter(formatter)
 logger.addHandler(console_logger)
 
+SETUP_ERRORS_FILE = os.path.join("clair-scanner-logs", "clair_setup_errors.log")
+# Clair's severities, most severe first; suites are written in this order
+SEVERITIES = ["Defcon1", "Critical", "High", "Medium", "Low", "Negligible", "Unknown"]
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = " \t\n\r"
+NUMBER_CHARS = "0123456789.eE+-"
+
+
+class JsonStream(object):
+    """
+    Reads a JSON document a value at a time, so that a large array can be iterated over without loading it whole
+    """
+
+    def __init__(self, f, chunk_size=CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self):
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop what has been consumed already, so the buffer only grows up to the largest single value
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        '''
+        Next non-whitespace character, or None at the end of the document
+        '''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return None
+
+    def expect(self, chars):
+        char = self.peek()
+        if char is None or char not in chars:
+            raise ValueError("Expected one of '{}' at offset {}, found {}".format(chars, self.pos, repr(char)))
+        self.pos += 1
+        return char
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                # The value is cut off at the end of the buffer
+                if self.fill():
+                    continue
+                raise
+            # A number cut by the end of the buffer decodes as its prefix (ex. "2" of "2.5e3") and continues
+            # in the next chunk, unless something other than a number character follows it
+            if isinstance(value, (int, float)) and not isinstance(value, bool) and not self.eof \
+                    and all(c in NUMBER_CHARS for c in self.buf[end:]) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        '''
+        (key, value) pairs of the object at the current position. Arrays are yielded as iterators, which have
+        to be consumed before the next pair is read
+        '''
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            if self.peek() == "[":
+                yield key, self.elements()
+            else:
+                yield key, self.value()
+            if self.expect(",}") == "}":
+                return
+
+    def elements(self):
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(",]") == "]":
+                return
+
+
+def iter_report(path):
+    '''
+    Yield ("image", name) and then ("vulnerability", vuln) for every vulnerability of a clair-scanner report
+    '''
+    with open(path) as f:
+        for key, value in JsonStream(f).items():
+            if key == "vulnerabilities":
+                for vuln in value:
+                    yield "vulnerability", vuln
+            elif key == "image":
+                yield "image", value
+            elif hasattr(value, "next") or hasattr(value, "__next__"):
+                for _ in value:
+                    pass
+
+def load_whitelist(path):
+    '''
+    Whitelisted CVEs, as the set of CVEs for every image plus a set per image name
+    '''
+    if not path or not os.path.exists(path):
+        return set(), {}
+    with open(path) as f:
+        whitelist = yaml.safe_load(f) or {}
+    general = set(whitelist.get("generalwhitelist") or {})
+    images = dict((image, set(cves or {})) for image, cves in (whitelist.get("images") or {}).items())
+    return general, images
+
+def read_setup_errors():
+    if not os.path.exists(SETUP_ERRORS_FILE):
+        return None
+    with open(SETUP_ERRORS_FILE, 'r') as clairfile_errors:
+        return clairfile_errors.read()
+
+def image_name(image):
+    # Whitelists are keyed by image name, without the registry, tag or digest
+    name = image.split("@")[0]
+    if ":" in name.split("/")[-1]:
+        name = name.rsplit(":", 1)[0]
+    return name.split("/")[-1]
+
+
+class ReportIndex(object):
+    """
+    Vulnerabilities of one or more images, grouped by severity and deduplicated by CVE
+    """
+
+    def __init__(self, general_whitelist=None, image_whitelists=None):
+        self.general_whitelist = general_whitelist or set()
+        self.image_whitelists = image_whitelists or {}
+        self.severities = {}
+        self.errors = []
+        self.images = 0
+        self.vulnerabilities = 0
+
+    def whitelist_for(self, image):
+        return self.general_whitelist | self.image_whitelists.get(image_name(image), set())
+
+    def add_image(self, image, vulnerabilities):
+        whitelist = self.whitelist_for(image)
+        for vuln in vulnerabilities:
+            self.add(image, vuln, whitelist)
+        self.images += 1
+
+    def add_report(self, path):
+        image = os.path.basename(os.path.dirname(os.path.abspath(path)))
+        whitelist = self.general_whitelist
+        try:
+            for kind, value in iter_report(path):
+                if kind == "image":
+                    image = value
+                    whitelist = self.whitelist_for(image)
+                else:
+                    self.add(image, value, whitelist)
+        except (IOError, OSError, ValueError) as e:
+            logger.exception("Failed to parse clair file {}".format(path))
+            self.errors.append((image, "Failed to parse clair file {}: {}".format(path, e)))
+            return
+        self.images += 1
+
+    def add(self, image, vuln, whitelist):
+        self.vulnerabilities += 1
+        severity = vuln.get("severity") or "Unknown"
+        cases = self.severities.setdefault(severity, {})
+        case = cases.get(vuln["vulnerability"])
+        if case is None:
+            case = cases[vuln["vulnerability"]] = {
+                "vuln": vuln,
+                "whitelisted": vuln["vulnerability"] in whitelist,
+                "features": set(),
+                "images": set()
+            }
+        elif vuln["vulnerability"] not in whitelist:
+            # Approved only if it is whitelisted for every image it was found in
+            case["whitelisted"] = False
+        case["features"].add("{} {}".format(vuln.get("featurename"), vuln.get("featureversion")).strip())
+        case["images"].add(image)
+
+    def test_suites(self, setup_errors=None):
+        test_suites = []
+        if setup_errors:
+            suite = TestSuite("SetupError")
+            new_step = TestCase(name="SetupError", classname="SetupError", status="unapproved", stderr=setup_errors)
+            new_step.log = setup_errors
+            new_step.category = "SetupError"
+            new_step.add_failure_info(message="Clair scanner setup reported errors", output=setup_errors, failure_type="unapproved")
+            suite.test_cases.append(new_step)
+            test_suites.append(suite)
+        if self.errors:
+            suite = TestSuite("ScanError")
+            for image, message in self.errors:
+                new_step = TestCase(name=image, classname="ScanError", status="error")
+                new_step.add_error_info(message=message)
+                suite.test_cases.append(new_step)
+            test_suites.append(suite)
+        ordered = [s for s in SEVERITIES if s in self.severities] + sorted(s for s in self.severities if s not in SEVERITIES)
+        for severity in ordered:
+            suite = TestSuite(name=severity)
+            for name, case in sorted(self.severities[severity].items()):
+                vuln = case["vuln"]
+                images = ", ".join(sorted(case["images"]))
+                new_step = TestCase(name=name, classname=severity, status="approved" if case["whitelisted"] else "unapproved",
+                                    url=vuln.get("link"), stderr=vuln.get("description"),
+                                    stdout="Found in {} ({})".format(images, ", ".join(sorted(case["features"]))))
+                new_step.log = vuln
+                new_step.category = severity
+                if case["whitelisted"]:
+                    new_step.add_skipped_info(message="Whitelisted in clair-whitelist.yml")
+                else:
+                    new_step.add_failure_info(message="Please have the following security issue reviewed by Splunk: {}".format(vuln.get("link")),
+                                              output=vuln.get("description"), failure_type="unapproved")
+                suite.test_cases.append(new_step)
+            test_suites.append(suite)
+        return test_suites
+
+
 def parse_args():
-    parser = argparse.ArgumentParser(description="Process Json File")
-    parser.add_argument("clairfile", type=str, default=None, help="Location of clair scanner ouptut file to convert to cucumber.json")
+    parser = argparse.ArgumentParser(description="Convert clair scanner reports into a single junit file")
+    parser.add_argument("clairfiles", type=str, nargs="+", help="Location of one or more clair scanner output files to convert to junit")
     parser.add_argument("--output", type=str, default=None, help="name of output file to store in new format. Defaults to clair inputfile")
+    parser.add_argument("--whitelist", type=str, default="clair-whitelist.yml", help="clair-scanner whitelist of approved CVEs (default: clair-whitelist.yml)")
     args = parser.parse_args()
     if not args.output:
+        if len(args.clairfiles) > 1:
+            parser.error("--output is required when converting more than one clair file")
         logger.warning("No output file specified, replacing input file.")
-        args.output = args.clairfile
+        args.output = args.clairfiles[0]
     return args
 
 def main():
-    cwd = os.getcwd()
     args = parse_args()
-    try:
-        if os.path.exists(args.clairfile):
-            with open(args.clairfile) as clairfile:
-                clair_parsed_file = json.load(clairfile)
-        if os.path.exists(os.path.join("clair-scanner-logs", "/clair_setup_errors.log")):
-            with open(os.path.join("clair-scanner-logs", "/clair_setup_errors.log"), 'r') as clairfile_errors:
-                clair_parsed_error_file = clairfile_errors.readlines()
-        else:
-            clair_parsed_error_file = None
-    except:
-        logger.exception("Failed to parse clair / clair_error file.  Exiting.")
-
-    current_sorted_level = None
-    current_suite = None
-    test_suites = []
-    if clair_parsed_error_file:
-        current_suite = TestSuite("SetupError")
-        new_step = TestCase(name="SetupError", classname="SetupError", status="unapproved", stderr=clair_parsed_error_file)
-        new_step.log = clair_parsed_error_file
-        new_step.category = "SetupError"
-        new_step.failure_type = "unapproved"
-        new_step.failure_message = "Please have the following security issue reviewed by Splunk: {}".format(vuln["link"])
-        new_step.failure_output = clair_parsed_error_file
-        current_suite.test_cases.append(new_step)
-        test_suites.append(current_suite)
-    for vuln in clair_parsed_file["vulnerabilities"]:
-        if current_sorted_level != vuln["severity"]:
-            if current_suite:
-                test_suites.append(current_suite)
-            current_suite = TestSuite(name=vuln["severity"])
-            current_sorted_level = vuln["severity"]
-        new_step = TestCase(name=vuln["vulnerability"], classname=vuln["severity"], status="unapproved", url=vuln["link"], stderr=vuln["description"])
-        new_step.log = vuln
-        new_step.category = vuln["severity"]
-        new_step.failure_type = "unapproved"
-        new_step.failure_message = "Please have the following security issue reviewed by Splunk: {}".format(vuln["link"])
-        new_step.failure_output = vuln["description"]
-        current_suite.test_cases.append(new_step)
+    general_whitelist, image_whitelists = load_whitelist(args.whitelist)
+    index = ReportIndex(general_whitelist, image_whitelists)
+    for clairfile in args.clairfiles:
+        if not os.path.exists(clairfile):
+            logger.error("Clair file {} does not exist.".format(clairfile))
+            index.errors.append((clairfile, "Clair file {} does not exist".format(clairfile)))
+            continue
+        index.add_report(clairfile)
     # try to write new file
     try:
         with open(args.output, 'w') as outfile:
-            outfile.write(TestSuite.to_xml_string(test_suites))
+            outfile.write(TestSuite.to_xml_string(index.test_suites(read_setup_errors())))
     except:
         logger.exception("Filed saving file.")
 
@@ -13,8 +13,10 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import os
+import re
 import six
 import sys
+import math
 import uuid
 import random
 import base64
@@ -29,6 +31,11 @@ splunk_idxc_secret = os.environ.get("SPLUNK_IDXC_SECRET", None)
 splunk_idxc_pass4SymmKey = os.environ.get("SPLUNK_IDXC_PASS4SYMMKEY", None)
 splunk_shc_secret = os.environ.get("SPLUNK_SHC_SECRET", None)
 splunk_shc_pass4SymmKey = os.environ.get("SPLUNK_SHC_PASS4SYMMKEY", None)
+splunk_retry_backoff_base = os.environ.get("SPLUNK_RETRY_BACKOFF_BASE", None)
+splunk_retry_backoff_cap = os.environ.get("SPLUNK_RETRY_BACKOFF_CAP", None)
+splunk_retry_backoff_jitter = os.environ.get("SPLUNK_RETRY_BACKOFF_JITTER", None)
+
+RETRY_KEYS = ["retry_num", "wait_for_splunk_retry_num", "shc_sync_retry_num"]
 
 def random_generator(size=24):
     # Use System Random for
@@ -41,6 +48,38 @@ def random_generator(size=24):
         s = base64.b64encode(s.encode()).decode()
     return s
 
+def get_top_level_int(defaults, key, default):
+    match = re.search(r"^{}: *(\d+) *$".format(key), defaults, flags=re.MULTILINE)
+    return int(match.group(1)) if match else default
+
+def set_top_level(defaults, key, value):
+    line = "{}: {}".format(key, value)
+    pattern = r"^{}:.*$".format(key)
+    if re.search(pattern, defaults, flags=re.MULTILINE):
+        return re.sub(pattern, lambda _: line, defaults, count=1, flags=re.MULTILINE)
+    return defaults.rstrip("\n") + "\n" + line + "\n"
+
+def apply_retry_backoff(defaults, base, cap, jitter):
+    """
+    Ansible `until` loops sleep for a fixed delay between attempts, so the backoff policy is resolved per host
+    and per task: each wait draws a delay between `base` and `base + jitter * (cap - base)` seconds. This keeps
+    peers from polling the cluster master in lockstep, and the retry counts are scaled to keep the original wait budget.
+    """
+    base = max(int(base), 1)
+    cap = max(int(cap), base)
+    jitter = min(max(float(jitter), 0.0), 1.0)
+    spread = int(jitter * (cap - base))
+    mean_delay = base + spread / 2.0
+    retry_delay = get_top_level_int(defaults, "retry_delay", 6)
+    if spread:
+        defaults = set_top_level(defaults, "retry_delay", "'{{{{ {} + (range(0, {}) | random) }}}}'".format(base, spread + 1))
+    else:
+        defaults = set_top_level(defaults, "retry_delay", base)
+    for key in RETRY_KEYS:
+        budget = get_top_level_int(defaults, key, 60) * retry_delay
+        defaults = set_top_level(defaults, key, int(math.ceil(budget / mean_delay)))
+    policy = "retry_backoff:\n  base: {}\n  cap: {}\n  jitter: {}".format(base, cap, jitter)
+    return defaults.rstrip("\n") + "\n" + policy + "\n"
 
 # if there are no environment vars set, lets make some safe defaults
 if not splunk_hec_token:
@@ -62,5 +101,18 @@ else:
     os.environ["SPLUNK_SHC_PASS4SYMMKEY"] = os.environ["SPLUNK_SHC_SECRET"] = random_generator()
 sys.argv.append("--write-to-stdout")
 import environ
-environ.main()
+if splunk_retry_backoff_base:
+    # Capture the generated defaults so that the fixed retry delay can be replaced with the backoff policy
+    stdout = sys.stdout
+    sys.stdout = six.StringIO()
+    try:
+        environ.main()
+        defaults = sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+    sys.stdout.write(apply_retry_backoff(defaults, splunk_retry_backoff_base,
+                                         splunk_retry_backoff_cap or 10,
+                                         splunk_retry_backoff_jitter or 1))
+else:
+    environ.main()
 
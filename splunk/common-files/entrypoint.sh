@@ -30,9 +30,36 @@ teardown() {
 	if [ `whoami` != "${SPLUNK_USER}" ]; then
 		RUN_AS_SPLUNK="sudo -u ${SPLUNK_USER}"
 	fi
+	if [[ "$SPLUNK_DRAIN_ON_STOP" == "true" ]]; then
+		drain
+	fi
 	${RUN_AS_SPLUNK} ${SPLUNK_HOME}/bin/splunk stop || true
 }
 
+drain() {
+	# Take an indexer peer offline through the cluster master, so that its primary buckets are handed over before splunkd stops
+	if [[ "$SPLUNK_ROLE" != "splunk_indexer" || -z "$SPLUNK_CLUSTER_MASTER_URL" ]]; then
+		echo "Skipping drain, this container is not an indexer cluster peer"
+		return 0
+	fi
+	if [ -z "$SPLUNK_PASSWORD" ]; then
+		echo "WARNING: Skipping drain, SPLUNK_PASSWORD is required to take the peer offline"
+		return 0
+	fi
+	if [ `whoami` != "${SPLUNK_USER}" ]; then
+		RUN_AS_SPLUNK="sudo -u ${SPLUNK_USER}"
+	fi
+	if [[ "$SPLUNK_DRAIN_ENFORCE_COUNTS" == "true" ]]; then
+		DRAIN_ARGS="--enforce-counts"
+	fi
+	echo "Draining indexer peer, waiting up to ${SPLUNK_DRAIN_TIMEOUT:-180}s"
+	DRAIN_START=`date +%s`
+	DRAIN_RC=0
+	# --foreground keeps splunk offline in our process group, so that the supervisor can kill the whole drain
+	${RUN_AS_SPLUNK} timeout --foreground ${SPLUNK_DRAIN_TIMEOUT:-180} ${SPLUNK_HOME}/bin/splunk offline ${DRAIN_ARGS} -auth "admin:${SPLUNK_PASSWORD}" || DRAIN_RC=$?
+	echo "Drain finished in $(( `date +%s` - DRAIN_START ))s (rc: ${DRAIN_RC})"
+}
+
 trap teardown SIGINT SIGTERM
 
 prep_ansible() {
@@ -40,6 +67,11 @@ prep_ansible() {
 	if [ `whoami` == "${SPLUNK_USER}" ]; then
 		sed -i -e "s,^become\\s*=.*,become = false," ansible.cfg
 	fi
+	if [[ "$SPLUNK_ANSIBLE_PROFILE" == "true" ]]; then
+		# The task_profile callback is installed in callback_plugins/ next to the playbooks
+		export ANSIBLE_CALLBACK_WHITELIST="task_profile${ANSIBLE_CALLBACK_WHITELIST:+,${ANSIBLE_CALLBACK_WHITELIST}}"
+		export ANSIBLE_CALLBACKS_ENABLED="task_profile${ANSIBLE_CALLBACKS_ENABLED:+,${ANSIBLE_CALLBACKS_ENABLED}}"
+	fi
 	if [[ "$DEBUG" == "true" ]]; then
 		ansible-playbook --version
 		python inventory/environ.py --write-to-file
@@ -49,6 +81,38 @@ prep_ansible() {
 	fi
 }
 
+skip_bundled_java() {
+	# Images built from java-image/ already have the JDK, so Ansible doesn't need to install it again
+	if [[ -n "$JAVA_VERSION" && "$JAVA_VERSION" == "$SPLUNK_BUNDLED_JAVA" ]] && java -version >/dev/null 2>&1; then
+		echo "Java ${JAVA_VERSION} is preinstalled in ${JAVA_HOME}, skipping its installation"
+		unset JAVA_VERSION
+	fi
+}
+
+preflight() {
+	# Check host settings that affect splunkd performance before provisioning
+	if [ `whoami` != "${SPLUNK_USER}" ]; then
+		RUN_AS_SPLUNK="sudo -E -u ${SPLUNK_USER}"
+	fi
+	${RUN_AS_SPLUNK} /sbin/preflight.py
+}
+
+reconcile_ownership() {
+	# Give SPLUNK_USER ownership of SPLUNK_HOME and mounted volumes, skipping the subtrees that already have it
+	if [ `whoami` != "root" ]; then
+		RUN_AS_ROOT="sudo -E"
+	fi
+	${RUN_AS_ROOT} /sbin/ownership.py
+}
+
+relocate_scratch() {
+	# Move dispatch and other search scratch paths onto SPLUNK_SCRATCH_DIR, or back onto the volume if it can't be used
+	if [ `whoami` != "${SPLUNK_USER}" ]; then
+		RUN_AS_SPLUNK="sudo -E -u ${SPLUNK_USER}"
+	fi
+	${RUN_AS_SPLUNK} /sbin/scratch.py setup
+}
+
 watch_for_failure(){
 	if [[ $? -eq 0 ]]; then
 		sh -c "echo 'started' > ${CONTAINER_ARTIFACT_DIR}/splunk-container.state"
@@ -60,13 +124,20 @@ watch_for_failure(){
 		RUN_AS_SPLUNK="sudo -u ${SPLUNK_USER}"
 	fi
 	# Any crashes/errors while Splunk is running should get logged to splunkd_stderr.log and sent to the container's stdout
-	if [ -z "$SPLUNK_TAIL_FILE" ]; then
+	if [[ "$SPLUNK_LOG_STREAMER" == "true" ]]; then
+		echo Ansible playbook complete, will begin streaming ${SPLUNK_LOG_STREAMER_FILES:-${SPLUNK_TAIL_FILE:-splunkd_stderr.log}}
+		# The streamer is configured through the environment, so keep it across sudo
+		${RUN_AS_SPLUNK/sudo/sudo -E} /sbin/logstream.py &
+	elif [ -z "$SPLUNK_TAIL_FILE" ]; then
 		echo Ansible playbook complete, will begin streaming splunkd_stderr.log
 		${RUN_AS_SPLUNK} tail -n 0 -F ${SPLUNK_HOME}/var/log/splunk/splunkd_stderr.log &
 	else
 		echo Ansible playbook complete, will begin streaming ${SPLUNK_TAIL_FILE}
 		${RUN_AS_SPLUNK} tail -n 0 -F ${SPLUNK_TAIL_FILE} &
 	fi
+	if [[ -n "$SPLUNK_SCRATCH_DIR" ]]; then
+		${RUN_AS_SPLUNK/sudo/sudo -E} /sbin/scratch.py watch &
+	fi
 	if [[ "$DISABLE_ENTIRE_SHELL_ACCESS" == "true" ]]; then
 		disable_entire_shell_access_for_container
 	fi
@@ -84,6 +155,16 @@ start_and_exit() {
 	fi
 	sh -c "echo 'starting' > ${CONTAINER_ARTIFACT_DIR}/splunk-container.state"
 	setup
+	if [[ "$SPLUNK_OWNERSHIP_RECONCILE" == "true" ]]; then
+		reconcile_ownership
+	fi
+	if [[ "$SPLUNK_PREFLIGHT" == "true" ]]; then
+		preflight
+	fi
+	if [[ -n "$SPLUNK_SCRATCH_DIR" || -L "${SPLUNK_HOME}/var/run/splunk/dispatch" ]]; then
+		relocate_scratch
+	fi
+	skip_bundled_java
 	prep_ansible
 	ansible-playbook $ANSIBLE_EXTRA_FLAGS -i inventory/environ.py -l localhost site.yml
 }
@@ -158,6 +239,21 @@ Environment Variables:
                                                      This is optional for standalones, but required for multi-node Splunk deployments.
   * SPLUNK_BUILD_URL - URL to a Splunk build which will be installed (instead of the image's default build)
   * SPLUNK_APPS_URL - comma-separated list of URLs to Splunk apps which will be downloaded and installed
+  * SPLUNK_ANSIBLE_PROFILE - write the duration of every Ansible task to \$CONTAINER_ARTIFACT_DIR/ansible_task_profile_<playbook>.json (default: false)
+  * SPLUNK_PREFLIGHT - run host performance checks before provisioning and write them to \$CONTAINER_ARTIFACT_DIR/preflight.json (default: false)
+  * SPLUNK_PREFLIGHT_FAIL_FAST - stop the container if any preflight check falls below its threshold (default: false)
+  * SPLUNK_OWNERSHIP_RECONCILE - give SPLUNK_USER:SPLUNK_GROUP ownership of SPLUNK_HOME before provisioning, skipping subtrees that already have it (default: false)
+  * SPLUNK_OWNERSHIP_PATHS - comma-separated paths to reconcile (default: SPLUNK_HOME)
+  * SPLUNK_OWNERSHIP_WORKERS - number of directories walked in parallel (default: 8)
+  * SPLUNK_SCRATCH_DIR - tmpfs or local directory to move var/run/splunk/dispatch and srtemp onto, with idle entries moved back to the volume when it fills up (default: none)
+  * SPLUNK_DRAIN_ON_STOP - take an indexer cluster peer offline through the cluster master before stopping it (default: false)
+  * SPLUNK_DRAIN_TIMEOUT - maximum number of seconds to wait for the peer to go offline (default: 180)
+  * SPLUNK_DRAIN_ENFORCE_COUNTS - wait for the replication and search factors to be met again before the peer goes offline (default: false)
+  * SPLUNK_LOG_STREAMER - stream Splunk logs to stdout as rate-limited JSON lines instead of tailing splunkd_stderr.log (default: false)
+  * SPLUNK_LOG_STREAMER_FILES - comma-separated log files to stream, relative to \$SPLUNK_HOME/var/log/splunk (default: splunkd_stderr.log)
+  * SPLUNK_SUPERVISOR - run start, start-and-exit, restart, no-provision and create-defaults under a Python supervisor as PID 1 (default: false)
+  * SPLUNK_SUPERVISOR_STOP_TIMEOUT - seconds the supervisor allows splunk stop before it kills what is left (default: 25)
+  * SPLUNK_SUPERVISOR_STOP_RESERVE - seconds of the stop timeout kept for splunk stop when draining (default: 15)
 
 Examples:
   * docker run -it -e SPLUNK_PASSWORD=helloworld -p 8000:8000 splunk/splunk start
@@ -169,6 +265,15 @@ EOF
 	exit 1
 }
 
+# Hand the supported commands over to the Python supervisor, which then runs as PID 1
+if [[ "$SPLUNK_SUPERVISOR" == "true" ]]; then
+	case "$1" in
+		start|start-service|start-and-exit|restart|no-provision|create-defaults)
+			exec /sbin/supervisor.py "$@"
+			;;
+	esac
+fi
+
 case "$1" in
 	start|start-service)
 		shift
@@ -185,6 +290,21 @@ case "$1" in
 	create-defaults)
 		create_defaults
 		;;
+	preflight)
+		preflight
+		;;
+	prep-ansible)
+		prep_ansible
+		;;
+	reconcile-ownership)
+		reconcile_ownership
+		;;
+	relocate-scratch)
+		relocate_scratch
+		;;
+	drain)
+		drain
+		;;
 	restart)
 		shift
 		restart $@
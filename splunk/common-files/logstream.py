@@ -0,0 +1,288 @@
+#! /usr/bin/python
+# Copyright 2018-2021 Splunk
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This script follows one or more Splunk log files and writes every new line to stdout as JSON,
+# tagged with the file it came from and its log level. It is a replacement for `tail -F` in
+# watch_for_failure, enabled with SPLUNK_LOG_STREAMER=true. Each file has its own rate limit;
+# lines over the limit are sampled and the rest are dropped, with the number of dropped lines
+# reported periodically. New data is picked up through inotify, with polling as a fallback. A file
+# whose directory doesn't exist yet is watched through its nearest existing parent directory.
+import os
+import re
+import sys
+import json
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+SPLUNK_HOME = os.environ.get("SPLUNK_HOME", "/opt/splunk")
+LOG_DIR = os.path.join(SPLUNK_HOME, "var", "log", "splunk")
+DEFAULT_FILE = os.environ.get("SPLUNK_TAIL_FILE") or "splunkd_stderr.log"
+FILES = os.environ.get("SPLUNK_LOG_STREAMER_FILES") or DEFAULT_FILE
+RATE = float(os.environ.get("SPLUNK_LOG_STREAMER_RATE", 100))
+BURST = float(os.environ.get("SPLUNK_LOG_STREAMER_BURST", 1000))
+SAMPLE = int(os.environ.get("SPLUNK_LOG_STREAMER_SAMPLE", 100))
+REPORT_INTERVAL = float(os.environ.get("SPLUNK_LOG_STREAMER_REPORT_INTERVAL", 10))
+MAX_LINE = 64 * 1024
+POLL_INTERVAL = 1
+
+# splunkd.log and friends look like "06-17-2021 10:00:00.000 +0000 WARN  TcpOutputProc - ..."
+LEVEL_PATTERN = re.compile(r"\b(DEBUG|INFO|WARN|WARNING|ERROR|FATAL|CRIT)\b")
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct("iIII")
+
+
+def resolve(name):
+    # Bare file names are taken to be in $SPLUNK_HOME/var/log/splunk, like SPLUNK_TAIL_FILE
+    return name if os.path.isabs(name) else os.path.join(LOG_DIR, name)
+
+def emit(record):
+    sys.stdout.write(json.dumps(record, sort_keys=True) + "\n")
+
+
+class Inotify(object):
+    """
+    Minimal inotify binding over ctypes, watching directories so that files can be created and rotated.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.add_watch = libc.inotify_add_watch
+        self.add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches = {}
+
+    def watch(self, directory):
+        if directory in self.watches.values():
+            return True
+        wd = self.add_watch(self.fd, directory.encode("utf-8"), WATCH_MASK)
+        if wd < 0:
+            return False
+        self.watches[wd] = directory
+        return True
+
+    def read(self, timeout):
+        '''
+        Paths that changed within `timeout` seconds
+        '''
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return set()
+            raise
+        changed, offset = set(), 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0").decode("utf-8", "replace")
+            offset += EVENT_HEADER.size + length
+            if wd in self.watches and name:
+                changed.add(os.path.join(self.watches[wd], name))
+        return changed
+
+
+class FollowedFile(object):
+    """
+    One followed file with its own token bucket. Lines over the rate limit are sampled 1 in `sample`
+    (0 to drop all of them), and the dropped lines are counted until the next report.
+    """
+
+    def __init__(self, path, rate=RATE, burst=BURST, sample=SAMPLE):
+        self.path = path
+        self.rate = rate
+        self.burst = burst
+        self.sample = sample
+        self.tokens = burst
+        self.refilled = time.time()
+        self.over_limit = 0
+        self.dropped = 0
+        self.dropped_total = 0
+        self.handle = None
+        self.inode = None
+        self.partial = b""
+
+    def open(self, from_start):
+        try:
+            handle = open(self.path, "rb")
+        except (IOError, OSError):
+            return False
+        if self.handle:
+            self.handle.close()
+        self.handle = handle
+        self.inode = os.fstat(handle.fileno()).st_ino
+        self.partial = b""
+        if not from_start:
+            handle.seek(0, os.SEEK_END)
+        return True
+
+    def check_rotation(self):
+        '''
+        Reopen the file from the start when it was replaced, and rewind when it was truncated
+        '''
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return
+        if self.handle is None or stat.st_ino != self.inode:
+            # Drain what was written to the old file before switching over
+            if self.handle:
+                self.read()
+            self.open(from_start=True)
+        elif stat.st_size < self.handle.tell():
+            self.handle.seek(0)
+            self.partial = b""
+
+    def read(self):
+        if self.handle is None:
+            return
+        while True:
+            data = self.handle.read(MAX_LINE)
+            if not data:
+                break
+            lines = (self.partial + data).split(b"\n")
+            self.partial = lines.pop()
+            if len(self.partial) >= MAX_LINE:
+                lines.append(self.partial)
+                self.partial = b""
+            for line in lines:
+                self.handle_line(line.decode("utf-8", "replace").rstrip("\r"))
+
+    def allow(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, False
+        self.over_limit += 1
+        if self.sample and (self.over_limit - 1) % self.sample == 0:
+            return True, True
+        return False, False
+
+    def handle_line(self, line):
+        if not line:
+            return
+        allowed, sampled = self.allow()
+        if not allowed:
+            self.dropped += 1
+            self.dropped_total += 1
+            return
+        match = LEVEL_PATTERN.search(line)
+        record = {"time": round(time.time(), 3), "file": self.path, "level": match.group(1) if match else None, "message": line}
+        if sampled:
+            record["sampled"] = self.sample
+        emit(record)
+
+    def report(self):
+        if not self.dropped:
+            return
+        emit({"time": round(time.time(), 3), "file": self.path, "level": "WARN", "dropped": self.dropped,
+              "dropped_total": self.dropped_total,
+              "message": "Dropped {} lines over the rate limit of {}/s".format(self.dropped, self.rate)})
+        self.dropped = 0
+
+
+def watch(inotify, entry):
+    '''
+    Watch the directory of a followed file, or its nearest existing parent until the directory is created.
+    Returns the watched directory, or None when nothing could be watched and the file has to be polled.
+    '''
+    directory = os.path.dirname(entry.path)
+    while not inotify.watch(directory):
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            return None
+        directory = parent
+    return directory
+
+def stream(paths, inotify=None, iterations=None):
+    followed = dict((path, FollowedFile(path)) for path in paths)
+    # Files whose directory doesn't exist yet, by the parent directory that is watched in its place
+    waiting = {}
+    polled = [] if inotify else list(followed.values())
+    for entry in followed.values():
+        # Like `tail -n 0`, only stream what is written from now on
+        entry.open(from_start=False)
+        if not inotify:
+            continue
+        watched = watch(inotify, entry)
+        if watched is None:
+            sys.stderr.write("WARNING: Unable to watch {}, polling it instead\n".format(os.path.dirname(entry.path)))
+            polled.append(entry)
+        elif watched != os.path.dirname(entry.path):
+            waiting[entry.path] = watched
+    reported = time.time()
+    count = 0
+    while iterations is None or count < iterations:
+        count += 1
+        if inotify:
+            changed = inotify.read(POLL_INTERVAL)
+            targets = [followed[path] for path in changed if path in followed]
+            # A parent of a missing directory changed, so the directory (and the file) may exist now
+            for path, watched in list(waiting.items()):
+                if any(os.path.dirname(change) == watched for change in changed):
+                    entry = followed[path]
+                    watched = watch(inotify, entry)
+                    if watched == os.path.dirname(path):
+                        del waiting[path]
+                        targets.append(entry)
+                    elif watched is not None:
+                        waiting[path] = watched
+            targets += polled
+        else:
+            time.sleep(POLL_INTERVAL)
+            targets = polled
+        for entry in targets:
+            entry.check_rotation()
+            entry.read()
+        if time.time() - reported >= REPORT_INTERVAL:
+            for entry in followed.values():
+                entry.report()
+            reported = time.time()
+        sys.stdout.flush()
+
+def main():
+    paths = [resolve(name.strip()) for name in FILES.split(",") if name.strip()]
+    try:
+        inotify = Inotify()
+    except (OSError, AttributeError) as e:
+        sys.stderr.write("WARNING: inotify is not available ({}), falling back to polling\n".format(e))
+        inotify = None
+    try:
+        stream(paths, inotify)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
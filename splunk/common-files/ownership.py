@@ -0,0 +1,252 @@
+#! /usr/bin/python
+# Copyright 2018-2021 Splunk
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This script gives SPLUNK_USER:SPLUNK_GROUP ownership of $SPLUNK_HOME (or SPLUNK_OWNERSHIP_PATHS)
+# without a recursive chown of everything. A subtree is skipped when its directory and a sample
+# of the entries below it already have the right owner, unless a volume is mounted inside it.
+# The directories that do need a fix-up are walked by a bounded pool of worker threads. What was
+# checked, changed and skipped is written as JSON to $CONTAINER_ARTIFACT_DIR/ownership.json.
+import os
+import sys
+import grp
+import pwd
+import json
+import stat
+import time
+import socket
+import threading
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+SPLUNK_HOME = os.environ.get("SPLUNK_HOME", "/opt/splunk")
+SPLUNK_USER = os.environ.get("SPLUNK_USER", "splunk")
+SPLUNK_GROUP = os.environ.get("SPLUNK_GROUP", "splunk")
+CONTAINER_ARTIFACT_DIR = os.environ.get("CONTAINER_ARTIFACT_DIR", "/opt/container_artifact")
+REPORT_FILE = os.path.join(CONTAINER_ARTIFACT_DIR, "ownership.json")
+
+PATHS = [path for path in os.environ.get("SPLUNK_OWNERSHIP_PATHS", SPLUNK_HOME).split(",") if path]
+WORKERS = max(1, int(os.environ.get("SPLUNK_OWNERSHIP_WORKERS", 8)))
+# Number of entries to sample below a directory before trusting it, 0 walks everything
+SAMPLE = int(os.environ.get("SPLUNK_OWNERSHIP_SAMPLE", 64))
+MAX_ERRORS = 20
+
+
+def list_dir(path):
+    try:
+        return [os.path.join(path, name) for name in os.listdir(path)]
+    except (IOError, OSError):
+        return []
+
+def mount_parents(mounts_file="/proc/self/mounts"):
+    '''
+    Every directory that has a mount point somewhere below it
+    '''
+    parents = set()
+    try:
+        with open(mounts_file, "r") as f:
+            mounts = [line.split()[1] for line in f if len(line.split()) > 1]
+    except (IOError, OSError):
+        return parents
+    for mount in mounts:
+        # Spaces and other special characters are escaped as octal in the mounts file
+        mount = mount.replace("\\040", " ")
+        parent = os.path.dirname(mount)
+        while parent not in parents and parent != os.path.dirname(parent):
+            parents.add(parent)
+            parent = os.path.dirname(parent)
+    return parents
+
+def is_dir(mode):
+    # Symlinks are never followed, so a link to another volume isn't walked
+    return stat.S_ISDIR(mode) and not stat.S_ISLNK(mode)
+
+
+class Reconciler(object):
+
+    def __init__(self, uid, gid, workers=WORKERS, sample=SAMPLE, mounts=None):
+        self.uid = uid
+        self.gid = gid
+        self.workers = workers
+        self.sample = sample
+        self.mount_parents = mounts if mounts is not None else mount_parents()
+        self.lock = threading.Lock()
+        self.queue = Queue()
+        self.reset()
+
+    def reset(self):
+        self.checked = 0
+        self.changed = 0
+        self.sampled = 0
+        self.skipped = 0
+        self.errors = []
+
+    def count(self, **counters):
+        with self.lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def error(self, path, e):
+        with self.lock:
+            if len(self.errors) < MAX_ERRORS:
+                self.errors.append("{}: {}".format(path, e))
+
+    def matches(self, st):
+        return st.st_uid == self.uid and st.st_gid == self.gid
+
+    def probe(self, path):
+        '''
+        Breadth-first sample of up to `sample` entries below `path`, True if all of them have the right owner
+        '''
+        # Volumes are sampled on their own, a sample from above them could miss them entirely
+        if not self.sample or path in self.mount_parents:
+            return False
+        pending = [path]
+        budget = self.sample
+        while pending and budget > 0:
+            for entry in list_dir(pending.pop(0))[:budget]:
+                budget -= 1
+                try:
+                    st = os.lstat(entry)
+                except (IOError, OSError):
+                    continue
+                if not self.matches(st):
+                    self.count(sampled=self.sample - budget)
+                    return False
+                if is_dir(st.st_mode):
+                    pending.append(entry)
+        self.count(sampled=self.sample - budget)
+        return True
+
+    def fix(self, path, st):
+        if self.matches(st):
+            return
+        try:
+            os.lchown(path, self.uid, self.gid)
+            self.count(changed=1)
+        except (IOError, OSError) as e:
+            self.error(path, e)
+
+    def reconcile_dir(self, path):
+        checked = 0
+        for entry in list_dir(path):
+            try:
+                st = os.lstat(entry)
+            except (IOError, OSError) as e:
+                self.error(entry, e)
+                continue
+            checked += 1
+            if is_dir(st.st_mode):
+                if self.matches(st) and self.probe(entry):
+                    self.count(skipped=1)
+                    continue
+                self.fix(entry, st)
+                self.queue.put(entry)
+            else:
+                self.fix(entry, st)
+        self.count(checked=checked)
+
+    def worker(self):
+        while True:
+            path = self.queue.get()
+            try:
+                if path is None:
+                    return
+                self.reconcile_dir(path)
+            except Exception as e:
+                self.error(path, e)
+            finally:
+                self.queue.task_done()
+
+    def reconcile(self, path):
+        self.reset()
+        start = time.time()
+        result = {"path": path, "exists": os.path.exists(path), "skipped": False}
+        if result["exists"]:
+            st = os.lstat(path)
+            self.count(checked=1)
+            if self.matches(st) and self.probe(path):
+                result["skipped"] = True
+            else:
+                self.fix(path, st)
+                if is_dir(st.st_mode):
+                    self.walk(path)
+        result.update({
+            "seconds": round(time.time() - start, 3),
+            "checked": self.checked,
+            "changed": self.changed,
+            "sampled": self.sampled,
+            "skipped_subtrees": self.skipped,
+            "errors": self.errors
+        })
+        return result
+
+    def walk(self, path):
+        threads = [threading.Thread(target=self.worker) for _ in range(self.workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        self.queue.put(path)
+        # Directories are queued while others are processed, so wait for the queue to drain before stopping the workers
+        self.queue.join()
+        for _ in threads:
+            self.queue.put(None)
+        for thread in threads:
+            thread.join()
+
+
+def main():
+    try:
+        uid = pwd.getpwnam(SPLUNK_USER).pw_uid
+        gid = grp.getgrnam(SPLUNK_GROUP).gr_gid
+    except KeyError as e:
+        print("Unable to reconcile ownership, unknown user or group: {}".format(e))
+        return 1
+    reconciler = Reconciler(uid, gid)
+    start = time.time()
+    results = []
+    for path in PATHS:
+        result = reconciler.reconcile(path)
+        results.append(result)
+        if not result["exists"]:
+            print("Ownership of {}: does not exist".format(path))
+        elif result["skipped"]:
+            print("Ownership of {}: already {}:{} (sampled {} entries in {}s)".format(path, SPLUNK_USER, SPLUNK_GROUP, result["sampled"], result["seconds"]))
+        else:
+            print("Ownership of {}: changed {} of {} entries, skipped {} subtrees in {}s".format(
+                path, result["changed"], result["checked"], result["skipped_subtrees"], result["seconds"]))
+        for error in result["errors"]:
+            print("WARNING: Unable to change ownership of {}".format(error))
+    report = {
+        "hostname": socket.gethostname(),
+        "timestamp": int(time.time()),
+        "user": SPLUNK_USER,
+        "group": SPLUNK_GROUP,
+        "workers": WORKERS,
+        "sample": SAMPLE,
+        "seconds": round(time.time() - start, 3),
+        "paths": results
+    }
+    try:
+        with open(REPORT_FILE, "w") as f:
+            json.dump(report, f, indent=2)
+    except (IOError, OSError) as e:
+        print("WARNING: Unable to write ownership report to {}: {}".format(REPORT_FILE, e))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
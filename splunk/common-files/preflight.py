@@ -0,0 +1,196 @@
+#! /usr/bin/python
+# Copyright 2018-2021 Splunk
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This script checks the host settings that most affect splunkd performance
+# (transparent hugepages, ulimits, CPU quota and volume write throughput)
+# before provisioning starts. The results are written as JSON to
+# $CONTAINER_ARTIFACT_DIR/preflight.json so they can be collected by tooling.
+import os
+import sys
+import json
+import time
+import random
+import socket
+import resource
+
+SPLUNK_HOME = os.environ.get("SPLUNK_HOME", "/opt/splunk")
+CONTAINER_ARTIFACT_DIR = os.environ.get("CONTAINER_ARTIFACT_DIR", "/opt/container_artifact")
+REPORT_FILE = os.path.join(CONTAINER_ARTIFACT_DIR, "preflight.json")
+
+PROBE_DIR = os.environ.get("SPLUNK_PREFLIGHT_PROBE_DIR", os.path.join(SPLUNK_HOME, "var"))
+PROBE_SIZE_MB = int(os.environ.get("SPLUNK_PREFLIGHT_PROBE_SIZE_MB", 64))
+PROBE_RANDOM_WRITES = int(os.environ.get("SPLUNK_PREFLIGHT_PROBE_RANDOM_WRITES", 512))
+PROBE_BLOCK_SIZE = 4096
+
+# Thresholds follow the Splunk Enterprise reference hardware recommendations
+MIN_NOFILE = int(os.environ.get("SPLUNK_PREFLIGHT_MIN_NOFILE", 64000))
+MIN_NPROC = int(os.environ.get("SPLUNK_PREFLIGHT_MIN_NPROC", 16000))
+MIN_CPUS = float(os.environ.get("SPLUNK_PREFLIGHT_MIN_CPUS", 1))
+MIN_SEQ_WRITE_MBPS = float(os.environ.get("SPLUNK_PREFLIGHT_MIN_SEQ_WRITE_MBPS", 100))
+MIN_RANDOM_WRITE_IOPS = float(os.environ.get("SPLUNK_PREFLIGHT_MIN_RANDOM_WRITE_IOPS", 800))
+FAIL_FAST = os.environ.get("SPLUNK_PREFLIGHT_FAIL_FAST", "false").lower() == "true"
+
+PASS = "pass"
+FAIL = "fail"
+SKIP = "skip"
+
+
+def result(name, status, value=None, threshold=None, unit=None, detail=None):
+    return {
+        "name": name,
+        "status": status,
+        "value": value,
+        "threshold": threshold,
+        "unit": unit,
+        "detail": detail
+    }
+
+def read_file(path):
+    with open(path, "r") as f:
+        return f.read().strip()
+
+def check_transparent_hugepages():
+    # The active setting is the one wrapped in brackets, ex. "always madvise [never]"
+    checks = []
+    for setting in ("enabled", "defrag"):
+        name = "transparent_hugepage_{}".format(setting)
+        path = "/sys/kernel/mm/transparent_hugepage/{}".format(setting)
+        try:
+            content = read_file(path)
+        except (IOError, OSError) as e:
+            checks.append(result(name, SKIP, detail=str(e)))
+            continue
+        active = content[content.find("[")+1:content.find("]")] if "[" in content else content
+        status = FAIL if active == "always" else PASS
+        checks.append(result(name, status, value=active, threshold="never", detail=path))
+    return checks
+
+def check_rlimit(name, limit, minimum):
+    soft, _ = resource.getrlimit(limit)
+    if soft == resource.RLIM_INFINITY:
+        return result(name, PASS, value="unlimited", threshold=minimum)
+    return result(name, PASS if soft >= minimum else FAIL, value=soft, threshold=minimum)
+
+def get_cpu_quota():
+    # cgroup v2 exposes "<quota> <period>" in cpu.max, cgroup v1 uses two separate files
+    try:
+        quota, period = read_file("/sys/fs/cgroup/cpu.max").split()
+        if quota != "max":
+            return float(quota) / float(period)
+        return None
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        quota = int(read_file("/sys/fs/cgroup/cpu/cpu.cfs_quota_us"))
+        period = int(read_file("/sys/fs/cgroup/cpu/cpu.cfs_period_us"))
+        if quota > 0 and period > 0:
+            return float(quota) / float(period)
+    except (IOError, OSError, ValueError):
+        pass
+    return None
+
+def check_cpu_quota():
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() if hasattr(os, "cpu_count") else 1
+    quota = get_cpu_quota()
+    effective = min(cpus, quota) if quota else cpus
+    detail = "{} schedulable CPUs, cgroup quota {}".format(cpus, quota if quota else "unlimited")
+    return result("cpu_quota", PASS if effective >= MIN_CPUS else FAIL, value=round(effective, 2),
+                  threshold=MIN_CPUS, unit="cpus", detail=detail)
+
+def check_sequential_write(path):
+    block = os.urandom(1024 * 1024)
+    start = time.time()
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        for _ in range(PROBE_SIZE_MB):
+            os.write(fd, block)
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    elapsed = max(time.time() - start, 1e-6)
+    mbps = round(PROBE_SIZE_MB / elapsed, 2)
+    return result("sequential_write", PASS if mbps >= MIN_SEQ_WRITE_MBPS else FAIL, value=mbps,
+                  threshold=MIN_SEQ_WRITE_MBPS, unit="MB/s", detail="{}MB to {}".format(PROBE_SIZE_MB, PROBE_DIR))
+
+def check_random_write(path):
+    # Reuse the file from the sequential probe so that random writes land on allocated blocks
+    block = os.urandom(PROBE_BLOCK_SIZE)
+    blocks = max((PROBE_SIZE_MB * 1024 * 1024) // PROBE_BLOCK_SIZE, 1)
+    rng = random.Random(0)
+    fd = os.open(path, os.O_WRONLY | getattr(os, "O_DSYNC", os.O_SYNC))
+    start = time.time()
+    try:
+        for _ in range(PROBE_RANDOM_WRITES):
+            os.lseek(fd, rng.randrange(blocks) * PROBE_BLOCK_SIZE, os.SEEK_SET)
+            os.write(fd, block)
+    finally:
+        os.close(fd)
+    elapsed = max(time.time() - start, 1e-6)
+    iops = round(PROBE_RANDOM_WRITES / elapsed, 2)
+    return result("random_write", PASS if iops >= MIN_RANDOM_WRITE_IOPS else FAIL, value=iops,
+                  threshold=MIN_RANDOM_WRITE_IOPS, unit="iops", detail="{} synchronous 4KB writes".format(PROBE_RANDOM_WRITES))
+
+def check_volume():
+    if PROBE_SIZE_MB <= 0:
+        return [result("sequential_write", SKIP, detail="disabled"), result("random_write", SKIP, detail="disabled")]
+    path = os.path.join(PROBE_DIR, ".preflight-probe-{}".format(os.getpid()))
+    try:
+        return [check_sequential_write(path), check_random_write(path)]
+    except (IOError, OSError) as e:
+        return [result("sequential_write", SKIP, detail=str(e)), result("random_write", SKIP, detail=str(e))]
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+def run_checks():
+    checks = check_transparent_hugepages()
+    checks.append(check_rlimit("ulimit_nofile", resource.RLIMIT_NOFILE, MIN_NOFILE))
+    checks.append(check_rlimit("ulimit_nproc", resource.RLIMIT_NPROC, MIN_NPROC))
+    checks.append(check_cpu_quota())
+    checks.extend(check_volume())
+    return checks
+
+def main():
+    checks = run_checks()
+    failed = [check["name"] for check in checks if check["status"] == FAIL]
+    report = {
+        "hostname": socket.gethostname(),
+        "role": os.environ.get("SPLUNK_ROLE"),
+        "timestamp": int(time.time()),
+        "fail_fast": FAIL_FAST,
+        "passed": not failed,
+        "failed": failed,
+        "checks": checks
+    }
+    for check in checks:
+        print("Preflight {}: {} (value: {}, threshold: {})".format(check["name"], check["status"], check["value"], check["threshold"]))
+    try:
+        with open(REPORT_FILE, "w") as f:
+            json.dump(report, f, indent=2)
+    except (IOError, OSError) as e:
+        print("WARNING: Unable to write preflight report to {}: {}".format(REPORT_FILE, e))
+    if failed and FAIL_FAST:
+        print("Preflight checks failed: {}".format(", ".join(failed)))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+#! /usr/bin/python
+# Copyright 2018-2021 Splunk
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This script moves search artifacts (var/run/splunk/dispatch and srtemp by default) off the
+# /opt/splunk/var volume and onto SPLUNK_SCRATCH_DIR, ex. a size-bounded tmpfs, by replacing
+# them with symlinks. `setup` relocates the paths before splunkd starts, or puts them back on the
+# volume when the scratch directory is missing or too small. `watch` runs next to splunkd: when
+# the scratch directory fills past the high watermark, the oldest idle entries are moved back to
+# the volume, with a symlink left in their place so that Splunk can still find them. The state is
+# written as JSON to $CONTAINER_ARTIFACT_DIR/scratch.json.
+import os
+import glob
+import sys
+import json
+import time
+import shutil
+import socket
+
+SPLUNK_HOME = os.environ.get("SPLUNK_HOME", "/opt/splunk")
+CONTAINER_ARTIFACT_DIR = os.environ.get("CONTAINER_ARTIFACT_DIR", "/opt/container_artifact")
+REPORT_FILE = os.path.join(CONTAINER_ARTIFACT_DIR, "scratch.json")
+
+SCRATCH_DIR = os.environ.get("SPLUNK_SCRATCH_DIR")
+SCRATCH_PATHS = [path.strip("/") for path in os.environ.get("SPLUNK_SCRATCH_PATHS", "var/run/splunk/dispatch,var/run/splunk/srtemp").split(",") if path]
+# splunkd refuses to dispatch searches when the dispatch directory has less free space than [diskUsage]
+# minFreeSpace. It is a global setting that also guards the index volumes, so it is only overridden when
+# SPLUNK_SCRATCH_MIN_FREE_MB is set; otherwise the scratch directory has to be sized to fit it.
+MIN_FREE_MB = os.environ.get("SPLUNK_SCRATCH_MIN_FREE_MB")
+SPLUNK_MIN_FREE_MB = 5000
+# Room for search artifacts on top of minFreeSpace, below which the scratch directory isn't used
+HEADROOM_MB = 64
+HIGH_WATERMARK = float(os.environ.get("SPLUNK_SCRATCH_HIGH_WATERMARK", 80))
+LOW_WATERMARK = float(os.environ.get("SPLUNK_SCRATCH_LOW_WATERMARK", 60))
+MIN_AGE = float(os.environ.get("SPLUNK_SCRATCH_MIN_AGE", 60))
+INTERVAL = float(os.environ.get("SPLUNK_SCRATCH_INTERVAL", 10))
+# Entries moved back from the scratch directory are kept next to the original path on the volume
+FALLBACK_SUFFIX = ".volume"
+CONF_APP = os.path.join(SPLUNK_HOME, "etc", "apps", "splunk_scratch")
+
+
+def log(message):
+    sys.stdout.write("{}\n".format(message))
+    sys.stdout.flush()
+
+def usage(path, reserved_mb=0):
+    st = os.statvfs(path)
+    total = st.f_blocks * st.f_frsize
+    free = st.f_bavail * st.f_frsize
+    # Only the space above minFreeSpace can be used for search artifacts
+    usable = total - reserved_mb * 1048576
+    return {
+        "total_mb": round(total / 1048576.0, 1),
+        "free_mb": round(free / 1048576.0, 1),
+        "used_pct": round(100.0 * (total - free) / usable, 1) if usable > 0 else 100.0
+    }
+
+def read_min_free_space():
+    '''
+    [diskUsage] minFreeSpace as configured in etc/system/local or an app's local server.conf, or None
+    '''
+    confs = [os.path.join(SPLUNK_HOME, "etc", "system", "local", "server.conf")]
+    confs += sorted(conf for conf in glob.glob(os.path.join(SPLUNK_HOME, "etc", "apps", "*", "local", "server.conf"))
+                    if not conf.startswith(CONF_APP + os.sep))
+    for conf in confs:
+        stanza, value = None, None
+        try:
+            with open(conf, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if line.startswith("["):
+                        stanza = line.strip("[]").strip()
+                    elif stanza == "diskUsage" and "=" in line:
+                        key, _, raw = line.partition("=")
+                        if key.strip() == "minFreeSpace":
+                            value = raw.strip()
+        except (IOError, OSError):
+            continue
+        if value:
+            return value
+    return None
+
+def min_free_mb(total_mb):
+    '''
+    minFreeSpace in MB that splunkd will apply to the scratch directory
+    '''
+    if MIN_FREE_MB:
+        return int(MIN_FREE_MB)
+    value = read_min_free_space()
+    try:
+        if value and value.endswith("%"):
+            return int(total_mb * float(value[:-1]) / 100)
+        if value:
+            return int(value)
+    except ValueError:
+        log("WARNING: Ignoring minFreeSpace = {}, which is neither a number of MB nor a percentage".format(value))
+    return SPLUNK_MIN_FREE_MB
+
+def filesystem_type(path, mounts_file="/proc/self/mounts"):
+    # The filesystem of the longest mount point that contains `path`
+    path = os.path.realpath(path)
+    best, fstype = "", None
+    try:
+        with open(mounts_file, "r") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount = fields[1].replace("\\040", " ")
+                if (path == mount or path.startswith(mount.rstrip("/") + "/")) and len(mount) > len(best):
+                    best, fstype = mount, fields[2]
+    except (IOError, OSError):
+        pass
+    return fstype
+
+def makedirs(path):
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+def locations(path):
+    '''
+    (persistent, fallback, scratch) locations of a relocated path, ex. var/run/splunk/dispatch
+    '''
+    persistent = os.path.join(SPLUNK_HOME, path)
+    return persistent, persistent + FALLBACK_SUFFIX, os.path.join(SCRATCH_DIR or "", path)
+
+def replace_with_link(target, link):
+    # Renaming a new symlink over the old one swaps them atomically
+    partial = "{}.{}.link".format(link, os.getpid())
+    os.symlink(target, partial)
+    os.rename(partial, link)
+
+def newest_mtime(path):
+    # Splunk updates the files of a running job, not necessarily the job directory itself
+    newest = os.lstat(path).st_mtime
+    if os.path.isdir(path) and not os.path.islink(path):
+        for name in os.listdir(path):
+            try:
+                newest = max(newest, os.lstat(os.path.join(path, name)).st_mtime)
+            except (IOError, OSError):
+                continue
+    return newest
+
+def write_report(report):
+    try:
+        with open(REPORT_FILE, "w") as f:
+            json.dump(report, f, indent=2)
+    except (IOError, OSError) as e:
+        log("WARNING: Unable to write scratch report to {}: {}".format(REPORT_FILE, e))
+
+def write_min_free_space():
+    '''
+    Override minFreeSpace with SPLUNK_SCRATCH_MIN_FREE_MB, or drop the override once the variable is unset
+    '''
+    if not MIN_FREE_MB:
+        if os.path.isdir(CONF_APP):
+            shutil.rmtree(CONF_APP)
+        return
+    makedirs(os.path.join(CONF_APP, "local"))
+    with open(os.path.join(CONF_APP, "local", "server.conf"), "w") as f:
+        f.write("# Written by /sbin/scratch.py for SPLUNK_SCRATCH_MIN_FREE_MB\n[diskUsage]\nminFreeSpace = {}\n".format(int(MIN_FREE_MB)))
+
+def relocate(path):
+    persistent, fallback, scratch = locations(path)
+    makedirs(scratch)
+    makedirs(os.path.dirname(persistent))
+    if os.path.isdir(persistent) and not os.path.islink(persistent):
+        # Artifacts from before the relocation stay on the volume, and are linked from the scratch directory below
+        if not os.path.exists(fallback):
+            os.rename(persistent, fallback)
+        else:
+            for name in os.listdir(persistent):
+                os.rename(os.path.join(persistent, name), os.path.join(fallback, name))
+            os.rmdir(persistent)
+    makedirs(fallback)
+    for name in os.listdir(fallback):
+        link = os.path.join(scratch, name)
+        if not os.path.lexists(link):
+            os.symlink(os.path.join(fallback, name), link)
+    replace_with_link(scratch, persistent)
+
+def restore(path):
+    '''
+    Put a relocated path back on the volume, along with whatever was moved back to it
+    '''
+    persistent, fallback, _ = locations(path)
+    if os.path.islink(persistent):
+        os.unlink(persistent)
+    if os.path.isdir(fallback) and not os.path.exists(persistent):
+        os.rename(fallback, persistent)
+    makedirs(persistent)
+
+def setup():
+    report = {
+        "hostname": socket.gethostname(),
+        "timestamp": int(time.time()),
+        "scratch_dir": SCRATCH_DIR,
+        "paths": SCRATCH_PATHS,
+        "relocated": False,
+        "migrated": 0
+    }
+    reason = None
+    if not SCRATCH_DIR:
+        reason = "SPLUNK_SCRATCH_DIR is not set"
+    elif not os.path.isdir(SCRATCH_DIR) or not os.access(SCRATCH_DIR, os.W_OK):
+        reason = "{} is not a writable directory".format(SCRATCH_DIR)
+    else:
+        report["min_free_mb"] = min_free_mb(usage(SCRATCH_DIR)["total_mb"])
+        report.update(usage(SCRATCH_DIR, report["min_free_mb"]))
+        report["filesystem"] = filesystem_type(SCRATCH_DIR)
+        if report["free_mb"] < report["min_free_mb"] + HEADROOM_MB:
+            reason = "{} has {}MB free, at least {}MB are needed for a minFreeSpace of {}MB".format(
+                SCRATCH_DIR, report["free_mb"], report["min_free_mb"] + HEADROOM_MB, report["min_free_mb"])
+    if reason:
+        for path in SCRATCH_PATHS:
+            restore(path)
+        if os.path.isdir(CONF_APP):
+            shutil.rmtree(CONF_APP)
+        if SCRATCH_DIR:
+            log("WARNING: Keeping {} on the volume, {}".format(", ".join(SCRATCH_PATHS), reason))
+        report["reason"] = reason
+        write_report(report)
+        return 0
+    for path in SCRATCH_PATHS:
+        relocate(path)
+    write_min_free_space()
+    report["relocated"] = True
+    log("Relocated {} to {} ({}, {}MB free)".format(", ".join(SCRATCH_PATHS), SCRATCH_DIR, report["filesystem"], report["free_mb"]))
+    write_report(report)
+    return 0
+
+def idle_entries(now):
+    '''
+    Entries of the scratch directory that haven't changed for MIN_AGE seconds, oldest first
+    '''
+    entries = []
+    for path in SCRATCH_PATHS:
+        _, fallback, scratch = locations(path)
+        for name in os.listdir(scratch):
+            entry = os.path.join(scratch, name)
+            if os.path.islink(entry):
+                continue
+            try:
+                mtime = newest_mtime(entry)
+            except (IOError, OSError):
+                continue
+            if now - mtime >= MIN_AGE:
+                entries.append((mtime, entry, os.path.join(fallback, name)))
+    return sorted(entries)
+
+def migrate(entry, destination):
+    # Copy to the volume first, so that the entry is never missing for longer than two renames
+    partial = "{}.{}.partial".format(destination, os.getpid())
+    if os.path.isdir(entry):
+        shutil.copytree(entry, partial, symlinks=True)
+    else:
+        shutil.copy2(entry, partial)
+    os.rename(partial, destination)
+    stale = "{}.{}.stale".format(entry, os.getpid())
+    os.rename(entry, stale)
+    os.symlink(destination, entry)
+    if os.path.isdir(stale):
+        shutil.rmtree(stale, ignore_errors=True)
+    else:
+        os.unlink(stale)
+
+def reap():
+    '''
+    Remove what Splunk's own reaper left behind: links to deleted entries, and moved entries whose link is gone
+    '''
+    for path in SCRATCH_PATHS:
+        _, fallback, scratch = locations(path)
+        for name in os.listdir(scratch):
+            link = os.path.join(scratch, name)
+            if os.path.islink(link) and not os.path.exists(link):
+                os.unlink(link)
+        for name in os.listdir(fallback):
+            moved = os.path.join(fallback, name)
+            if name.endswith(".partial") or os.path.lexists(os.path.join(scratch, name)):
+                continue
+            if os.path.isdir(moved) and not os.path.islink(moved):
+                shutil.rmtree(moved, ignore_errors=True)
+            else:
+                os.unlink(moved)
+
+def watch():
+    if not SCRATCH_DIR or not os.path.islink(locations(SCRATCH_PATHS[0])[0]):
+        return 0
+    try:
+        with open(REPORT_FILE, "r") as f:
+            report = json.load(f)
+    except (IOError, OSError, ValueError):
+        report = {"scratch_dir": SCRATCH_DIR, "paths": SCRATCH_PATHS, "relocated": True, "migrated": 0}
+    if report.get("min_free_mb") is None:
+        report["min_free_mb"] = min_free_mb(usage(SCRATCH_DIR)["total_mb"])
+    full = False
+    while True:
+        current = usage(SCRATCH_DIR, report["min_free_mb"])
+        if current["used_pct"] >= HIGH_WATERMARK:
+            log("WARNING: {} is {}% full, moving idle entries back to the volume".format(SCRATCH_DIR, current["used_pct"]))
+            for _, entry, destination in idle_entries(time.time()):
+                try:
+                    migrate(entry, destination)
+                    report["migrated"] += 1
+                except (IOError, OSError, shutil.Error) as e:
+                    log("WARNING: Unable to move {} to {}: {}".format(entry, destination, e))
+                current = usage(SCRATCH_DIR, report["min_free_mb"])
+                if current["used_pct"] < LOW_WATERMARK:
+                    break
+            # Running searches can't be moved, so all that's left is to report it once
+            if current["used_pct"] >= HIGH_WATERMARK and not full:
+                log("WARNING: {} is still {}% full, searches may be refused until running jobs finish".format(SCRATCH_DIR, current["used_pct"]))
+            full = current["used_pct"] >= HIGH_WATERMARK
+            report.update(current)
+            report["timestamp"] = int(time.time())
+            write_report(report)
+        else:
+            full = False
+        try:
+            reap()
+        except (IOError, OSError) as e:
+            log("WARNING: Unable to clean up {}: {}".format(SCRATCH_DIR, e))
+        time.sleep(INTERVAL)
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "setup"
+    if command == "setup":
+        return setup()
+    if command == "watch":
+        return watch()
+    log("Usage: {} setup|watch".format(sys.argv[0]))
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,428 @@
+#! /usr/bin/python
+# Copyright 2018-2021 Splunk
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# This script is an optional PID 1 for the container, enabled with SPLUNK_SUPERVISOR=true.
+# It runs the same commands as entrypoint.sh, but it also reaps orphaned processes, runs the
+# independent pre-start phases concurrently and bounds how long a container stop can take.
+# The duration of every phase is written as JSON to $CONTAINER_ARTIFACT_DIR/supervisor.json.
+import os
+import sys
+import pwd
+import json
+import time
+import errno
+import shlex
+import signal
+import threading
+import subprocess
+try:
+    from urllib.request import urlopen
+    from urllib.parse import urlparse
+except ImportError:
+    from urllib2 import urlopen
+    from urlparse import urlparse
+
+SPLUNK_HOME = os.environ.get("SPLUNK_HOME", "/opt/splunk")
+SPLUNK_USER = os.environ.get("SPLUNK_USER", "splunk")
+SPLUNK_ANSIBLE_HOME = os.environ.get("SPLUNK_ANSIBLE_HOME", "/opt/ansible")
+CONTAINER_ARTIFACT_DIR = os.environ.get("CONTAINER_ARTIFACT_DIR", "/opt/container_artifact")
+STATE_FILE = os.path.join(CONTAINER_ARTIFACT_DIR, "splunk-container.state")
+REPORT_FILE = os.path.join(CONTAINER_ARTIFACT_DIR, "supervisor.json")
+ENTRYPOINT = "/sbin/entrypoint.sh"
+
+# Kubernetes waits 30 seconds by default before it sends SIGKILL, so stop a bit earlier than that
+STOP_TIMEOUT = float(os.environ.get("SPLUNK_SUPERVISOR_STOP_TIMEOUT", 25))
+# Part of the stop timeout that a drain can't use, so that splunk stop always gets to run
+STOP_RESERVE = float(os.environ.get("SPLUNK_SUPERVISOR_STOP_RESERVE", 15))
+PREFETCH_APPS = os.environ.get("SPLUNK_SUPERVISOR_PREFETCH_APPS", "true").lower() == "true"
+APPS_CACHE_DIR = os.environ.get("SPLUNK_SUPERVISOR_APPS_DIR", "/tmp/supervisor-apps")
+DOWNLOAD_TIMEOUT = 120
+POLL_INTERVAL = 0.1
+
+
+class StopRequested(Exception):
+    pass
+
+
+def log(message):
+    sys.stdout.write("{}\n".format(message))
+    sys.stdout.flush()
+
+def whoami():
+    return pwd.getpwuid(os.getuid()).pw_name
+
+def as_splunk(args, preserve_env=False):
+    # Same as RUN_AS_SPLUNK in entrypoint.sh
+    if whoami() == SPLUNK_USER:
+        return args
+    return ["sudo"] + (["-E"] if preserve_env else []) + ["-u", SPLUNK_USER] + args
+
+def enable_task_profile(env):
+    # Same as prep_ansible in entrypoint.sh, which can't export into the supervisor's environment
+    for key in ("ANSIBLE_CALLBACK_WHITELIST", "ANSIBLE_CALLBACKS_ENABLED"):
+        env[key] = ",".join(["task_profile"] + ([env[key]] if env.get(key) else []))
+
+def write_state(state):
+    with open(STATE_FILE, "w") as f:
+        f.write("{}\n".format(state))
+
+def exit_code(status):
+    if os.WIFSIGNALED(status):
+        return 128 + os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+def prefetch_apps(env):
+    '''
+    Download the apps in SPLUNK_APPS_URL in parallel and point Ansible at the local copies instead. Splunkbase
+    links need the Splunkbase credentials, so those and any app that fails to download are left to Ansible.
+    '''
+    urls = [url.strip() for url in env.get("SPLUNK_APPS_URL", "").split(",") if url.strip()]
+    if not urls:
+        return 0
+    if not os.path.isdir(APPS_CACHE_DIR):
+        os.makedirs(APPS_CACHE_DIR)
+    os.chmod(APPS_CACHE_DIR, 0o755)
+    resolved = list(urls)
+    failed = []
+    def download(index, url):
+        parsed = urlparse(url)
+        if parsed.scheme not in ("http", "https") or "splunkbase.splunk.com" in parsed.netloc:
+            return
+        path = os.path.join(APPS_CACHE_DIR, "{}-{}".format(index, os.path.basename(parsed.path) or "app.tgz"))
+        try:
+            resp = urlopen(url, timeout=DOWNLOAD_TIMEOUT)
+            with open(path, "wb") as f:
+                while True:
+                    data = resp.read(1024 * 1024)
+                    if not data:
+                        break
+                    f.write(data)
+            os.chmod(path, 0o644)
+            resolved[index] = path
+        except Exception as e:
+            failed.append(url)
+            log("WARNING: Unable to prefetch {}, leaving it to Ansible: {}".format(url, e))
+    threads = [threading.Thread(target=download, args=(n, url)) for n, url in enumerate(urls)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    env["SPLUNK_APPS_URL"] = ",".join(resolved)
+    return 1 if failed else 0
+
+
+class Supervisor(object):
+    """
+    Runs the phases of one entrypoint command as child processes, reaping every process that exits
+    (including orphans re-parented to PID 1) and recording how long each phase took.
+    """
+
+    def __init__(self, command):
+        self.command = command
+        self.env = dict(os.environ)
+        self.children = {}
+        self.exited = {}
+        self.phases = []
+        self.shutdown_report = None
+        self.stop_requested = None
+        self.provisioning = command != "create-defaults"
+        if self.env.get("SPLUNK_ANSIBLE_PROFILE") == "true":
+            enable_task_profile(self.env)
+
+    def handle_signal(self, signum, frame):
+        if self.stop_requested is None:
+            log("Supervisor received signal {}, stopping".format(signum))
+            self.stop_requested = time.time()
+
+    def spawn(self, args, cwd=None, env=None, own_group=False):
+        # A child in its own process group can be killed along with everything it started
+        proc = subprocess.Popen(args, cwd=cwd, env=env or self.env, preexec_fn=os.setpgrp if own_group else None)
+        self.children[proc.pid] = args
+        return proc.pid
+
+    def reap(self):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as e:
+                if e.errno == errno.ECHILD:
+                    return
+                raise
+            if pid == 0:
+                return
+            if pid in self.children:
+                self.exited[pid] = exit_code(status)
+
+    def wait(self, pids, deadline=None, interruptible=True):
+        '''
+        Wait for child processes to exit while reaping anything else that exits. Returns False if the deadline passed first.
+        '''
+        while any(pid not in self.exited for pid in pids):
+            if deadline is not None and time.time() >= deadline:
+                return False
+            self.tick(interruptible)
+        return True
+
+    def tick(self, interruptible=True):
+        if interruptible and self.stop_requested is not None:
+            raise StopRequested()
+        self.reap()
+        time.sleep(POLL_INTERVAL)
+
+    def record(self, name, start, rc):
+        end = time.time()
+        self.phases.append({"name": name, "start": round(start, 3), "end": round(end, 3), "seconds": round(end - start, 3), "rc": rc})
+        log("Supervisor phase {} finished in {:.2f}s (rc: {})".format(name, end - start, rc))
+        self.write_report()
+
+    def write_report(self):
+        report = {
+            "command": self.command,
+            "pid": os.getpid(),
+            "phases": self.phases,
+            "shutdown": self.shutdown_report
+        }
+        try:
+            with open(REPORT_FILE, "w") as f:
+                json.dump(report, f, indent=2)
+        except (IOError, OSError) as e:
+            log("WARNING: Unable to write supervisor report to {}: {}".format(REPORT_FILE, e))
+
+    def run_phases(self, phases):
+        '''
+        Run (name, target, required) phases concurrently. A target is either a command line, run as a child
+        process, or a callable run in a thread. Fails if any required phase fails.
+        '''
+        running = []
+        for name, target, required in phases:
+            # Each phase is timed from its own start, so the report shows how much they overlapped
+            start = time.time()
+            if callable(target):
+                result = {}
+                thread = threading.Thread(target=lambda t=target, r=result: r.update(rc=t()))
+                thread.daemon = True
+                thread.start()
+                running.append((name, required, start, None, thread, result))
+            else:
+                running.append((name, required, start, self.spawn(target, cwd=SPLUNK_ANSIBLE_HOME), None, None))
+        pending = list(running)
+        while pending:
+            for phase in list(pending):
+                name, required, start, pid, thread, result = phase
+                if pid is not None and pid in self.exited:
+                    rc = self.exited[pid]
+                elif thread is not None and not thread.is_alive():
+                    rc = result.get("rc", 1)
+                else:
+                    continue
+                pending.remove(phase)
+                self.record(name, start, rc)
+                if rc != 0 and required:
+                    raise RuntimeError("Phase {} failed with rc {}".format(name, rc))
+                if rc != 0:
+                    log("WARNING: Phase {} failed with rc {}, continuing".format(name, rc))
+            if pending:
+                self.tick()
+
+    def run_phase(self, name, args, cwd=SPLUNK_ANSIBLE_HOME):
+        start = time.time()
+        pid = self.spawn(args, cwd=cwd)
+        self.wait([pid])
+        self.record(name, start, self.exited[pid])
+        return self.exited[pid]
+
+    def setup(self):
+        if "--accept-license" not in self.env.get("SPLUNK_START_ARGS", ""):
+            log("License not accepted, please ensure the environment variable SPLUNK_START_ARGS contains the '--accept-license' flag")
+            log("For example: docker run -e SPLUNK_START_ARGS=--accept-license -e SPLUNK_PASSWORD splunk/splunk\n")
+            log("For additional information and examples, see the help: docker run -it splunk/splunk help")
+            return False
+        return True
+
+    def prestart_phases(self):
+        phases = [("prep_ansible", [ENTRYPOINT, "prep-ansible"], True)]
+        if os.path.exists("/sbin/updateetc.sh"):
+            phases.append(("seed_etc", as_splunk(["/sbin/updateetc.sh"], preserve_env=True), False))
+        if self.env.get("SPLUNK_PREFLIGHT") == "true":
+            phases.append(("preflight", [ENTRYPOINT, "preflight"], True))
+        if PREFETCH_APPS and self.env.get("SPLUNK_APPS_URL"):
+            phases.append(("prefetch_apps", lambda: prefetch_apps(self.env), False))
+        return phases
+
+    def playbook(self, playbook, extra_flags=True):
+        args = ["ansible-playbook"]
+        if extra_flags:
+            args += shlex.split(self.env.get("ANSIBLE_EXTRA_FLAGS", ""))
+        args += ["-i", "inventory/environ.py", "-l", "localhost", playbook]
+        rc = self.run_phase("ansible_{}".format(playbook.replace(".yml", "")), args)
+        if rc != 0:
+            raise RuntimeError("ansible-playbook {} failed with rc {}".format(playbook, rc))
+
+    def start_and_exit(self):
+        if not self.env.get("SPLUNK_PASSWORD"):
+            log("WARNING: No password ENV var.  Stack may fail to provision if splunk.password is not set in ENV or a default.yml")
+        write_state("starting")
+        if not self.setup():
+            return 1
+        self.skip_bundled_java()
+        # Ownership is fixed before any of the pre-start phases start writing to SPLUNK_HOME
+        if self.env.get("SPLUNK_OWNERSHIP_RECONCILE") == "true":
+            rc = self.run_phase("reconcile_ownership", [ENTRYPOINT, "reconcile-ownership"])
+            if rc != 0:
+                raise RuntimeError("Phase reconcile_ownership failed with rc {}".format(rc))
+        self.run_phases(self.prestart_phases())
+        # The scratch setup reads minFreeSpace from etc and may write an app to it, so it waits for seed_etc
+        if self.env.get("SPLUNK_SCRATCH_DIR") or os.path.islink(os.path.join(SPLUNK_HOME, "var", "run", "splunk", "dispatch")):
+            self.run_phases([("relocate_scratch", [ENTRYPOINT, "relocate-scratch"], False)])
+        self.playbook("site.yml")
+        return 0
+
+    def skip_bundled_java(self):
+        # Same as skip_bundled_java in entrypoint.sh
+        java_version = self.env.get("JAVA_VERSION")
+        java_home = self.env.get("JAVA_HOME", "/opt/java")
+        if java_version and java_version == self.env.get("SPLUNK_BUNDLED_JAVA") and os.access(os.path.join(java_home, "bin", "java"), os.X_OK):
+            log("Java {} is preinstalled in {}, skipping its installation".format(java_version, java_home))
+            self.env.pop("JAVA_VERSION")
+
+    def user_permission_change(self):
+        if self.env.get("STEPDOWN_ANSIBLE_USER") == "true":
+            self.run_phase("stepdown_ansible_user", ["sudo", "deluser", "-q", "ansible", "sudo"])
+
+    def watch_for_failure(self):
+        write_state("started")
+        log("===============================================================================")
+        log("")
+        self.user_permission_change()
+        if self.env.get("SPLUNK_SCRATCH_DIR"):
+            self.spawn(as_splunk(["/sbin/scratch.py", "watch"], preserve_env=True))
+        # Any crashes/errors while Splunk is running should get logged to splunkd_stderr.log and sent to the container's stdout
+        if self.env.get("SPLUNK_LOG_STREAMER") == "true":
+            log("Ansible playbook complete, will begin streaming {}".format(self.env.get("SPLUNK_LOG_STREAMER_FILES") or self.env.get("SPLUNK_TAIL_FILE") or "splunkd_stderr.log"))
+            pid = self.spawn(as_splunk(["/sbin/logstream.py"], preserve_env=True))
+        else:
+            tail_file = self.env.get("SPLUNK_TAIL_FILE") or os.path.join(SPLUNK_HOME, "var", "log", "splunk", "splunkd_stderr.log")
+            log("Ansible playbook complete, will begin streaming {}".format(self.env.get("SPLUNK_TAIL_FILE") or "splunkd_stderr.log"))
+            pid = self.spawn(as_splunk(["tail", "-n", "0", "-F", tail_file]))
+        self.wait([pid])
+        return self.exited[pid]
+
+    def restart(self):
+        write_state("restarting")
+        self.run_phases([("prep_ansible", [ENTRYPOINT, "prep-ansible"], True),
+                         ("splunk_stop", [os.path.join(SPLUNK_HOME, "bin", "splunk"), "stop"], False)])
+        self.playbook("start.yml", extra_flags=False)
+        return self.watch_for_failure()
+
+    def no_provision(self):
+        self.user_permission_change()
+        while True:
+            self.tick()
+
+    def shutdown(self):
+        '''
+        Stop splunkd within STOP_TIMEOUT seconds of the signal. If splunk stop takes longer, everything left is killed
+        so that the container exits on our terms rather than on the orchestrator's SIGKILL.
+        '''
+        start = self.stop_requested or time.time()
+        deadline = start + STOP_TIMEOUT
+        for pid in self.children:
+            if pid not in self.exited:
+                try:
+                    os.kill(pid, signal.SIGTERM)
+                except OSError:
+                    pass
+        if self.provisioning and self.env.get("SPLUNK_DRAIN_ON_STOP") == "true":
+            self.drain(deadline - min(STOP_RESERVE, STOP_TIMEOUT / 2))
+        if self.provisioning:
+            try:
+                stop_pid = self.spawn(as_splunk([os.path.join(SPLUNK_HOME, "bin", "splunk"), "stop"]))
+                stopped = self.wait([stop_pid], deadline=deadline, interruptible=False) and self.exited[stop_pid] == 0
+            except OSError as e:
+                log("WARNING: Unable to run splunk stop: {}".format(e))
+                stopped = False
+        else:
+            stopped = self.wait([pid for pid in self.children], deadline=deadline, interruptible=False)
+        if not stopped:
+            log("WARNING: splunk stop did not finish cleanly within {}s, killing the remaining processes".format(STOP_TIMEOUT))
+            for pid in self.children:
+                if pid not in self.exited:
+                    try:
+                        os.kill(pid, signal.SIGKILL)
+                    except OSError:
+                        pass
+        self.shutdown_report = {
+            "seconds": round(time.time() - start, 3),
+            "timeout": STOP_TIMEOUT,
+            "clean": stopped
+        }
+        log("Supervisor shutdown finished in {:.2f}s (clean: {})".format(self.shutdown_report["seconds"], self.shutdown_report["clean"]))
+        self.write_report()
+        return 0 if self.shutdown_report["clean"] else 1
+
+    def drain(self, deadline):
+        '''
+        Take the indexer peer offline, giving up at `deadline` so that the rest of the stop timeout is left for splunk stop
+        '''
+        drain_start = time.time()
+        budget = int(min(float(self.env.get("SPLUNK_DRAIN_TIMEOUT", 180)), deadline - drain_start))
+        if budget <= 0:
+            log("WARNING: Skipping drain, SPLUNK_SUPERVISOR_STOP_TIMEOUT leaves no time for it")
+            return
+        env = dict(self.env)
+        env["SPLUNK_DRAIN_TIMEOUT"] = str(budget)
+        drain_pid = self.spawn([ENTRYPOINT, "drain"], env=env, own_group=True)
+        if self.wait([drain_pid], deadline=deadline, interruptible=False):
+            self.record("drain", drain_start, self.exited[drain_pid])
+            return
+        log("WARNING: Drain did not finish within {}s, stopping anyway".format(budget))
+        try:
+            os.killpg(drain_pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.record("drain", drain_start, None)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.handle_signal)
+        signal.signal(signal.SIGINT, self.handle_signal)
+        try:
+            if self.command in ("start", "start-service"):
+                rc = self.start_and_exit()
+                return self.watch_for_failure() if rc == 0 else rc
+            if self.command == "start-and-exit":
+                return self.start_and_exit()
+            if self.command == "restart":
+                return self.restart()
+            if self.command == "no-provision":
+                return self.no_provision()
+            if self.command == "create-defaults":
+                return self.run_phase("create_defaults", ["createdefaults.py"], cwd=None)
+            log("Unsupported supervisor command {}".format(self.command))
+            return 1
+        except StopRequested:
+            return self.shutdown()
+        except RuntimeError as e:
+            log(str(e))
+            return 1
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "start-service"
+    return Supervisor(command).run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
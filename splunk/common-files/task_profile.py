@@ -0,0 +1,117 @@
+# Copyright 2018-2021 Splunk
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Ansible callback plugin that records how long every task of a playbook run took, and writes
+# them as JSON to $CONTAINER_ARTIFACT_DIR/ansible_task_profile_<playbook>.json when the run ends.
+# It is installed next to the playbooks and enabled by the entrypoint with SPLUNK_ANSIBLE_PROFILE=true.
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import json
+import time
+
+from ansible.plugins.callback import CallbackBase
+
+DOCUMENTATION = '''
+    callback: task_profile
+    type: aggregate
+    short_description: Writes per-task timings to a JSON file
+    description:
+      - Records the wall clock time of every task and handler, along with its role and result,
+        and writes them to $CONTAINER_ARTIFACT_DIR/ansible_task_profile_<playbook>.json.
+    requirements:
+      - enable in configuration
+'''
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = "aggregate"
+    CALLBACK_NAME = "task_profile"
+    CALLBACK_NEEDS_WHITELIST = True
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self):
+        super(CallbackModule, self).__init__()
+        self.output_dir = os.environ.get("CONTAINER_ARTIFACT_DIR", "/opt/container_artifact")
+        self.playbook = None
+        self.started = time.time()
+        self.tasks = []
+        self.current = None
+
+    def v2_playbook_on_start(self, playbook):
+        self.playbook = os.path.basename(playbook._file_name)
+        self.started = time.time()
+
+    def start_task(self, task, handler=False):
+        self.finish_task()
+        role = task._role.get_name() if task._role else None
+        self.current = {
+            "name": task.get_name(),
+            "role": role,
+            "action": task.action,
+            "handler": handler,
+            "status": "ok",
+            "start": time.time()
+        }
+
+    def finish_task(self):
+        # A task runs until the next one starts, which includes the time spent on every host
+        if self.current:
+            self.current["seconds"] = round(time.time() - self.current.pop("start"), 3)
+            self.tasks.append(self.current)
+            self.current = None
+
+    def set_status(self, status):
+        # Failures win over skips, which win over a plain ok
+        if self.current and (status == "failed" or self.current["status"] == "ok"):
+            self.current["status"] = status
+
+    def v2_playbook_on_task_start(self, task, is_conditional):
+        self.start_task(task)
+
+    def v2_playbook_on_handler_task_start(self, task):
+        self.start_task(task, handler=True)
+
+    def v2_runner_on_ok(self, result):
+        if result._result.get("changed"):
+            self.set_status("changed")
+
+    def v2_runner_on_skipped(self, result):
+        self.set_status("skipped")
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self.set_status("ignored" if ignore_errors else "failed")
+
+    def v2_runner_on_unreachable(self, result):
+        self.set_status("failed")
+
+    def v2_playbook_on_stats(self, stats):
+        self.finish_task()
+        playbook = self.playbook or "playbook.yml"
+        profile = {
+            "playbook": playbook,
+            "splunk_role": os.environ.get("SPLUNK_ROLE"),
+            "hostname": os.environ.get("HOSTNAME"),
+            "started": round(self.started, 3),
+            "seconds": round(time.time() - self.started, 3),
+            "tasks": self.tasks
+        }
+        path = os.path.join(self.output_dir, "ansible_task_profile_{}.json".format(os.path.splitext(playbook)[0]))
+        try:
+            with open(path, "w") as f:
+                f.write(json.dumps(profile, sort_keys=True) + "\n")
+        except (IOError, OSError) as e:
+            self._display.warning("Unable to write the task profile to {}: {}".format(path, e))
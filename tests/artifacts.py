@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import stat
+import tarfile
+import hashlib
+import logging
+import threading
+
+
+LOGGER = logging.getLogger("docker-splunk")
+
+
+def tree_hash(path):
+    '''
+    Content hash of a directory: relative paths, executable bits and file contents, in a stable order
+    '''
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full_path = os.path.join(root, name)
+            relative = os.path.relpath(full_path, path).replace(os.sep, "/")
+            mode = os.stat(full_path).st_mode
+            digest.update("{}\0{}\0".format(relative, int(bool(mode & stat.S_IXUSR))).encode("utf-8"))
+            with open(full_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+            digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class ArtifactCache(object):
+    """
+    Packages app directories into tarballs once, keyed by a content hash of the directory. Artifacts are kept
+    under `root` across sessions and are shared by pytest-xdist workers; a tarball is written under a temporary
+    name and renamed into place, so readers never see a partial file.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        self.hashes = {}
+        self.hits = 0
+        self.builds = 0
+
+    def package(self, path):
+        '''
+        Path to a .tgz of the directory `path`, with the directory as its single top-level entry
+        '''
+        name = os.path.basename(os.path.normpath(path))
+        with self.lock:
+            # Fixture directories don't change during a session, so each one is hashed only once
+            if path not in self.hashes:
+                self.hashes[path] = tree_hash(path)
+            directory = os.path.join(self.root, self.hashes[path])
+            artifact = os.path.join(directory, "{}.tgz".format(name))
+            if os.path.isfile(artifact):
+                self.hits += 1
+                return artifact
+            if not os.path.isdir(directory):
+                try:
+                    os.makedirs(directory)
+                except OSError:
+                    # Another worker created it first
+                    pass
+            partial = "{}.{}.partial".format(artifact, os.getpid())
+            with tarfile.open(partial, "w:gz") as tar:
+                tar.add(path, arcname=name)
+            # Tarballs are mounted into containers and served by the appserver, which run as other users
+            os.chmod(partial, 0o644)
+            os.rename(partial, artifact)
+            self.builds += 1
+            LOGGER.info("Packaged {} into {}".format(path, artifact))
+            return artifact
+
+    def summary(self):
+        return {"artifacts_built": self.builds, "artifacts_reused": self.hits}
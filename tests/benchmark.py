@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import sys
+import json
+import time
+import math
+import argparse
+
+
+FILE_DIR = os.path.dirname(os.path.normpath(os.path.join(__file__)))
+RESULTS_DIR = os.path.join(FILE_DIR, "..", "test-results", "benchmarks")
+PERCENTILES = [50, 90, 99]
+
+
+def percentile(values, pct):
+    '''
+    Percentile with linear interpolation between the closest ranks
+    '''
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low, high = int(math.floor(rank)), int(math.ceil(rank))
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+def summarize(values, digits=3):
+    if not values:
+        return {"n": 0}
+    mean = sum(values) / float(len(values))
+    summary = {
+        "n": len(values),
+        "min": round(min(values), digits),
+        "max": round(max(values), digits),
+        "mean": round(mean, digits),
+        "stdev": round(math.sqrt(sum((value - mean) ** 2 for value in values) / len(values)), digits)
+    }
+    for pct in PERCENTILES:
+        summary["p{}".format(pct)] = round(percentile(values, pct), digits)
+    return summary
+
+
+class BenchmarkStore(object):
+    """
+    Append-only store of benchmark runs, one JSON file per suite under test-results/benchmarks/.
+    Every run is tagged with the image it measured so results can be compared across image builds.
+    """
+
+    def __init__(self, suite, results_dir=RESULTS_DIR):
+        self.suite = suite
+        self.path = os.path.join(results_dir, "{}.json".format(suite))
+        if not os.path.isdir(results_dir):
+            os.makedirs(results_dir)
+
+    def load(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return []
+
+    def record(self, case, image, samples, unit="seconds", **extra):
+        '''
+        Store the raw samples of a benchmark case along with their summary and return the new entry
+        '''
+        entry = {
+            "suite": self.suite,
+            "case": case,
+            "timestamp": int(time.time()),
+            "image": image.get("name"),
+            "image_id": image.get("id"),
+            "image_created": image.get("created"),
+            "unit": unit,
+            "samples": [round(sample, 3) for sample in samples],
+            "summary": summarize(samples)
+        }
+        entry.update(extra)
+        runs = self.load()
+        runs.append(entry)
+        with open(self.path, "w") as f:
+            json.dump(runs, f, indent=2, sort_keys=True)
+        return entry
+
+    def baseline(self, case, image_id):
+        '''
+        Most recent run of the same case against a different image build, if any
+        '''
+        for entry in reversed(self.load()):
+            if entry["case"] == case and entry.get("image_id") != image_id:
+                return entry
+        return None
+
+
+def compare(entry, baseline, stat="p50"):
+    '''
+    Relative change of a summary statistic against the baseline run, ex. 0.1 means 10% higher
+    '''
+    if not baseline or not baseline["summary"].get(stat):
+        return None
+    return (entry["summary"][stat] - baseline["summary"][stat]) / float(baseline["summary"][stat])
+
+def report(path, stat="p50"):
+    '''
+    Print the latest result of every case per image, so builds can be compared side by side
+    '''
+    latest = {}
+    with open(path, "r") as f:
+        for entry in json.load(f):
+            latest[(entry["case"], entry["image"], entry.get("image_id"))] = entry
+    print("{:<48} {:<32} {:<14} {:>12} {:>12} {:>6}".format("case", "image", "image_id", stat, "p99", "n"))
+    for (case, image, image_id), entry in sorted(latest.items(), key=lambda item: (item[0][0], item[1]["timestamp"])):
+        print("{:<48} {:<32} {:<14} {:>12} {:>12} {:>6}".format(case, image, (image_id or "")[7:19], entry["summary"].get(stat),
+                                                              entry["summary"].get("p99"), entry["summary"]["n"]))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare stored benchmark results across image builds")
+    parser.add_argument("results", nargs="+", help="Benchmark result files, ex. test-results/benchmarks/startup.json")
+    parser.add_argument("--stat", default="p50", help="Summary statistic to compare (default: p50)")
+    args = parser.parse_args()
+    for path in args.results:
+        print(path)
+        report(path, args.stat)
+        print("")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,312 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import re
+import time
+import shlex
+import logging
+import threading
+import yaml
+import docker
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+LOGGER = logging.getLogger("docker-splunk")
+
+# ${VAR}, ${VAR:-default}, ${VAR-default} and $VAR, as interpolated by docker-compose
+VARIABLE_PATTERN = re.compile(r"\$(?:\{(?P<braced>[A-Za-z_][A-Za-z0-9_]*)(?:(?P<sep>:?-)(?P<default>[^}]*))?\}|(?P<bare>[A-Za-z_][A-Za-z0-9_]*)|(?P<escaped>\$))")
+DEFAULT_NETWORK = "default"
+# Service keys start_service() knows how to apply; anything else would be silently dropped
+SUPPORTED_SERVICE_KEYS = set(["image", "container_name", "hostname", "command", "entrypoint", "environment", "ports",
+                              "volumes", "tmpfs", "networks", "depends_on", "init", "tty"])
+# Scenarios parsed by load_scenario(), keyed by path and invalidated when the file changes
+_SCENARIOS = {}
+_SCENARIOS_LOCK = threading.Lock()
+
+
+def load_scenario(filename):
+    '''
+    Parse a compose file once; later calls for the same unchanged file return the cached definition
+    '''
+    path = os.path.abspath(filename)
+    mtime = os.path.getmtime(path)
+    with _SCENARIOS_LOCK:
+        cached = _SCENARIOS.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+    with open(path, "r") as f:
+        yml = yaml.load(f, Loader=yaml.Loader)
+    with _SCENARIOS_LOCK:
+        _SCENARIOS[path] = (mtime, yml)
+    return yml
+
+def interpolate(value, env):
+    if isinstance(value, dict):
+        return dict((k, interpolate(v, env)) for k, v in value.items())
+    if isinstance(value, list):
+        return [interpolate(v, env) for v in value]
+    if not isinstance(value, string_types):
+        return value
+    def replace(match):
+        if match.group("escaped"):
+            return "$"
+        name = match.group("braced") or match.group("bare")
+        current = env.get(name)
+        if match.group("sep") == ":-" and not current:
+            return match.group("default")
+        if match.group("sep") == "-" and current is None:
+            return match.group("default")
+        return current or ""
+    return VARIABLE_PATTERN.sub(replace, value)
+
+def parse_environment(environment, env):
+    '''
+    Compose environment (list or mapping) as a list of KEY=value; keys without a value are taken from `env`
+    '''
+    if isinstance(environment, dict):
+        items = [(k, v) for k, v in environment.items()]
+    else:
+        items = [tuple(item.split("=", 1)) if "=" in item else (item, None) for item in (environment or [])]
+    result = []
+    for key, value in items:
+        if value is None:
+            if key not in env:
+                continue
+            value = env[key]
+        result.append("{}={}".format(key, "" if value is None else value))
+    return result
+
+def parse_port(port):
+    '''
+    "8089", "8089/udp", "8000:8000" or "127.0.0.1:8000:8000" as (container port, host binding)
+    '''
+    parts = str(port).split(":")
+    container = parts[-1]
+    if "/" in container:
+        number, protocol = container.split("/", 1)
+        container = (int(number), protocol)
+    else:
+        container = int(container)
+    if len(parts) == 1:
+        return container, None
+    if len(parts) == 2:
+        return container, int(parts[0]) if parts[0] else None
+    return container, (parts[0], int(parts[1])) if parts[1] else (parts[0],)
+
+def dependency_layers(services):
+    '''
+    Group services so that each one comes after everything in its depends_on
+    '''
+    # Dependencies outside of `services` are expected to be up already
+    remaining = dict((name, set(definition.get("depends_on") or []) & set(services)) for name, definition in services.items())
+    layers, done = [], set()
+    while remaining:
+        layer = sorted(name for name, deps in remaining.items() if deps <= done)
+        if not layer:
+            raise ValueError("Circular depends_on between services: {}".format(", ".join(sorted(remaining))))
+        layers.append(layer)
+        done.update(layer)
+        for name in layer:
+            remaining.pop(name)
+    return layers
+
+def run_concurrently(target, items):
+    '''
+    Call target(item) for every item on its own thread and raise the first error once they all finished
+    '''
+    errors = []
+    def call(item):
+        try:
+            target(item)
+        except Exception as e:
+            errors.append((item, e))
+    threads = [threading.Thread(target=call, args=(item,)) for item in items]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        item, e = errors[0]
+        raise RuntimeError("{} failed: {}".format(item, e))
+
+
+class ComposeEngine(object):
+    """
+    In-process replacement for `docker-compose up -d` on the scenarios in test_scenarios/. The compose file is
+    parsed once, and networks, volumes and containers are created concurrently through the Docker API client.
+    Resources get the same names and com.docker.compose.* labels docker-compose would give them, so that
+    label lookups and `docker-compose down` keep working on the stack.
+    """
+
+    def __init__(self, client, project_name, filename, env=None, extra_environment=None):
+        self.client = client
+        self.project_name = project_name
+        self.filename = filename
+        self.directory = os.path.dirname(os.path.abspath(filename))
+        self.env = env if env is not None else dict(os.environ)
+        # Set in every service on top of what the compose file lists, like a docker-compose override file
+        self.extra_environment = extra_environment or {}
+        self.scenario = interpolate(load_scenario(filename), self.env)
+        self.services = self.scenario.get("services") or {}
+        self.validate()
+        # Service name to container ID, filled in by up()
+        self.containers = {}
+        self.timings = {}
+        self.lock = threading.Lock()
+
+    def validate(self):
+        unsupported = []
+        for service, definition in sorted(self.services.items()):
+            keys = sorted(set(definition or {}) - SUPPORTED_SERVICE_KEYS)
+            if keys:
+                unsupported.append("{} ({})".format(service, ", ".join(keys)))
+        if unsupported:
+            raise ValueError("{} uses service keys the compose engine doesn't support, run it with --compose-engine cli: {}".format(
+                os.path.basename(self.filename), "; ".join(unsupported)))
+
+    def labels(self, **extra):
+        labels = {"com.docker.compose.project": self.project_name}
+        labels.update(("com.docker.compose.{}".format(key.replace("_", "-")), value) for key, value in extra.items())
+        return labels
+
+    def network_name(self, network):
+        definition = (self.scenario.get("networks") or {}).get(network) or {}
+        return definition.get("name") or "{}_{}".format(self.project_name, network)
+
+    def volume_name(self, volume):
+        definition = (self.scenario.get("volumes") or {}).get(volume) or {}
+        return definition.get("name") or "{}_{}".format(self.project_name, volume)
+
+    def container_name(self, service):
+        return self.services[service].get("container_name") or "{}_{}_1".format(self.project_name, service)
+
+    def service_networks(self, service):
+        networks = self.services[service].get("networks") or [DEFAULT_NETWORK]
+        if isinstance(networks, list):
+            return dict((network, {}) for network in networks)
+        return dict((network, definition or {}) for network, definition in networks.items())
+
+    def timed(self, key, func, *args, **kwargs):
+        start = time.time()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.timings[key] = round(time.time() - start, 2)
+
+    def up(self, services=None):
+        '''
+        Create and start `services` (all of them by default) and return a mapping of service name to container ID
+        '''
+        start = time.time()
+        services = list(services or self.services)
+        # Services brought up by an earlier call (ex. a previous tier) are left alone
+        pending = [name for name in services if name not in self.containers]
+        self.timed("networks", self.create_networks, pending)
+        self.timed("volumes", self.create_volumes, pending)
+        self.timed("pull", self.pull_images, pending)
+        for layer in dependency_layers(dict((name, self.services[name]) for name in pending)):
+            run_concurrently(self.start_service, layer)
+        self.timings["total"] = round(time.time() - start, 2)
+        LOGGER.info("Compose engine brought up {} of {} in {:.2f}s: {}".format(", ".join(services), self.project_name,
+                                                                              time.time() - start, self.timings))
+        return dict((name, self.containers[name]) for name in services)
+
+    def create_networks(self, services):
+        needed = set()
+        for service in services:
+            needed.update(self.service_networks(service))
+        existing = set(network["Name"] for network in self.client.networks(filters={"label": "com.docker.compose.project={}".format(self.project_name)}))
+        for network in sorted(needed):
+            name = self.network_name(network)
+            definition = (self.scenario.get("networks") or {}).get(network) or {}
+            if name in existing or definition.get("external"):
+                continue
+            self.client.create_network(name, driver=definition.get("driver", "bridge"), attachable=definition.get("attachable", False),
+                                       labels=self.labels(network=network))
+
+    def create_volumes(self, services):
+        declared = self.scenario.get("volumes") or {}
+        for volume in sorted(declared):
+            used = any(self.parse_volume(service, spec)[0] == self.volume_name(volume)
+                       for service in services for spec in self.services[service].get("volumes") or [])
+            if not used or (declared[volume] or {}).get("external"):
+                continue
+            try:
+                self.client.inspect_volume(self.volume_name(volume))
+            except docker.errors.NotFound:
+                self.client.create_volume(self.volume_name(volume), labels=self.labels(volume=volume))
+
+    def pull_images(self, services):
+        missing = set()
+        for service in services:
+            image = self.services[service]["image"]
+            try:
+                self.client.inspect_image(image)
+            except docker.errors.ImageNotFound:
+                missing.add(image)
+        def pull(image):
+            repository, _, tag = image.rpartition(":") if ":" in image.split("/")[-1] else (image, None, "latest")
+            for _ in self.client.pull(repository, tag=tag, stream=True, decode=True):
+                continue
+        run_concurrently(pull, sorted(missing))
+
+    def parse_volume(self, service, spec):
+        '''
+        A service volume as (source, target, mode); relative sources are bind mounts relative to the compose file
+        '''
+        parts = spec.split(":")
+        if len(parts) == 1:
+            return None, parts[0], "rw"
+        source, target = parts[0], parts[1]
+        mode = parts[2] if len(parts) > 2 else "rw"
+        if source.startswith(".") or source.startswith("~"):
+            source = os.path.normpath(os.path.join(self.directory, os.path.expanduser(source)))
+        elif not source.startswith("/"):
+            source = self.volume_name(source)
+        return source, target, mode
+
+    def start_service(self, service):
+        definition = self.services[service]
+        name = self.container_name(service)
+        ports, port_bindings = [], {}
+        for port in definition.get("ports") or []:
+            container, host = parse_port(port)
+            ports.append(container)
+            port_bindings[container] = host
+        volumes, binds = [], []
+        for spec in definition.get("volumes") or []:
+            source, target, mode = self.parse_volume(service, spec)
+            volumes.append(target)
+            if source:
+                binds.append("{}:{}:{}".format(source, target, mode))
+        networks = self.service_networks(service)
+        first = sorted(networks)[0]
+        networking_config = self.client.create_networking_config({
+            self.network_name(first): self.client.create_endpoint_config(aliases=networks[first].get("aliases"))
+        })
+        tmpfs = definition.get("tmpfs")
+        host_config = self.client.create_host_config(port_bindings=port_bindings, binds=binds, init=definition.get("init"),
+                                                     tmpfs=[tmpfs] if isinstance(tmpfs, string_types) else tmpfs)
+        command = definition.get("command")
+        entrypoint = definition.get("entrypoint")
+        container = self.timed("{}_create".format(service), self.client.create_container,
+                               definition["image"], name=name, hostname=definition.get("hostname"),
+                               command=shlex.split(command) if isinstance(command, string_types) else command,
+                               entrypoint=shlex.split(entrypoint) if isinstance(entrypoint, string_types) else entrypoint,
+                               environment=parse_environment(definition.get("environment"), self.env) +
+                                           ["{}={}".format(k, v) for k, v in sorted(self.extra_environment.items())],
+                               ports=ports, volumes=volumes, tty=definition.get("tty", False),
+                               labels=self.labels(service=service, container_number="1", oneoff="False"),
+                               host_config=host_config, networking_config=networking_config)
+        cid = container["Id"]
+        with self.lock:
+            self.containers[service] = cid
+        # Only one network can be given at creation time, the others are attached before the container starts
+        for network in sorted(networks)[1:]:
+            self.client.connect_container_to_network(cid, self.network_name(network), aliases=networks[network].get("aliases"))
+        self.timed("{}_start".format(service), self.client.start, cid)
@@ -1,8 +1,119 @@
 #!/usr/bin/env python
 # encoding: utf-8
 
+import os
 import pytest
+import teardown
+import artifacts
+import provisioning
+import taskprofile
+from executor import Executor
 
 
 def pytest_addoption(parser):
     parser.addoption("--platform", default="debian-9", action="store", help="Define which platform of images to run tests again (default: debian-9)")
+    parser.addoption("--staged-bringup", default=False, action="store_true", help="Bring up compose scenarios one tier at a time: management, indexers, then search (default: false)")
+    parser.addoption("--compose-engine", default="cli", choices=["cli", "sdk"], action="store", help="Bring up compose scenarios with the docker-compose CLI or in-process through the Docker SDK (default: cli)")
+    parser.addoption("--async-teardown", default=False, action="store_true", help="Tear down finished compose stacks in the background while the next test runs (default: false)")
+    parser.addoption("--teardown-queue-size", default=2, type=int, action="store", help="Number of finished stacks that may wait for teardown before tests block (default: 2)")
+    parser.addoption("--provisioning-history", default="test-results/provisioning/history.jsonl", action="store", help="File that the time-to-ready of every scenario is appended to (default: test-results/provisioning/history.jsonl)")
+    parser.addoption("--provisioning-baselines", default=None, action="store", help="JSON file of fixed per-scenario baselines in seconds; other scenarios use the median of their history")
+    parser.addoption("--provisioning-tolerance", default=0.5, type=float, action="store", help="Fraction over the baseline at which provisioning counts as a regression (default: 0.5)")
+    parser.addoption("--provisioning-gate", default="warn", choices=provisioning.GATE_MODES, action="store", help="Turn off, flag regressions in the junit XML, or fail tests on provisioning regressions (default: warn)")
+    parser.addoption("--ansible-profile", default=False, action="store_true", help="Run compose scenarios with SPLUNK_ANSIBLE_PROFILE=true and rank the slowest Ansible roles and tasks (default: false)")
+    parser.addoption("--ansible-profile-dir", default="test-results/ansible-profile", action="store", help="Directory for the harvested task profiles and the report (default: test-results/ansible-profile)")
+    parser.addoption("--benchmark-repetitions", default=5, type=int, action="store", help="Number of times each benchmark case is repeated (default: 5)")
+    parser.addoption("--hec-batch-sizes", default="1,100", action="store", help="Comma-separated number of events per HEC request for the HEC benchmark (default: 1,100)")
+    parser.addoption("--hec-concurrency", default="1,8", action="store", help="Comma-separated number of concurrent HEC clients for the HEC benchmark (default: 1,8)")
+    parser.addoption("--hec-events", default=20000, type=int, action="store", help="Number of events sent by every HEC benchmark run (default: 20000)")
+    parser.addoption("--forwarder-files", default=20, type=int, action="store", help="Number of files monitored by the forwarder throughput benchmark (default: 20)")
+    parser.addoption("--forwarder-events", default=100000, type=int, action="store", help="Number of events spread over the monitored files (default: 100000)")
+    parser.addoption("--search-concurrency", default="1,4", action="store", help="Comma-separated number of concurrent searches for the search benchmark (default: 1,4)")
+    parser.addoption("--search-events", default=200000, type=int, action="store", help="Size of the dataset loaded by the search benchmark (default: 200000)")
+    parser.addoption("--search-scratch-mb", default=6144, type=int, action="store", help="Size of the tmpfs the search benchmark puts the search heads' dispatch directory on, which has to fit Splunk's minFreeSpace of 5000MB, 0 to skip those runs (default: 6144)")
+    parser.addoption("--smartstore-cache-sizes", default="64,1024", action="store", help="Comma-separated SmartStore cache sizes in MB per indexer for the SmartStore benchmark (default: 64,1024)")
+    parser.addoption("--smartstore-events", default=1000000, type=int, action="store", help="Size of the dataset loaded by the SmartStore benchmark (default: 1000000)")
+
+
+@pytest.fixture(autouse=True)
+def junit_properties(request, record_property):
+    # Executor subclasses collect per-test measurements in junit_properties, which get attached to the junit XML
+    if request.instance is not None:
+        request.instance.junit_properties = {}
+    yield
+    if request.instance is not None:
+        for key, value in sorted(getattr(request.instance, "junit_properties", {}).items()):
+            record_property(key, value)
+
+
+@pytest.fixture(autouse=True)
+def docker_test_label(request):
+    # Everything a test creates through the Docker client is labeled, and removed by that label afterwards.
+    # Compose stacks are removed by teardown_method, which may hand them to the --async-teardown queue
+    if not isinstance(request.instance, Executor):
+        yield
+        return
+    request.instance.set_test_label(Executor.generate_random_string())
+    yield
+    try:
+        request.instance._clean_test_resources()
+    finally:
+        request.instance.set_test_label(None)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def compose_engine(request):
+    Executor.compose_engine = request.config.option.compose_engine
+    yield
+
+
+@pytest.fixture(scope="session", autouse=True)
+def artifact_cache(request):
+    # Apps are packaged once per content hash and reused by every test through Executor.package_app()
+    cache = artifacts.ArtifactCache(Executor.ARTIFACTS_DIR)
+    Executor.artifact_cache = cache
+    yield cache
+    Executor.artifact_cache = None
+    Executor.logger.info("Artifact cache summary: {}".format(cache.summary()))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def provisioning_history(request):
+    option = request.config.option
+    if option.provisioning_gate == "off":
+        yield None
+        return
+    history = provisioning.ProvisioningHistory(option.provisioning_history, baselines=option.provisioning_baselines,
+                                               tolerance=option.provisioning_tolerance, mode=option.provisioning_gate)
+    Executor.provisioning_history = history
+    yield history
+    Executor.provisioning_history = None
+
+
+@pytest.fixture(scope="session", autouse=True)
+def task_profiles(request):
+    # Executor.harvest_task_profiles() appends to profiles.jsonl; the report covers every session that wrote to it
+    option = request.config.option
+    if not option.ansible_profile:
+        yield None
+        return
+    path = os.path.join(option.ansible_profile_dir, "profiles.jsonl")
+    Executor.task_profiles = path
+    yield path
+    Executor.task_profiles = None
+    report = taskprofile.write_report(path, os.path.join(option.ansible_profile_dir, "report.json"))
+    Executor.logger.info("Ansible task profile report:\n{}".format(taskprofile.format_report(report)))
+
+
+@pytest.fixture(scope="session", autouse=True)
+def teardown_queue(request):
+    # Executor.teardown_stack() hands stacks to this queue instead of removing them inline
+    if not request.config.option.async_teardown:
+        yield None
+        return
+    queue = teardown.TeardownQueue(max_pending=request.config.option.teardown_queue_size)
+    Executor.teardown_queue = queue
+    yield queue
+    # Don't let the session end while stacks are still being removed
+    Executor.teardown_queue = None
+    queue.close()
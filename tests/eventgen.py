@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Deterministic synthetic event generator for ingestion and search benchmarks.
+
+Events are rendered once into a seeded pool, split around their timestamp. Streaming N events then
+only means joining pre-encoded pool entries with a timestamp that changes once per simulated second,
+so a single core can produce data far faster than a Splunk container can ingest it.
+
+Examples:
+    python tests/eventgen.py --sourcetype access_combined --events 1000000 --output /tmp/access.log
+    python tests/eventgen.py --sourcetype syslog --events 1000000 --files 20 --output /tmp/monitored
+    python tests/eventgen.py --sourcetype json --events 1000000 --pipe /tmp/events.fifo
+    python tests/eventgen.py --sourcetype syslog --events 1000000 --hec https://localhost:8088 abcd1234
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+
+SOURCETYPES = ["syslog", "json", "access_combined"]
+CARDINALITY = {
+    "hosts": 100,
+    "users": 1000,
+    "clients": 5000,
+    "paths": 500
+}
+PROGRAMS = ["sshd", "sudo", "cron", "systemd", "kernel", "dockerd"]
+METHODS = ["GET"] * 6 + ["POST"] * 3 + ["PUT", "DELETE"]
+STATUSES = [200] * 16 + [201, 204, 301, 302, 304, 400, 401, 403, 404, 404, 500, 503]
+AGENTS = ["Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36", "curl/7.68.0", "python-requests/2.25.1", "Splunk/8.1.2"]
+ACTIONS = ["login", "logout", "view", "search", "cart", "purchase"]
+
+
+class EventGenerator(object):
+    """
+    Seedable stream of events of one sourcetype. The same seed, sourcetype and cardinality always produce the
+    same events, with timestamps advancing `rate` events per simulated second from `start_time`.
+    """
+
+    def __init__(self, sourcetype="syslog", seed=0, cardinality=None, rate=1000, start_time=None, pool_size=8192):
+        if sourcetype not in SOURCETYPES:
+            raise ValueError("Unsupported sourcetype {}, expected one of {}".format(sourcetype, ", ".join(SOURCETYPES)))
+        self.sourcetype = sourcetype
+        self.seed = seed
+        self.cardinality = dict(CARDINALITY)
+        self.cardinality.update(cardinality or {})
+        self.rate = rate
+        self.start_time = int(start_time if start_time is not None else time.time())
+        self.pool_size = pool_size
+        rng = random.Random(seed * len(SOURCETYPES) + SOURCETYPES.index(sourcetype))
+        self.heads, self.tails = [], []
+        for _ in range(pool_size):
+            head, tail = self.render(rng)
+            self.heads.append(head.encode("utf-8"))
+            self.tails.append(tail.encode("utf-8"))
+        # glue[n] is everything between the timestamps of event n and event n+1, so that a run of events
+        # sharing a timestamp is a single bytes.join() over a slice of the pool
+        self.glue = [self.tails[n] + self.heads[(n + 1) % pool_size] for n in range(pool_size)]
+        self.ts_cache = (None, None)
+
+    def pick(self, rng, kind):
+        return rng.randrange(self.cardinality[kind])
+
+    def render(self, rng):
+        '''
+        Render one event as (text before the timestamp, text after the timestamp including the newline)
+        '''
+        host = "host{:04d}".format(self.pick(rng, "hosts"))
+        user = "user{:05d}".format(self.pick(rng, "users"))
+        client = self.pick(rng, "clients")
+        ip = "10.{}.{}.{}".format(client // 65536 % 256, client // 256 % 256, client % 256)
+        if self.sourcetype == "syslog":
+            program = rng.choice(PROGRAMS)
+            return "", " {} {}[{}]: action={} user={} src={} session={:08x}\n".format(
+                host, program, rng.randrange(100, 65535), rng.choice(ACTIONS), user, ip, rng.getrandbits(32))
+        if self.sourcetype == "json":
+            body = json.dumps({"host": host, "user": user, "src": ip, "action": rng.choice(ACTIONS),
+                               "duration_ms": rng.randrange(1, 5000), "status": rng.choice(STATUSES)}, sort_keys=True)
+            return '{"timestamp": "', '", ' + body[1:] + "\n"
+        path = "/app/{}/{}".format(rng.choice(["product", "cart", "search", "account"]), self.pick(rng, "paths"))
+        return "{} - {} [".format(ip, user), '] "{} {} HTTP/1.1" {} {} "-" "{}"\n'.format(
+            rng.choice(METHODS), path, rng.choice(STATUSES), rng.randrange(200, 50000), rng.choice(AGENTS))
+
+    def timestamp(self, epoch):
+        # Read the cache once, since a generator can be shared between threads
+        cached = self.ts_cache
+        if cached[0] == epoch:
+            return cached[1]
+        moment = time.gmtime(epoch)
+        if self.sourcetype == "syslog":
+            text = time.strftime("%b %d %H:%M:%S", moment)
+        elif self.sourcetype == "json":
+            text = time.strftime("%Y-%m-%dT%H:%M:%SZ", moment)
+        else:
+            text = time.strftime("%d/%b/%Y:%H:%M:%S +0000", moment)
+        cached = (epoch, text.encode("utf-8"))
+        self.ts_cache = cached
+        return cached[1]
+
+    def chunk(self, first, count):
+        '''
+        Events `first` to `first + count` of the stream as newline-delimited bytes
+        '''
+        pieces = []
+        n, end = first, first + count
+        while n < end:
+            # Events within the same simulated second share a timestamp, and are bounded by the end of the pool
+            second_end = min(end, (n // self.rate + 1) * self.rate)
+            run_end = min(second_end, n + self.pool_size - n % self.pool_size)
+            start, stop = n % self.pool_size, (run_end - 1) % self.pool_size
+            parts = [self.heads[start]] + self.glue[start:stop] + [self.tails[stop]]
+            pieces.append(self.timestamp(self.start_time + n // self.rate).join(parts))
+            n = run_end
+        return b"".join(pieces)
+
+    def chunks(self, count, chunk_events=4096, first=0):
+        '''
+        Stream `count` events as chunks of at most `chunk_events` events
+        '''
+        for n in range(first, first + count, chunk_events):
+            yield self.chunk(n, min(chunk_events, first + count - n))
+
+    def hec_event_batches(self, count, batch_size=100, first=0):
+        '''
+        Batches for the HEC /services/collector/event endpoint, with the event time set explicitly
+        '''
+        for batch_start in range(first, first + count, batch_size):
+            envelopes = []
+            for n in range(batch_start, min(batch_start + batch_size, first + count)):
+                event = self.chunk(n, 1).decode("utf-8").rstrip("\n")
+                envelopes.append(json.dumps({"time": self.start_time + n // self.rate, "sourcetype": self.sourcetype, "event": event}))
+            yield "".join(envelopes).encode("utf-8")
+
+    def write(self, fileobj, count, chunk_events=4096, first=0):
+        written = 0
+        for data in self.chunks(count, chunk_events, first):
+            fileobj.write(data)
+            written += len(data)
+        return written
+
+    def write_file(self, path, count, first=0):
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, "wb") as f:
+            return self.write(f, count, first=first)
+
+    def write_files(self, root, files, count):
+        '''
+        Spread `count` events over `files` files in a few subdirectories of `root`, for forwarder monitor inputs
+        '''
+        written, first = 0, 0
+        for n in range(files):
+            events = count // files + (1 if n < count % files else 0)
+            written += self.write_file(os.path.join(root, "dir{}".format(n % 4), "{}{}.log".format(self.sourcetype, n)), events, first)
+            first += events
+        return written
+
+    def write_pipe(self, path, count):
+        '''
+        Stream events into a named pipe, creating it if needed. Blocks until a reader opens the other end.
+        '''
+        if not os.path.exists(path):
+            os.mkfifo(path)
+        with open(path, "wb", 0) as f:
+            return self.write(f, count)
+
+
+def parse_cardinality(value):
+    cardinality = {}
+    for item in value.split(","):
+        if item.strip():
+            key, _, raw = item.partition("=")
+            if key.strip() not in CARDINALITY:
+                raise argparse.ArgumentTypeError("Unknown cardinality key {}".format(key))
+            cardinality[key.strip()] = int(raw)
+    return cardinality
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate deterministic synthetic events")
+    parser.add_argument("--sourcetype", choices=SOURCETYPES, default="syslog")
+    parser.add_argument("--events", type=int, default=100000, help="Number of events to generate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--rate", type=int, default=1000, help="Events per simulated second of event time")
+    parser.add_argument("--start-time", type=int, default=None, help="Epoch of the first event (default: now)")
+    parser.add_argument("--cardinality", type=parse_cardinality, default={}, help="ex. hosts=10,users=100000")
+    sink = parser.add_mutually_exclusive_group()
+    sink.add_argument("--output", default=None, help="File to write to, or a directory with --files")
+    sink.add_argument("--pipe", default=None, help="Named pipe to stream into")
+    sink.add_argument("--hec", nargs=2, metavar=("URL", "TOKEN"), default=None, help="Send to the HEC raw endpoint")
+    parser.add_argument("--files", type=int, default=0, help="Spread the events over this many files under --output")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Events per HEC request")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    generator = EventGenerator(args.sourcetype, seed=args.seed, cardinality=args.cardinality, rate=args.rate, start_time=args.start_time)
+    start = time.time()
+    if args.hec:
+        import requests
+        url = "{}/services/collector/raw?sourcetype={}".format(args.hec[0].rstrip("/"), args.sourcetype)
+        headers = {"Authorization": "Splunk {}".format(args.hec[1])}
+        written = 0
+        for data in generator.chunks(args.events, args.batch_size):
+            requests.post(url, data=data, headers=headers, verify=False).raise_for_status()
+            written += len(data)
+    elif args.pipe:
+        written = generator.write_pipe(args.pipe, args.events)
+    elif args.output and args.files:
+        written = generator.write_files(args.output, args.files, args.events)
+    elif args.output:
+        written = generator.write_file(args.output, args.events)
+    else:
+        out = getattr(sys.stdout, "buffer", sys.stdout)
+        written = generator.write(out, args.events)
+        out.flush()
+    elapsed = max(time.time() - start, 1e-6)
+    sys.stderr.write("{} events, {:.1f}MB in {:.2f}s ({:.1f}MB/s)\n".format(args.events, written / 1048576.0, elapsed, written / 1048576.0 / elapsed))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -11,10 +11,18 @@ import docker
 import json
 import urllib
 import yaml
+import re
+import math
+import calendar
 import shlex
 import subprocess
 import logging.handlers
-from shutil import copy
+import topology
+import sampler
+import compose_engine
+import artifacts
+import taskprofile
+from shutil import copy, rmtree
 from random import choice
 from string import ascii_lowercase
 # Code to suppress insecure https warnings
@@ -37,6 +45,60 @@ LOGGER.addHandler(file_handler)
 # Define Docker client settings
 os.environ['COMPOSE_HTTP_TIMEOUT'] = "500"
 os.environ['DOCKER_CLIENT_TIMEOUT'] = "500"
+# Label put on every container, network and volume a test creates through the Docker client
+TEST_LABEL = "com.splunk.docker-splunk.test"
+
+
+def remove_labeled_resources(client, label):
+    '''
+    Remove every container, network and volume that carries `label`, ex. "com.docker.compose.project=abcdef"
+    '''
+    for container in client.containers(all=True, filters={"label": label}):
+        try:
+            client.remove_container(container["Id"], v=True, force=True)
+        except docker.errors.NotFound:
+            pass
+    for network in client.networks(filters={"label": label}):
+        try:
+            client.remove_network(network["Id"])
+        except docker.errors.APIError:
+            pass
+    for volume in client.volumes(filters={"label": label}).get("Volumes") or []:
+        try:
+            client.remove_volume(volume["Name"], force=True)
+        except docker.errors.APIError:
+            pass
+
+
+class LabeledAPIClient(docker.APIClient):
+    """
+    Docker client that adds `labels` to every container, network and volume it creates, so that the resources
+    of a test can be removed by label instead of by pruning the whole daemon
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(LabeledAPIClient, self).__init__(*args, **kwargs)
+        self.labels = {}
+
+    def with_labels(self, labels):
+        merged = dict(self.labels)
+        if isinstance(labels, dict):
+            merged.update(labels)
+        elif labels:
+            merged.update((label, "") for label in labels)
+        return merged
+
+    def create_container(self, *args, **kwargs):
+        kwargs["labels"] = self.with_labels(kwargs.get("labels"))
+        return super(LabeledAPIClient, self).create_container(*args, **kwargs)
+
+    def create_network(self, *args, **kwargs):
+        kwargs["labels"] = self.with_labels(kwargs.get("labels"))
+        return super(LabeledAPIClient, self).create_network(*args, **kwargs)
+
+    def create_volume(self, *args, **kwargs):
+        kwargs["labels"] = self.with_labels(kwargs.get("labels"))
+        return super(LabeledAPIClient, self).create_volume(*args, **kwargs)
 
 
 class Executor(object):
@@ -52,12 +114,37 @@ class Executor(object):
     FIXTURES_DIR = os.path.join(FILE_DIR, "fixtures")
     EXAMPLE_APP = os.path.join(FIXTURES_DIR, "splunk_app_example")
     EXAMPLE_APP_TGZ = os.path.join(FIXTURES_DIR, "splunk_app_example.tgz")
+    # Packaged apps, keyed by content hash; the appserver in the compose scenarios serves FIXTURES_DIR
+    ARTIFACTS_DIR = os.path.join(FIXTURES_DIR, "artifacts")
     SCENARIOS_DIR = os.path.join(FILE_DIR, "..", "test_scenarios")
     DEFAULTS_DIR = os.path.join(SCENARIOS_DIR, "defaults")
+    RESOURCES_DIR = os.path.join(FILE_DIR, "..", "test-results", "resources")
+    RESOURCE_SAMPLE_INTERVAL = 2 # in seconds
+    # Set by the session fixture in conftest.py when running with --async-teardown
+    teardown_queue = None
+    # Set by the session fixture in conftest.py: "cli" shells out to docker-compose, "sdk" uses compose_engine.py
+    compose_engine = "cli"
+    # Set by the session fixture in conftest.py, and created on first use otherwise
+    artifact_cache = None
+    # Set by the session fixture in conftest.py; time-to-ready of every scenario is checked against its history
+    provisioning_history = None
+    # Set by the session fixture in conftest.py with --ansible-profile: the JSON lines file Ansible task profiles go to
+    task_profiles = None
+    # Order in which roles are brought up during a staged bring-up; roles not listed here start in the last tier
+    BRINGUP_TIERS = [
+        ("management", {"splunk_cluster_master", "splunk_license_master", "splunk_deployer", "splunk_deployment_server"}),
+        ("indexers", {"splunk_indexer"}),
+        ("search", None)
+    ]
 
     @classmethod
-    def setup_class(cls, platform):
-        cls.client = docker.APIClient()
+    def setup_class(cls, platform, staged_bringup=False):
+        cls.client = LabeledAPIClient()
+        cls.test_label = None
+        cls.staged_bringup = staged_bringup
+        cls.platform = platform
+        cls.bringup_started = None
+        cls.bringup_mode = None
         # Define images by name to be validated
         cls.BASE_IMAGE_NAME = "base-{}".format(platform)
         cls.SPLUNK_IMAGE_NAME = "splunk-{}".format(platform)
@@ -68,6 +155,11 @@ class Executor(object):
         cls.project_name = None
         cls.DIR = None
         cls.container_id = None
+        cls.engine = None
+        cls.containers = {}
+        cls.tier_timings = []
+        cls.junit_properties = {}
+        cls.resource_sampler = None
         # Wrap into custom env variable for subprocess overrides
         cls.env = {
             "SPLUNK_PASSWORD": cls.password,
@@ -116,15 +208,22 @@ class Executor(object):
             raise e
 
     def _clean_docker_env(self):
-        # Remove anything spun up by docker-compose
-        containers = self.client.containers(filters={"label": "com.docker.compose.project={}".format(self.project_name)})
-        for container in containers:
-            self.client.remove_container(container["Id"], v=True, force=True)
-        try:
-            self.client.prune_networks({"until": "15s"})
-            self.client.prune_volumes()
-        except:
-            pass
+        # Remove anything spun up by docker-compose, and anything this test created through self.client
+        if self.project_name:
+            remove_labeled_resources(self.client, "com.docker.compose.project={}".format(self.project_name))
+        self._clean_test_resources()
+
+    def _clean_test_resources(self):
+        # Only what this test created through self.client; compose stacks are left to teardown_stack()
+        if self.test_label:
+            remove_labeled_resources(self.client, "{}={}".format(TEST_LABEL, self.test_label))
+
+    def set_test_label(self, value):
+        '''
+        Label everything created through self.client from now on with `value`, or stop labeling when it is None
+        '''
+        self.test_label = value
+        self.client.labels = {TEST_LABEL: value} if value else {}
 
     def wait_for_containers(self, count, label=None, name=None, timeout=500):
         '''
@@ -158,6 +257,8 @@ class Executor(object):
                     healthy_count += 1
             if healthy_count == count:
                 self.logger.info("All containers ready to proceed")
+                if label == "com.docker.compose.project={}".format(self.project_name):
+                    self.check_provisioning_time()
                 break
             time.sleep(5)
             end = time.time()
@@ -221,12 +322,241 @@ class Executor(object):
         job_results = json.loads(job_results.content)
         return job_metadata, job_results
 
-    def compose_up(self, defaults_url=None, apps_url=None):
+    def start_resource_sampler(self):
+        '''
+        Record CPU, memory, block I/O and network usage of every container in the compose project to test-results/resources/
+        '''
+        self.stop_resource_sampler()
+        self.resource_sampler = sampler.ResourceSampler(self.client, self.project_name, self.RESOURCES_DIR,
+                                                        interval=self.RESOURCE_SAMPLE_INTERVAL).start()
+
+    def stop_resource_sampler(self):
+        if not self.resource_sampler:
+            return {}
+        summary = self.resource_sampler.stop()
+        self.logger.info("Resource samples for {} written to {}".format(self.project_name, self.resource_sampler.path))
+        self.junit_properties.update(summary)
+        self.resource_sampler = None
+        return summary
+
+    def compose_up(self, defaults_url=None, apps_url=None, staged=False):
+        self.wait_for_pending_teardown(os.path.join(self.SCENARIOS_DIR, self.compose_file_name))
+        self.start_resource_sampler()
+        self.bringup_started = time.time()
+        self.bringup_mode = "staged" if staged or self.staged_bringup else self.compose_engine
+        if staged or self.staged_bringup:
+            return self.compose_up_staged(defaults_url, apps_url)
         container_count = self.get_number_of_containers(os.path.join(self.SCENARIOS_DIR, self.compose_file_name))
-        command = "docker-compose -p {} -f test_scenarios/{} up -d".format(self.project_name, self.compose_file_name)
+        if self.compose_engine == "sdk":
+            return container_count, self.compose_up_engine(defaults_url, apps_url)
+        command = "docker-compose -p {} {} up -d".format(self.project_name, self.compose_file_args())
         out, err, rc = self._run_command(command, defaults_url, apps_url)
         return container_count, rc
 
+    def compose_up_engine(self, defaults_url=None, apps_url=None, services=None):
+        '''
+        Bring up the scenario, or only `services` of it, in-process through compose_engine.py. The container IDs end up
+        in self.containers and the creation timings in the junit properties.
+        '''
+        compose_file = os.path.join(self.SCENARIOS_DIR, self.compose_file_name)
+        if not self.engine or self.engine.project_name != self.project_name or self.engine.filename != compose_file:
+            extra_environment = {"SPLUNK_ANSIBLE_PROFILE": "true"} if self.task_profiles else None
+            self.engine = compose_engine.ComposeEngine(self.client, self.project_name, compose_file,
+                                                       env=self.compose_env(defaults_url, apps_url),
+                                                       extra_environment=extra_environment)
+            self.containers = {}
+        try:
+            self.containers.update(self.engine.up(services))
+        except Exception as e:
+            self.logger.error("Compose engine failed to bring up {}: {}".format(self.project_name, e))
+            return 1
+        for key, seconds in self.engine.timings.items():
+            self.junit_properties["engine_{}_seconds".format(key)] = seconds
+        return 0
+
+    def compose_file_args(self):
+        '''
+        The -f arguments for docker-compose: the scenario, and with --ansible-profile an override that turns on
+        SPLUNK_ANSIBLE_PROFILE in every service
+        '''
+        args = "-f test_scenarios/{}".format(self.compose_file_name)
+        if not self.task_profiles:
+            return args
+        scenario = compose_engine.load_scenario(os.path.join(self.SCENARIOS_DIR, self.compose_file_name))
+        override = {
+            "version": scenario.get("version", "3.6"),
+            "services": dict((service, {"environment": ["SPLUNK_ANSIBLE_PROFILE=true"]}) for service in scenario["services"])
+        }
+        directory = os.path.join(os.path.dirname(self.task_profiles), "overrides")
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, "{}.yaml".format(self.project_name))
+        with open(path, "w") as f:
+            yaml.safe_dump(override, f, default_flow_style=False)
+        return "{} -f {}".format(args, path)
+
+    def harvest_task_profiles(self):
+        '''
+        Copy the Ansible task profiles out of every Splunk container in the project before it is removed
+        '''
+        if not self.task_profiles or not self.project_name:
+            return 0
+        profiles = []
+        containers = self.client.containers(filters={"label": "com.docker.compose.project={}".format(self.project_name)})
+        for container in containers:
+            if container.get("Labels", {}).get("maintainer") != "support@splunk.com":
+                continue
+            try:
+                exec_command = self.client.exec_create(container["Id"], ["sh", "-c", "cat ${CONTAINER_ARTIFACT_DIR:-/opt/container_artifact}/ansible_task_profile_*.json 2>/dev/null"])
+                output = self.client.exec_start(exec_command)
+            except docker.errors.APIError as e:
+                self.logger.info("Unable to harvest task profiles from {}: {}".format(container["Names"][0], e))
+                continue
+            if isinstance(output, bytes):
+                output = output.decode("utf-8", "replace")
+            for line in output.splitlines():
+                try:
+                    profile = json.loads(line)
+                except ValueError:
+                    continue
+                profile.update({"platform": self.platform, "scenario": self.compose_file_name,
+                                "service": container.get("Labels", {}).get("com.docker.compose.service")})
+                profiles.append(profile)
+        taskprofile.append(self.task_profiles, profiles)
+        self.logger.info("Harvested {} task profiles from {}".format(len(profiles), self.project_name))
+        return len(profiles)
+
+    def compose_down(self):
+        self.harvest_task_profiles()
+        command = "docker-compose -p {} -f test_scenarios/{} down --volumes --remove-orphans".format(self.project_name, self.compose_file_name)
+        out, err, rc = self._run_command(command)
+        self._clean_docker_env()
+        return rc
+
+    def teardown_stack(self, compose_file, paths=()):
+        '''
+        Remove the stack of self.project_name along with `paths`. With --async-teardown this happens on a background
+        worker and only blocks when too many stacks are already waiting.
+        '''
+        self.harvest_task_profiles()
+        if self.teardown_queue:
+            self.teardown_queue.submit(self.project_name, compose_file, paths, env=self.env,
+                                       container_names=self.get_container_names(compose_file))
+            return
+        command = "docker-compose -p {} -f {} down --volumes --remove-orphans".format(self.project_name, compose_file)
+        out, err, rc = self._run_command(command)
+        self._clean_docker_env()
+        for path in paths:
+            if os.path.isdir(path):
+                rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+
+    def wait_for_pending_teardown(self, compose_file):
+        # Scenarios with fixed container names can't come up until a previous stack using the same names is gone
+        if self.teardown_queue:
+            assert self.teardown_queue.wait_for_names(self.get_container_names(compose_file))
+
+    def package_app(self, path=None):
+        '''
+        Tarball of an app directory (the example app by default) from the artifact cache, along with the URL
+        the appserver serves it at. The tarball is shared with other tests, so it must only be mounted read-only.
+        '''
+        if not Executor.artifact_cache:
+            Executor.artifact_cache = artifacts.ArtifactCache(self.ARTIFACTS_DIR)
+        artifact = Executor.artifact_cache.package(path or self.EXAMPLE_APP)
+        return artifact, "http://appserver/{}".format(os.path.relpath(artifact, self.FIXTURES_DIR).replace(os.sep, "/"))
+
+    def check_provisioning_time(self):
+        '''
+        Record how long the scenario took from compose_up() until every container was ready, and compare it against
+        the scenario's baseline. Regressions are flagged in the junit properties, and fail the test with
+        --provisioning-gate=fail.
+        '''
+        if not self.bringup_started or not self.provisioning_history:
+            return None
+        seconds = time.time() - self.bringup_started
+        self.bringup_started = None
+        # Generated scenarios are named after the random project name, so they never have a history
+        if self.compose_file_name.endswith("_generated.yaml"):
+            return None
+        result = self.provisioning_history.check(self.compose_file_name, self.platform, self.bringup_mode, seconds)
+        self.junit_properties["provisioning_seconds"] = result["seconds"]
+        if result["baseline"] is not None:
+            self.junit_properties["provisioning_baseline_seconds"] = result["baseline"]
+            self.junit_properties["provisioning_regression"] = result["regression"]
+        if result["regression"] and self.provisioning_history.mode == "fail":
+            raise AssertionError("Provisioning of {} took {}s, over the limit of {}s (baseline {}s)".format(
+                self.compose_file_name, result["seconds"], result["limit"], result["baseline"]))
+        return result
+
+    def get_image_info(self, image):
+        '''
+        Name, ID and creation date of an image, used to tag benchmark results with the build they measured
+        '''
+        info = self.client.inspect_image(image)
+        return {"name": image, "id": info["Id"], "created": info["Created"]}
+
+    def generate_self_signed_certs(self, path, passphrase):
+        '''
+        Write a CA and a server certificate signed by it to `path`: cert.pem is the server bundle to configure in Splunk,
+        cacert.pem is the chain clients should verify against
+        '''
+        # Commands to generate self-signed certificates for Splunk here: https://docs.splunk.com/Documentation/Splunk/latest/Security/ConfigureSplunkforwardingtousesignedcertificates
+        cmds = [
+                    "openssl genrsa -aes256 -passout pass:{pw} -out {path}/ca.key 2048".format(pw=passphrase, path=path),
+                    "openssl req -new -key {path}/ca.key -passin pass:{pw} -out {path}/ca.csr -subj /CN=localhost".format(pw=passphrase, path=path),
+                    "openssl x509 -req -in {path}/ca.csr -sha512 -passin pass:{pw} -signkey {path}/ca.key -CAcreateserial -out {path}/ca.pem -days 3".format(pw=passphrase, path=path),
+                    "openssl genrsa -aes256 -passout pass:{pw} -out {path}/server.key 2048".format(pw=passphrase, path=path),
+                    "openssl req -new -passin pass:{pw} -key {path}/server.key -out {path}/server.csr -subj /CN=localhost".format(pw=passphrase, path=path),
+                    "openssl x509 -req -passin pass:{pw} -in {path}/server.csr -SHA256 -CA {path}/ca.pem -CAkey {path}/ca.key -CAcreateserial -out {path}/server.pem -days 3".format(pw=passphrase, path=path),
+                    "cat {path}/server.pem {path}/server.key {path}/ca.pem > {path}/cert.pem".format(path=path),
+                    "cat {path}/server.pem {path}/ca.pem > {path}/cacert.pem".format(path=path)
+            ]
+        for cmd in cmds:
+            subprocess.check_output(["/bin/sh", "-c", cmd])
+
+    def compose_up_staged(self, defaults_url=None, apps_url=None, timeout=600):
+        '''
+        Bring up a scenario one tier at a time so that peers don't spin in retry loops waiting on the
+        cluster master, license master and deployer. Each tier is gated on the readiness of the previous one.
+        '''
+        tiers = self.get_bringup_tiers(os.path.join(self.SCENARIOS_DIR, self.compose_file_name))
+        container_count = sum(len(services) for _, services in tiers)
+        self.tier_timings = []
+        start = time.time()
+        rc = 0
+        for tier, services in tiers:
+            tier_start = time.time()
+            if self.compose_engine == "sdk":
+                rc = self.compose_up_engine(defaults_url, apps_url, services)
+            else:
+                command = "docker-compose -p {} {} up -d --no-recreate {}".format(self.project_name, self.compose_file_args(), " ".join(services))
+                out, err, rc = self._run_command(command, defaults_url, apps_url)
+            if rc != 0:
+                break
+            failed = []
+            for service in services:
+                labels = ["com.docker.compose.project={}".format(self.project_name), "com.docker.compose.service={}".format(service)]
+                remaining = max(timeout - (time.time() - start), 0)
+                if not self.wait_for_containers(1, label=labels, timeout=remaining):
+                    failed.append(service)
+            tier_end = time.time()
+            self.tier_timings.append({"tier": tier, "services": services, "seconds": round(tier_end - tier_start, 2), "failed": failed})
+            self.junit_properties["bringup_{}_seconds".format(tier)] = round(tier_end - tier_start, 2)
+            if failed:
+                # The next tier depends on this one, so there is no point in starting it
+                self.junit_properties["bringup_failed_tier"] = tier
+                self.logger.error("Tier {} did not converge, {} not ready after {:.2f}s".format(tier, ", ".join(failed), tier_end - tier_start))
+                rc = 1
+                break
+            self.logger.info("Tier {} ({}) converged in {:.2f}s".format(tier, ", ".join(services), tier_end - tier_start))
+        self.junit_properties["bringup_total_seconds"] = round(time.time() - start, 2)
+        if rc == 0:
+            self.check_provisioning_time()
+        self.logger.info("Staged bring-up of {} finished in {:.2f}s".format(self.compose_file_name, time.time() - start))
+        return container_count, rc
+
     def extract_json(self, container_name):
         retries = 15
         for i in range(retries):
@@ -244,10 +574,97 @@ class Executor(object):
             return None
 
     def get_number_of_containers(self, filename):
-        yml = {}
-        with open(filename, "r") as f:
-            yml = yaml.load(f, Loader=yaml.Loader)
-        return len(yml["services"])
+        return len(compose_engine.load_scenario(filename)["services"])
+
+    def get_container_names(self, filename):
+        try:
+            yml = compose_engine.load_scenario(filename)
+        except (IOError, OSError):
+            return []
+        return [service["container_name"] for service in yml["services"].values() if service and "container_name" in service]
+
+    def generate_scenario(self, spec):
+        '''
+        Write a compose scenario for a topology spec (see topology.py) into test_scenarios/ and return its file name
+        '''
+        filename = "{}_generated.yaml".format(self.project_name)
+        topology.write_compose(topology.parse_spec(spec), os.path.join(self.SCENARIOS_DIR, filename))
+        return filename
+
+    def generate_scratch_scenario(self, filename, size_mb, roles=("splunk_search_head",)):
+        '''
+        Write a copy of a scenario into test_scenarios/ in which the services with one of `roles` keep their search
+        artifacts on a tmpfs of `size_mb`, and return its file name
+        '''
+        with open(os.path.join(self.SCENARIOS_DIR, filename), "r") as f:
+            yml = yaml.safe_load(f)
+        for definition in yml["services"].values():
+            if self.get_service_role(definition) not in roles:
+                continue
+            environment = definition.get("environment") or []
+            if isinstance(environment, dict):
+                environment = ["{}={}".format(k, v) for k, v in environment.items()]
+            definition["environment"] = environment + ["SPLUNK_SCRATCH_DIR=/opt/splunk-scratch"]
+            definition["tmpfs"] = ["/opt/splunk-scratch:size={}m,mode=1777".format(size_mb)]
+        generated = "{}_generated.yaml".format(self.project_name)
+        with open(os.path.join(self.SCENARIOS_DIR, generated), "w") as f:
+            yaml.safe_dump(yml, f, default_flow_style=False)
+        return generated
+
+    def get_bringup_tiers(self, filename):
+        yml = compose_engine.load_scenario(filename)
+        tiers = [(name, []) for name, _ in self.BRINGUP_TIERS]
+        for service, definition in sorted(yml["services"].items()):
+            role = self.get_service_role(definition)
+            if role is None:
+                # Non-Splunk services (ex. app servers) are dependencies of everything else
+                tiers[0][1].append(service)
+                continue
+            for i, (_, roles) in enumerate(self.BRINGUP_TIERS):
+                if roles is None or role in roles:
+                    tiers[i][1].append(service)
+                    break
+        return [(name, services) for name, services in tiers if services]
+
+    @staticmethod
+    def get_service_role(definition):
+        environment = definition.get("environment") or {}
+        if isinstance(environment, list):
+            environment = dict(item.split("=", 1) for item in environment if "=" in item)
+        if "SPLUNK_ROLE" in environment:
+            return environment["SPLUNK_ROLE"]
+        image = definition.get("image", "")
+        if "UF_IMAGE" in image or "universalforwarder" in image:
+            return "splunk_universal_forwarder"
+        if "SPLUNK_IMAGE" in image or "splunk/splunk" in image:
+            return "splunk_standalone"
+        return None
+
+    def measure_request_load(self, container_id, since=None, path="/opt/splunk/var/log/splunk/splunkd_access.log"):
+        '''
+        Summarize the per-second rate of REST requests that other hosts made against a container's splunkd
+        '''
+        exec_command = self.client.exec_create(container_id, "cat {}".format(path), user="splunk")
+        output = self.client.exec_start(exec_command)
+        if isinstance(output, bytes):
+            output = output.decode("utf-8", "replace")
+        per_second = {}
+        for line in output.splitlines():
+            match = re.match(r"^(\S+) .*?\[(\d+/\w+/\d+:\d+:\d+:\d+)", line)
+            if not match or match.group(1) in ("127.0.0.1", "::1"):
+                continue
+            ts = calendar.timegm(time.strptime(match.group(2), "%d/%b/%Y:%H:%M:%S"))
+            if since and ts < since:
+                continue
+            per_second[ts] = per_second.get(ts, 0) + 1
+        if not per_second:
+            return {"requests": 0, "peak_rps": 0, "mean_rps": 0, "stdev_rps": 0}
+        # Include idle seconds so that bursts show up as variance
+        window = range(min(per_second), max(per_second) + 1)
+        counts = [per_second.get(ts, 0) for ts in window]
+        mean = float(sum(counts)) / len(counts)
+        stdev = math.sqrt(sum((c - mean) ** 2 for c in counts) / len(counts))
+        return {"requests": sum(counts), "peak_rps": max(counts), "mean_rps": round(mean, 2), "stdev_rps": round(stdev, 2)}
 
     def search_internal_distinct_hosts(self, container_id, username="admin", password="password"):
         query = "search index=_internal earliest=-1m | stats dc(host) as distinct_hosts"
@@ -256,12 +673,8 @@ class Executor(object):
         distinct_hosts = int(results["results"][0]["distinct_hosts"])
         return search_providers, distinct_hosts
 
-    def _run_command(self, command, defaults_url=None, apps_url=None):
-        if isinstance(command, list):
-            sh = command
-        elif isinstance(command, str):
-            sh = shlex.split(command)
-        self.logger.info("CALL: %s" % sh)
+    def compose_env(self, defaults_url=None, apps_url=None):
+        # Environment that the compose files are interpolated with
         env = os.environ.copy()
         env["SPLUNK_PASSWORD"] = self.password
         env["SPLUNK_IMAGE"] = self.SPLUNK_IMAGE_NAME
@@ -270,7 +683,15 @@ class Executor(object):
             env["SPLUNK_DEFAULTS_URL"] = defaults_url
         if apps_url:
             env["SPLUNK_APPS_URL"] = apps_url
-        proc = subprocess.Popen(sh, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env)
+        return env
+
+    def _run_command(self, command, defaults_url=None, apps_url=None):
+        if isinstance(command, list):
+            sh = command
+        elif isinstance(command, str):
+            sh = shlex.split(command)
+        self.logger.info("CALL: %s" % sh)
+        proc = subprocess.Popen(sh, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=self.compose_env(defaults_url, apps_url))
         lines = []
         err_lines = []
         for line in iter(proc.stdout.readline, ''):
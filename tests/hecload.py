@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+import requests
+import benchmark
+import eventgen
+
+
+class HecLoadGenerator(object):
+    """
+    Closed-loop load generator for the HTTP Event Collector. Each worker sends one batch at a time and
+    records the request latency; with acknowledgement enabled the latency includes the wait for the
+    ackId to be confirmed, which is when the events are safely indexed.
+    """
+
+    def __init__(self, url, token, endpoint="event", batch_size=100, concurrency=4, events=10000,
+                 sourcetype="syslog", seed=0, ack=False, verify=False, timeout=60, ack_poll_interval=0.05):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.endpoint = endpoint
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.events = events
+        self.generator = eventgen.EventGenerator(sourcetype, seed=seed)
+        self.ack = ack
+        self.verify = verify
+        self.timeout = timeout
+        self.ack_poll_interval = ack_poll_interval
+        self.lock = threading.Lock()
+        self.remaining = events
+        self.latencies = []
+        self.sent_events = 0
+        self.sent_bytes = 0
+        self.errors = []
+
+    def build_payload(self, first, count):
+        if self.endpoint == "raw":
+            return self.generator.chunk(first, count)
+        return next(self.generator.hec_event_batches(count, count, first))
+
+    def take_batch(self):
+        '''
+        Claim the next batch of the event stream, returning its first event and its size
+        '''
+        with self.lock:
+            count = min(self.batch_size, self.remaining)
+            first = self.events - self.remaining
+            self.remaining -= count
+            return first, count
+
+    def wait_for_ack(self, session, headers, ack_id):
+        url = "{}/services/collector/ack".format(self.url)
+        deadline = time.time() + self.timeout
+        while time.time() < deadline:
+            resp = session.post(url, headers=headers, data=json.dumps({"acks": [ack_id]}), verify=self.verify, timeout=self.timeout)
+            resp.raise_for_status()
+            if json.loads(resp.content)["acks"].get(str(ack_id)):
+                return
+            time.sleep(self.ack_poll_interval)
+        raise RuntimeError("ackId {} was not acknowledged within {}s".format(ack_id, self.timeout))
+
+    def worker(self, worker):
+        session = requests.Session()
+        headers = {"Authorization": "Splunk {}".format(self.token), "X-Splunk-Request-Channel": str(uuid.uuid4())}
+        url = "{}/services/collector/{}".format(self.url, self.endpoint)
+        if self.endpoint == "raw":
+            url += "?sourcetype={}".format(self.generator.sourcetype)
+        while True:
+            first, count = self.take_batch()
+            if not count:
+                break
+            payload = self.build_payload(first, count)
+            start = time.time()
+            try:
+                resp = session.post(url, headers=headers, data=payload, verify=self.verify, timeout=self.timeout)
+                resp.raise_for_status()
+                if self.ack:
+                    self.wait_for_ack(session, headers, json.loads(resp.content)["ackId"])
+            except Exception as e:
+                with self.lock:
+                    self.errors.append(str(e))
+                continue
+            latency = time.time() - start
+            with self.lock:
+                self.latencies.append(latency)
+                self.sent_events += count
+                self.sent_bytes += len(payload)
+
+    def run(self):
+        '''
+        Send all events and return the throughput along with the request latencies (in milliseconds)
+        '''
+        threads = [threading.Thread(target=self.worker, args=(n,)) for n in range(self.concurrency)]
+        start = time.time()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = max(time.time() - start, 1e-6)
+        return {
+            "events": self.sent_events,
+            "bytes": self.sent_bytes,
+            "seconds": round(elapsed, 3),
+            "events_per_second": round(self.sent_events / elapsed, 2),
+            "mb_per_second": round(self.sent_bytes / elapsed / (1024.0 * 1024.0), 3),
+            "errors": len(self.errors),
+            "latencies_ms": [latency * 1000.0 for latency in self.latencies]
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Drive load against a Splunk HTTP Event Collector")
+    parser.add_argument("url", help="Base URL of HEC, ex. https://localhost:8088")
+    parser.add_argument("token", help="HEC token")
+    parser.add_argument("--endpoint", choices=["event", "raw"], default="event")
+    parser.add_argument("--batch-size", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--events", type=int, default=10000)
+    parser.add_argument("--sourcetype", choices=eventgen.SOURCETYPES, default="syslog")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--ack", action="store_true", help="Wait for indexer acknowledgement of every batch")
+    parser.add_argument("--verify", default=False, help="CA bundle used to verify the HEC certificate")
+    args = parser.parse_args()
+    result = HecLoadGenerator(args.url, args.token, endpoint=args.endpoint, batch_size=args.batch_size,
+                              concurrency=args.concurrency, events=args.events, sourcetype=args.sourcetype, seed=args.seed,
+                              ack=args.ack, verify=args.verify).run()
+    result["latency_ms"] = benchmark.summarize(result.pop("latencies_ms"))
+    print(json.dumps(result, indent=2, sort_keys=True))
+    return 1 if result["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
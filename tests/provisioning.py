@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import json
+import time
+import logging
+import threading
+
+
+LOGGER = logging.getLogger("docker-splunk")
+
+GATE_MODES = ["off", "warn", "fail"]
+
+
+def median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+
+class ProvisioningHistory(object):
+    """
+    Local history of how long each scenario took to become ready, stored as one JSON record per line. A scenario's
+    baseline comes from `baselines` (a JSON file of {"scenario": seconds}) when it is listed there, and otherwise
+    from the median of its last `window` runs on the same platform and bring-up mode that were not regressions.
+    """
+
+    def __init__(self, path, baselines=None, tolerance=0.5, mode="warn", window=10, min_samples=3):
+        self.path = path
+        self.tolerance = tolerance
+        self.mode = mode
+        self.window = window
+        self.min_samples = min_samples
+        self.baselines = {}
+        if baselines:
+            with open(baselines, "r") as f:
+                self.baselines = json.load(f)
+        self.lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def records(self, scenario, platform, bringup):
+        if not os.path.isfile(self.path):
+            return []
+        matches = []
+        with open(self.path, "r") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if (record.get("scenario"), record.get("platform"), record.get("bringup")) == (scenario, platform, bringup):
+                    matches.append(record)
+        return matches
+
+    def baseline(self, scenario, platform, bringup):
+        '''
+        Baseline in seconds, or None while there is not enough history to compare against
+        '''
+        if scenario in self.baselines:
+            return float(self.baselines[scenario])
+        samples = [record["seconds"] for record in self.records(scenario, platform, bringup) if not record.get("regression")]
+        samples = samples[-self.window:]
+        if len(samples) < self.min_samples:
+            return None
+        return median(samples)
+
+    def check(self, scenario, platform, bringup, seconds):
+        '''
+        Compare a time-to-ready against the scenario's baseline and append it to the history
+        '''
+        baseline = self.baseline(scenario, platform, bringup)
+        limit = baseline * (1 + self.tolerance) if baseline is not None else None
+        result = {
+            "scenario": scenario,
+            "platform": platform,
+            "bringup": bringup,
+            "seconds": round(seconds, 2),
+            "baseline": round(baseline, 2) if baseline is not None else None,
+            "limit": round(limit, 2) if limit is not None else None,
+            "regression": limit is not None and seconds > limit,
+            "timestamp": int(time.time())
+        }
+        with self.lock:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(result, sort_keys=True) + "\n")
+        if result["regression"]:
+            LOGGER.warning("Provisioning of {} took {:.1f}s, over the baseline of {:.1f}s by more than {:.0%}".format(
+                scenario, seconds, baseline, self.tolerance))
+        return result
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import csv
+import time
+import logging
+import threading
+
+
+LOGGER = logging.getLogger("docker-splunk")
+
+COLUMNS = ["timestamp", "container", "cpu_percent", "mem_bytes", "mem_limit_bytes",
+           "blkio_read_bytes", "blkio_write_bytes", "net_rx_bytes", "net_tx_bytes"]
+# Columns that get a peak/average summary, along with the suffix used in the junit properties
+SUMMARY_COLUMNS = [("cpu_percent", "cpu_percent"), ("mem_bytes", "mem_mb")]
+
+
+def parse_stats(stats):
+    '''
+    Flatten a single sample of the Docker stats stream into the sampler columns
+    '''
+    cpu_stats = stats.get("cpu_stats", {})
+    precpu_stats = stats.get("precpu_stats", {})
+    cpu_delta = cpu_stats.get("cpu_usage", {}).get("total_usage", 0) - precpu_stats.get("cpu_usage", {}).get("total_usage", 0)
+    system_delta = cpu_stats.get("system_cpu_usage", 0) - precpu_stats.get("system_cpu_usage", 0)
+    online_cpus = cpu_stats.get("online_cpus") or len(cpu_stats.get("cpu_usage", {}).get("percpu_usage") or []) or 1
+    cpu_percent = 100.0 * cpu_delta / system_delta * online_cpus if cpu_delta > 0 and system_delta > 0 else 0.0
+    # Page cache is reclaimable, so report the same working set as `docker stats` does
+    memory_stats = stats.get("memory_stats", {})
+    mem_cache = memory_stats.get("stats", {}).get("inactive_file", memory_stats.get("stats", {}).get("cache", 0))
+    mem_bytes = max(memory_stats.get("usage", 0) - mem_cache, 0)
+    blkio_read, blkio_write = 0, 0
+    for entry in (stats.get("blkio_stats", {}).get("io_service_bytes_recursive") or []):
+        op = entry.get("op", "").lower()
+        if op == "read":
+            blkio_read += entry.get("value", 0)
+        elif op == "write":
+            blkio_write += entry.get("value", 0)
+    networks = (stats.get("networks") or {}).values()
+    return {
+        "cpu_percent": round(cpu_percent, 2),
+        "mem_bytes": mem_bytes,
+        "mem_limit_bytes": memory_stats.get("limit", 0),
+        "blkio_read_bytes": blkio_read,
+        "blkio_write_bytes": blkio_write,
+        "net_rx_bytes": sum(net.get("rx_bytes", 0) for net in networks),
+        "net_tx_bytes": sum(net.get("tx_bytes", 0) for net in networks)
+    }
+
+
+class ResourceSampler(object):
+    """
+    Background sampler that follows the Docker stats stream of every container in a compose project and
+    writes one CSV row per container per interval. Containers that show up after the sampler starts (ex.
+    during a staged bring-up) are picked up on the next discovery pass.
+    """
+
+    def __init__(self, client, project_name, output_dir, interval=2, discovery_interval=5):
+        self.client = client
+        self.project_name = project_name
+        self.interval = interval
+        self.discovery_interval = discovery_interval
+        self.path = os.path.join(output_dir, "{}.csv".format(project_name))
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        self.samples = {}
+        self.threads = {}
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.file = None
+        self.writer = None
+        self.discovery_thread = None
+
+    def start(self):
+        self.file = open(self.path, "w")
+        self.writer = csv.writer(self.file, lineterminator="\n")
+        self.writer.writerow(COLUMNS)
+        self.discovery_thread = threading.Thread(target=self._discover)
+        self.discovery_thread.daemon = True
+        self.discovery_thread.start()
+        return self
+
+    def stop(self, timeout=10):
+        '''
+        Stop sampling, flush the CSV and return the per-container summary
+        '''
+        self.stopped.set()
+        if self.discovery_thread:
+            self.discovery_thread.join(timeout)
+        for thread in list(self.threads.values()):
+            thread.join(timeout)
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+        return self.summarize()
+
+    def _discover(self):
+        label = "com.docker.compose.project={}".format(self.project_name)
+        while not self.stopped.is_set():
+            try:
+                for container in self.client.containers(filters={"label": label}):
+                    if container["Id"] in self.threads:
+                        continue
+                    name = container.get("Labels", {}).get("com.docker.compose.service") or container["Names"][0].lstrip("/")
+                    thread = threading.Thread(target=self._follow, args=(container["Id"], name))
+                    thread.daemon = True
+                    self.threads[container["Id"]] = thread
+                    thread.start()
+            except Exception as e:
+                LOGGER.warning("Resource sampler could not list containers for {}: {}".format(self.project_name, e))
+            self.stopped.wait(self.discovery_interval)
+
+    def _follow(self, container_id, name):
+        last = 0
+        try:
+            # The stream yields roughly one sample per second and ends when the container goes away
+            for stats in self.client.stats(container_id, decode=True, stream=True):
+                if self.stopped.is_set():
+                    break
+                now = time.time()
+                if now - last < self.interval:
+                    continue
+                last = now
+                sample = parse_stats(stats)
+                with self.lock:
+                    if not self.file:
+                        break
+                    self.samples.setdefault(name, []).append(sample)
+                    self.writer.writerow([round(now, 1), name] + [sample[column] for column in COLUMNS[2:]])
+                    self.file.flush()
+        except Exception as e:
+            LOGGER.info("Resource sampler stopped following {}: {}".format(name, e))
+
+    def summarize(self):
+        '''
+        Peak and average of CPU and memory for every container, keyed for use as junit properties
+        '''
+        summary = {}
+        with self.lock:
+            for name, samples in sorted(self.samples.items()):
+                for column, suffix in SUMMARY_COLUMNS:
+                    values = [sample[column] for sample in samples]
+                    if column == "mem_bytes":
+                        values = [value / (1024.0 * 1024.0) for value in values]
+                    summary["resources_{}_{}_peak".format(name, suffix)] = round(max(values), 2)
+                    summary["resources_{}_{}_avg".format(name, suffix)] = round(sum(values) / len(values), 2)
+                summary["resources_{}_samples".format(name)] = len(samples)
+        return summary
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Rank the slowest Ansible roles and tasks from the task profiles that the test harness harvests from containers
+started with SPLUNK_ANSIBLE_PROFILE=true (see splunk/common-files/task_profile.py).
+
+Every line of the input is one playbook run of one container. Runs are grouped by SPLUNK_ROLE and platform,
+and each group lists its roles and tasks by mean time per run.
+
+Examples:
+    python tests/taskprofile.py test-results/ansible-profile/profiles.jsonl
+    python tests/taskprofile.py test-results/ansible-profile/profiles.jsonl --top 10 --output /tmp/report.json
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+
+
+LOCK = threading.Lock()
+
+
+def append(path, profiles):
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    with LOCK:
+        with open(path, "a") as f:
+            for profile in profiles:
+                f.write(json.dumps(profile, sort_keys=True) + "\n")
+
+def load(path):
+    profiles = []
+    if not os.path.isfile(path):
+        return profiles
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                profiles.append(json.loads(line))
+            except ValueError:
+                continue
+    return profiles
+
+def aggregate(profiles, top=20):
+    groups = {}
+    for profile in profiles:
+        key = (profile.get("splunk_role") or "unknown", profile.get("platform") or "unknown", profile.get("playbook"))
+        group = groups.setdefault(key, {"runs": 0, "seconds": 0.0, "roles": {}, "tasks": {}})
+        group["runs"] += 1
+        group["seconds"] += profile.get("seconds", 0)
+        for task in profile.get("tasks", []):
+            role = task.get("role") or "(playbook)"
+            group["roles"][role] = group["roles"].get(role, 0.0) + task["seconds"]
+            entry = group["tasks"].setdefault((role, task["name"]), {"count": 0, "seconds": 0.0, "max_seconds": 0.0})
+            entry["count"] += 1
+            entry["seconds"] += task["seconds"]
+            entry["max_seconds"] = max(entry["max_seconds"], task["seconds"])
+    report = []
+    for (splunk_role, platform, playbook), group in sorted(groups.items(), key=lambda item: item[0]):
+        runs = group["runs"]
+        roles = [{"role": role, "mean_seconds": round(seconds / runs, 2),
+                  "share": round(seconds / group["seconds"], 3) if group["seconds"] else 0}
+                 for role, seconds in group["roles"].items()]
+        tasks = [{"role": role, "task": name, "mean_seconds": round(entry["seconds"] / runs, 2),
+                  "max_seconds": round(entry["max_seconds"], 2), "count": entry["count"]}
+                 for (role, name), entry in group["tasks"].items()]
+        report.append({
+            "splunk_role": splunk_role,
+            "platform": platform,
+            "playbook": playbook,
+            "runs": runs,
+            "mean_seconds": round(group["seconds"] / runs, 2),
+            "roles": sorted(roles, key=lambda r: -r["mean_seconds"])[:top],
+            "tasks": sorted(tasks, key=lambda t: -t["mean_seconds"])[:top]
+        })
+    return report
+
+def format_report(report):
+    lines = []
+    for group in report:
+        lines.append("{splunk_role} on {platform}, {playbook}: {runs} run(s), {mean_seconds}s per run".format(**group))
+        lines.append("  Slowest roles:")
+        for role in group["roles"]:
+            lines.append("    {:>8.2f}s {:>5.1f}%  {}".format(role["mean_seconds"], role["share"] * 100, role["role"]))
+        lines.append("  Slowest tasks:")
+        for task in group["tasks"]:
+            lines.append("    {:>8.2f}s (max {:.2f}s)  {}".format(task["mean_seconds"], task["max_seconds"], task["task"]))
+        lines.append("")
+    return "\n".join(lines)
+
+def write_report(path, output, top=20):
+    report = aggregate(load(path), top=top)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Rank the slowest Ansible roles and tasks from harvested task profiles")
+    parser.add_argument("profiles", help="JSON lines file written by the test harness")
+    parser.add_argument("--top", type=int, default=20, help="Number of roles and tasks to list per group (default: 20)")
+    parser.add_argument("--output", help="Also write the report as JSON to this file")
+    args = parser.parse_args()
+    report = aggregate(load(args.profiles), top=args.top)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+    sys.stdout.write(format_report(report) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
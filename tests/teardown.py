@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import os
+import time
+import shlex
+import logging
+import threading
+import subprocess
+import docker
+from shutil import rmtree
+from executor import remove_labeled_resources
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
+
+
+LOGGER = logging.getLogger("docker-splunk")
+
+
+class TeardownQueue(object):
+    """
+    Tears down finished compose stacks on a background worker, so that the next test can start while the
+    volumes of the previous one are still being removed. submit() blocks once `max_pending` stacks are waiting,
+    and close() is the barrier that waits for every stack at the end of the session.
+    """
+
+    def __init__(self, max_pending=2, workers=1):
+        self.client = docker.APIClient()
+        self.queue = Queue(maxsize=max_pending)
+        self.condition = threading.Condition()
+        # Fixed container names (`container_name:` in a compose file) held by stacks that are not removed yet
+        self.pending_names = {}
+        self.timings = []
+        self.failures = []
+        self.blocked_seconds = 0.0
+        self.threads = [threading.Thread(target=self.worker, name="teardown-{}".format(n)) for n in range(workers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    def submit(self, project_name, compose_file=None, paths=(), env=None, container_names=()):
+        '''
+        Queue a stack, identified by its compose project label, for removal along with any files that belong to it
+        '''
+        with self.condition:
+            self.pending_names[project_name] = set(container_names)
+        start = time.time()
+        self.queue.put((project_name, compose_file, list(paths), env or {}))
+        waited = time.time() - start
+        self.blocked_seconds += waited
+        if waited > 1:
+            LOGGER.info("Teardown queue was full, waited {:.1f}s to queue {}".format(waited, project_name))
+        return waited
+
+    def wait_for_names(self, container_names, timeout=600):
+        '''
+        Block until no queued stack still holds any of `container_names`, so a scenario can reuse them
+        '''
+        names = set(container_names)
+        deadline = time.time() + timeout
+        with self.condition:
+            while any(names & held for held in self.pending_names.values()):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+        return True
+
+    def worker(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                self.teardown(*item)
+            except Exception as e:
+                LOGGER.error("Teardown of {} failed: {}".format(item[0], e))
+                self.failures.append((item[0], str(e)))
+            finally:
+                if item is not None:
+                    with self.condition:
+                        self.pending_names.pop(item[0], None)
+                        self.condition.notify_all()
+                self.queue.task_done()
+
+    def teardown(self, project_name, compose_file, paths, env):
+        start = time.time()
+        if compose_file and os.path.isfile(compose_file):
+            command = "docker-compose -p {} -f {} down --volumes --remove-orphans".format(project_name, compose_file)
+            proc_env = os.environ.copy()
+            proc_env.update(env)
+            proc = subprocess.Popen(shlex.split(command), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, env=proc_env)
+            out, _ = proc.communicate()
+            if proc.returncode != 0:
+                LOGGER.info("Background teardown of {} returned {}: {}".format(project_name, proc.returncode, out))
+        # Anything compose did not remove, ex. when the compose file was already deleted
+        remove_labeled_resources(self.client, "com.docker.compose.project={}".format(project_name))
+        for path in paths:
+            if os.path.isdir(path):
+                rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.remove(path)
+        self.timings.append((project_name, round(time.time() - start, 2)))
+        LOGGER.info("Background teardown of {} took {:.1f}s".format(project_name, time.time() - start))
+
+    def close(self):
+        '''
+        Wait for every queued stack to be removed and stop the workers
+        '''
+        start = time.time()
+        self.queue.join()
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        summary = {
+            "stacks": len(self.timings),
+            "teardown_seconds": round(sum(seconds for _, seconds in self.timings), 2),
+            "blocked_seconds": round(self.blocked_seconds, 2),
+            "barrier_seconds": round(time.time() - start, 2),
+            "failures": len(self.failures)
+        }
+        LOGGER.info("Teardown queue summary: {}".format(summary))
+        return summary
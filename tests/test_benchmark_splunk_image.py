@@ -0,0 +1,715 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import pytest
+import time
+import re
+import os
+import io
+import uuid
+import random
+import tarfile
+import threading
+import json
+import requests
+import docker
+import benchmark
+import hecload
+import eventgen
+from shutil import rmtree
+from executor import Executor
+# Code to suppress insecure https warnings
+import urllib3
+from urllib3.exceptions import InsecureRequestWarning, SubjectAltNameWarning
+urllib3.disable_warnings(InsecureRequestWarning)
+urllib3.disable_warnings(SubjectAltNameWarning)
+
+
+global PLATFORM
+PLATFORM = "debian-9"
+global REPETITIONS
+REPETITIONS = 5
+global HEC_BATCH_SIZES
+HEC_BATCH_SIZES = [1, 100]
+global HEC_CONCURRENCY
+HEC_CONCURRENCY = [1, 8]
+global HEC_EVENTS
+HEC_EVENTS = 20000
+global FORWARDER_FILES
+FORWARDER_FILES = 20
+global FORWARDER_EVENTS
+FORWARDER_EVENTS = 100000
+global SEARCH_CONCURRENCY
+SEARCH_CONCURRENCY = [1, 4]
+global SEARCH_EVENTS
+SEARCH_EVENTS = 200000
+global SEARCH_SCRATCH_MB
+SEARCH_SCRATCH_MB = 6144
+global SMARTSTORE_CACHE_SIZES
+SMARTSTORE_CACHE_SIZES = [64, 1024]
+global SMARTSTORE_EVENTS
+SMARTSTORE_EVENTS = 1000000
+
+def pytest_generate_tests(metafunc):
+    # This is called for every test. Only get/set command line arguments
+    # if the argument is specified in the list of test "fixturenames".
+    global PLATFORM
+    PLATFORM = metafunc.config.option.platform
+    global REPETITIONS
+    REPETITIONS = metafunc.config.option.benchmark_repetitions
+    global HEC_BATCH_SIZES
+    HEC_BATCH_SIZES = [int(n) for n in metafunc.config.option.hec_batch_sizes.split(",")]
+    global HEC_CONCURRENCY
+    HEC_CONCURRENCY = [int(n) for n in metafunc.config.option.hec_concurrency.split(",")]
+    global HEC_EVENTS
+    HEC_EVENTS = metafunc.config.option.hec_events
+    global FORWARDER_FILES
+    FORWARDER_FILES = metafunc.config.option.forwarder_files
+    global FORWARDER_EVENTS
+    FORWARDER_EVENTS = metafunc.config.option.forwarder_events
+    global SEARCH_CONCURRENCY
+    SEARCH_CONCURRENCY = [int(n) for n in metafunc.config.option.search_concurrency.split(",")]
+    global SEARCH_EVENTS
+    SEARCH_EVENTS = metafunc.config.option.search_events
+    global SEARCH_SCRATCH_MB
+    SEARCH_SCRATCH_MB = metafunc.config.option.search_scratch_mb
+    global SMARTSTORE_CACHE_SIZES
+    SMARTSTORE_CACHE_SIZES = [int(n) for n in metafunc.config.option.smartstore_cache_sizes.split(",")]
+    global SMARTSTORE_EVENTS
+    SMARTSTORE_EVENTS = metafunc.config.option.smartstore_events
+    if "cache_size_mb" in metafunc.fixturenames:
+        metafunc.parametrize("cache_size_mb", SMARTSTORE_CACHE_SIZES)
+
+
+@pytest.mark.benchmark
+class TestBenchmarkSplunk(Executor):
+    """
+    Benchmarks for the Splunk Enterprise/Universal Forwarder images. Raw samples and their percentiles are
+    stored under test-results/benchmarks/ (see benchmark.py) and the medians are attached to the junit XML.
+    """
+
+    STARTUP_SCENARIOS = [("1so_trial.yaml", "so1"), ("1uf.yaml", "uf1"), ("1so_namedvolumes.yaml", "so1")]
+    # Token hard-coded within the 1so_hec.yaml and 1uf_hec.yaml composes
+    HEC_TOKEN = "abcd1234"
+    # Same shapes as 1uf1so.yaml and 1sh2idx2hf.yaml, generated so that a default.yml can be mounted for splunktcp-ssl
+    FORWARDER_TOPOLOGIES = {
+        "uf_1idx": ({"universal_forwarders": 1}, "uf1", "so1"),
+        "uf_2idx": ({"indexers": 2, "cluster_master": False, "search_heads": 1, "universal_forwarders": 1}, "uf1", "sh1"),
+        "hf_2idx": ({"indexers": 2, "cluster_master": False, "search_heads": 1, "heavy_forwarders": 1}, "hf1", "sh1")
+    }
+    SEARCH_SOURCETYPE = "searchbench"
+    # Representative search shapes, all over the fixed dataset from build_search_dataset()
+    SEARCH_CATALOG = [
+        ("dense", "search index=main sourcetype=searchbench earliest=-2d | stats count"),
+        ("sparse", "search index=main sourcetype=searchbench earliest=-2d needle | stats count"),
+        ("tstats", "| tstats count where index=main sourcetype=searchbench earliest=-2d by host"),
+        ("stats_by", "search index=main sourcetype=searchbench earliest=-2d | stats count avg(bytes) by status server")
+    ]
+    # Bucket and credentials of the S3 stand-in in 2idx1cm_smartstore.yaml
+    SMARTSTORE_BUCKET = "smartstore"
+    SMARTSTORE_ACCESS_KEY = "smartstore"
+    SMARTSTORE_SECRET_KEY = "smartstore-secret"
+    SMARTSTORE_QUERY = "search index=main sourcetype=access_combined earliest=-1d | stats count avg(bytes) by status"
+    # JAVA_VERSION values along with the java-image/ variant that has them preinstalled (see `make splunk-java`)
+    JAVA_VARIANTS = [("openjdk:8", "splunk-openjdk8"), ("openjdk:11", "splunk-openjdk11")]
+
+    @classmethod
+    def setup_class(cls):
+        super(TestBenchmarkSplunk, cls).setup_class(PLATFORM)
+
+    def setup_method(self, method):
+        # Make sure all running containers are removed
+        self._clean_docker_env()
+        self.compose_file_name = None
+        self.project_name = None
+        self.container_id = None
+        self.DIR = None
+
+    def teardown_method(self, method):
+        self.stop_resource_sampler()
+        if self.container_id:
+            self.client.remove_container(self.container_id, v=True, force=True)
+        if self.compose_file_name and self.project_name:
+            # Generated scenarios and their defaults go away together with the stack
+            compose_file = os.path.join(self.SCENARIOS_DIR, self.compose_file_name)
+            paths = [compose_file] if self.compose_file_name.endswith("_generated.yaml") else []
+            self.teardown_stack(compose_file, paths=paths + ([self.DIR] if self.DIR else []))
+        elif self.DIR:
+            try:
+                rmtree(self.DIR)
+            except OSError:
+                pass
+        self.compose_file_name, self.project_name, self.container_id, self.DIR = None, None, None, None
+
+    def get_scenario_image(self, scenario):
+        return self.UF_IMAGE_NAME if "uf" in scenario else self.SPLUNK_IMAGE_NAME
+
+    def get_service_container(self, service):
+        labels = ["com.docker.compose.project={}".format(self.project_name), "com.docker.compose.service={}".format(service)]
+        containers = self.client.containers(filters={"label": labels})
+        assert len(containers) == 1
+        return containers[0]["Id"]
+
+    def splunkd_ready(self, container_id):
+        try:
+            splunkd_port = self.client.port(container_id, 8089)[0]["HostPort"]
+            url = "https://localhost:{}/services/server/info".format(splunkd_port)
+            resp = requests.get(url, auth=("admin", self.password), verify=False, timeout=5)
+            return resp.status_code == 200
+        except Exception:
+            return False
+
+    def wait_for_startup(self, container_id, start, playbook_runs=1, timeout=600):
+        '''
+        Seconds from `start` until the container has logged `playbook_runs` completed playbooks and
+        until splunkd answers on its management port. Set playbook_runs to 0 to only wait on splunkd.
+        '''
+        playbook_seconds = None if playbook_runs else 0
+        while time.time() - start < timeout:
+            if playbook_seconds is None:
+                output = self.client.logs(container_id)
+                if output.count("Ansible playbook complete") >= playbook_runs:
+                    playbook_seconds = time.time() - start
+            if playbook_seconds is not None and self.splunkd_ready(container_id):
+                return playbook_seconds, time.time() - start
+            time.sleep(1)
+        return None, None
+
+    def record_benchmark(self, store, case, image, samples, **extra):
+        entry = store.record(case, self.get_image_info(image), samples, **extra)
+        baseline = store.baseline(case, entry["image_id"])
+        change = benchmark.compare(entry, baseline)
+        self.logger.info("Benchmark {}/{} on {}: {}".format(store.suite, case, image, entry["summary"]))
+        if change is not None:
+            self.logger.info("Benchmark {}/{} p50 changed by {:+.1%} compared to {} ({})".format(store.suite, case, change,
+                                                                                                  baseline["image"], baseline["image_id"]))
+        self.junit_properties["{}_p50".format(case)] = entry["summary"]["p50"]
+        self.junit_properties["{}_p99".format(case)] = entry["summary"]["p99"]
+        return entry
+
+    @pytest.mark.parametrize("scenario,service", STARTUP_SCENARIOS)
+    def test_benchmark_startup_cold(self, scenario, service):
+        store = benchmark.BenchmarkStore("startup")
+        playbook_samples, splunkd_samples = [], []
+        for _ in range(REPETITIONS):
+            self.compose_file_name = scenario
+            self.project_name = self.generate_random_string()
+            start = time.time()
+            container_count, rc = self.compose_up()
+            assert rc == 0
+            playbook_seconds, splunkd_seconds = self.wait_for_startup(self.get_service_container(service), start)
+            assert playbook_seconds is not None, "{} did not start within the timeout".format(scenario)
+            playbook_samples.append(playbook_seconds)
+            splunkd_samples.append(splunkd_seconds)
+            self.stop_resource_sampler()
+            assert self.compose_down() == 0
+        case = "cold_{}".format(scenario.replace(".yaml", ""))
+        image = self.get_scenario_image(scenario)
+        self.record_benchmark(store, "{}_playbook".format(case), image, playbook_samples, scenario=scenario)
+        self.record_benchmark(store, "{}_splunkd".format(case), image, splunkd_samples, scenario=scenario)
+
+    @pytest.mark.parametrize("scenario,service", STARTUP_SCENARIOS)
+    def test_benchmark_startup_restart(self, scenario, service):
+        store = benchmark.BenchmarkStore("startup")
+        self.compose_file_name = scenario
+        self.project_name = self.generate_random_string()
+        container_count, rc = self.compose_up()
+        assert rc == 0
+        container_id = self.get_service_container(service)
+        playbook_seconds, _ = self.wait_for_startup(container_id, time.time())
+        assert playbook_seconds is not None, "{} did not start within the timeout".format(scenario)
+        # Every restart re-runs the playbook against an already provisioned container
+        playbook_samples, splunkd_samples = [], []
+        for n in range(REPETITIONS):
+            start = time.time()
+            self.client.restart(container_id)
+            playbook_seconds, splunkd_seconds = self.wait_for_startup(container_id, start, playbook_runs=n+2)
+            assert playbook_seconds is not None, "{} did not restart within the timeout".format(scenario)
+            playbook_samples.append(playbook_seconds)
+            splunkd_samples.append(splunkd_seconds)
+        case = "restart_{}".format(scenario.replace(".yaml", ""))
+        image = self.get_scenario_image(scenario)
+        self.record_benchmark(store, "{}_playbook".format(case), image, playbook_samples, scenario=scenario)
+        self.record_benchmark(store, "{}_splunkd".format(case), image, splunkd_samples, scenario=scenario)
+
+    @pytest.mark.parametrize("product,splunk_home", [("splunk", "/opt/splunk"), ("uf", "/opt/splunkforwarder")])
+    def test_benchmark_startup_no_provision(self, product, splunk_home):
+        store = benchmark.BenchmarkStore("startup")
+        image = self.UF_IMAGE_NAME if product == "uf" else self.SPLUNK_IMAGE_NAME
+        command = "{}/bin/splunk start --accept-license --answer-yes --no-prompt --seed-passwd {}".format(splunk_home, self.password)
+        samples = []
+        for _ in range(REPETITIONS):
+            # Without provisioning, the only startup cost is the container itself plus a bare splunkd start
+            cid = self.client.create_container(image, tty=True, command="no-provision", ports=[8089],
+                                               host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)}))
+            self.container_id = cid.get("Id")
+            start = time.time()
+            self.client.start(self.container_id)
+            exec_command = self.client.exec_create(self.container_id, command, user="splunk")
+            self.client.exec_start(exec_command)
+            _, splunkd_seconds = self.wait_for_startup(self.container_id, start, playbook_runs=0)
+            assert splunkd_seconds is not None, "splunkd in {} did not start within the timeout".format(image)
+            samples.append(splunkd_seconds)
+            self.client.remove_container(self.container_id, v=True, force=True)
+            self.container_id = None
+        self.record_benchmark(store, "no_provision_{}_splunkd".format(product), image, samples)
+
+    def received_bytes(self, container_id):
+        stats = self.client.stats(container_id, stream=False)
+        return sum(net.get("rx_bytes", 0) for net in (stats.get("networks") or {}).values())
+
+    @pytest.mark.parametrize("java_version,bundled_image", JAVA_VARIANTS)
+    def test_benchmark_java_install(self, java_version, bundled_image):
+        store = benchmark.BenchmarkStore("java")
+        bundled_image = "{}-{}".format(bundled_image, PLATFORM)
+        try:
+            self.client.inspect_image(bundled_image)
+        except docker.errors.ImageNotFound:
+            pytest.skip("{} has not been built, see `make splunk-java`".format(bundled_image))
+        tag = java_version.replace(":", "")
+        # The runtime path installs the JDK during provisioning, the bundled image should skip that entirely
+        for variant, image in [("runtime", self.SPLUNK_IMAGE_NAME), ("bundled", bundled_image)]:
+            playbook_samples, splunkd_samples, received_mb = [], [], []
+            for _ in range(REPETITIONS):
+                cid = self.client.create_container(image, tty=True, ports=[8089],
+                                                   environment={"SPLUNK_START_ARGS": "--accept-license", "SPLUNK_PASSWORD": self.password,
+                                                                "JAVA_VERSION": java_version},
+                                                   host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)}))
+                self.container_id = cid.get("Id")
+                start = time.time()
+                self.client.start(self.container_id)
+                playbook_seconds, splunkd_seconds = self.wait_for_startup(self.container_id, start)
+                assert playbook_seconds is not None, "{} with {} did not start within the timeout".format(image, java_version)
+                exec_command = self.client.exec_create(self.container_id, "java -version")
+                assert "openjdk version" in self.client.exec_start(exec_command)
+                playbook_samples.append(playbook_seconds)
+                splunkd_samples.append(splunkd_seconds)
+                received_mb.append(self.received_bytes(self.container_id) / 1024.0 / 1024)
+                self.client.remove_container(self.container_id, v=True, force=True)
+                self.container_id = None
+            case = "java_{}_{}".format(tag, variant)
+            self.record_benchmark(store, "{}_playbook".format(case), image, playbook_samples, java_version=java_version)
+            self.record_benchmark(store, "{}_splunkd".format(case), image, splunkd_samples, java_version=java_version)
+            self.record_benchmark(store, "{}_received_mb".format(case), image, received_mb, java_version=java_version)
+
+    def start_hec_target(self, product, tls):
+        '''
+        Bring up a Splunk Enterprise/Universal Forwarder container with HEC enabled and return its container ID,
+        the HEC base URL and what to verify the HEC certificate against
+        '''
+        image = self.UF_IMAGE_NAME if product == "uf" else self.SPLUNK_IMAGE_NAME
+        if tls == "ssl":
+            # Splunk's default self-signed certificate, as set up by the 1so_hec.yaml/1uf_hec.yaml scenarios
+            self.compose_file_name = "1{}_hec.yaml".format("uf" if product == "uf" else "so")
+            self.project_name = self.generate_random_string()
+            container_count, rc = self.compose_up()
+            assert rc == 0
+            assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name))
+            container_id = self.get_service_container("uf1" if product == "uf" else "so1")
+            hec_port = self.client.port(container_id, 8088)[0]["HostPort"]
+            return container_id, "https://localhost:{}".format(hec_port), False
+        splunk_container_name = self.generate_random_string()
+        environment = {"DEBUG": "true", "SPLUNK_START_ARGS": "--accept-license", "SPLUNK_PASSWORD": self.password}
+        binds = []
+        if tls == "ssl_disabled":
+            environment.update({"SPLUNK_HEC_TOKEN": self.HEC_TOKEN, "SPLUNK_HEC_SSL": "False"})
+        elif tls == "custom_cert":
+            # Same setup as the hec_custom_cert tests, with the HEC certificate signed by our own CA
+            self.DIR = os.path.join(self.FIXTURES_DIR, splunk_container_name)
+            os.mkdir(self.DIR)
+            cid = self.client.create_container(image, tty=True, command="create-defaults")
+            self.client.start(cid.get("Id"))
+            output = self.get_container_logs(cid.get("Id"))
+            self.client.remove_container(cid.get("Id"), v=True, force=True)
+            passphrase = "glootie"
+            self.generate_self_signed_certs(self.DIR, passphrase)
+            output = re.sub(r'''  hec:.*?    token: .*?\n''', r'''  hec:
+    enable: True
+    port: 8088
+    ssl: True
+    token: {}
+    cert: /tmp/defaults/cert.pem
+    password: {}\n'''.format(self.HEC_TOKEN, passphrase), output, flags=re.DOTALL)
+            with open(os.path.join(self.DIR, "default.yml"), "w") as f:
+                f.write(output)
+            binds.append(self.DIR + ":/tmp/defaults/")
+        cid = self.client.create_container(image, tty=True, ports=[8088, 8089], volumes=["/tmp/defaults/"],
+                                           name=splunk_container_name, environment=environment,
+                                           host_config=self.client.create_host_config(binds=binds,
+                                                                                      port_bindings={8089: ("0.0.0.0",), 8088: ("0.0.0.0",)}))
+        self.container_id = cid.get("Id")
+        self.client.start(self.container_id)
+        assert self.wait_for_containers(1, name=splunk_container_name)
+        assert self.check_splunkd("admin", self.password, name=splunk_container_name)
+        hec_port = self.client.port(self.container_id, 8088)[0]["HostPort"]
+        if tls == "ssl_disabled":
+            return self.container_id, "http://localhost:{}".format(hec_port), False
+        return self.container_id, "https://localhost:{}".format(hec_port), os.path.join(self.DIR, "cacert.pem")
+
+    def set_hec_ack(self, container_id, enabled):
+        splunkd_port = self.client.port(container_id, 8089)[0]["HostPort"]
+        url = "https://localhost:{}/servicesNS/nobody/splunk_httpinput/data/inputs/http/splunk_hec_token".format(splunkd_port)
+        kwargs = {"auth": ("admin", self.password), "data": {"useACK": "1" if enabled else "0"}, "verify": False}
+        status, content = self.handle_request_retry("POST", url, kwargs)
+        assert status == 200
+
+    @pytest.mark.parametrize("product,tls", [("splunk", "ssl"), ("splunk", "ssl_disabled"), ("splunk", "custom_cert"),
+                                             ("uf", "ssl"), ("uf", "ssl_disabled")])
+    def test_benchmark_hec_throughput(self, product, tls):
+        store = benchmark.BenchmarkStore("hec")
+        image = self.UF_IMAGE_NAME if product == "uf" else self.SPLUNK_IMAGE_NAME
+        container_id, url, verify = self.start_hec_target(product, tls)
+        # Indexer acknowledgement only applies where the events get indexed, so skip it on the forwarder
+        for ack in ([False] if product == "uf" else [False, True]):
+            self.set_hec_ack(container_id, ack)
+            for endpoint in ["event", "raw"]:
+                for batch_size in HEC_BATCH_SIZES:
+                    for concurrency in HEC_CONCURRENCY:
+                        result = hecload.HecLoadGenerator(url, self.HEC_TOKEN, endpoint=endpoint, batch_size=batch_size,
+                                                          concurrency=concurrency, events=HEC_EVENTS, ack=ack, verify=verify).run()
+                        assert result["errors"] == 0
+                        case = "hec_{}_{}_{}_ack{}_batch{}_conc{}".format(product, tls, endpoint, "on" if ack else "off", batch_size, concurrency)
+                        self.record_benchmark(store, case, image, result.pop("latencies_ms"), unit="ms", tls=tls, endpoint=endpoint,
+                                              ack=ack, batch_size=batch_size, concurrency=concurrency, **result)
+                        self.junit_properties["{}_events_per_second".format(case)] = result["events_per_second"]
+                        self.junit_properties["{}_mb_per_second".format(case)] = result["mb_per_second"]
+
+    def make_archive(self, files):
+        '''
+        Tar archive, suitable for put_archive(), of (path, content) pairs that are readable by the splunk user
+        '''
+        archive = io.BytesIO()
+        with tarfile.open(fileobj=archive, mode="w") as tar:
+            for path, data in files:
+                info = tarfile.TarInfo(path.strip("/"))
+                info.size = len(data)
+                info.mode = 0o644
+                info.mtime = time.time()
+                tar.addfile(info, io.BytesIO(data))
+        return archive.getvalue()
+
+    def build_file_tree(self, root, files, events, sourcetype="syslog"):
+        '''
+        Tar archive of a synthetic log tree under `root`, with `events` lines spread over `files` files in a few subdirectories
+        '''
+        generator = eventgen.EventGenerator(sourcetype)
+        tree, first = [], 0
+        for n in range(files):
+            count = events // files + (1 if n < events % files else 0)
+            tree.append(("{}/dir{}/file{}.log".format(root, n % 4, n), generator.chunk(first, count)))
+            first += count
+        return self.make_archive(tree), sum(len(data) for _, data in tree)
+
+    def enable_s2s_compression(self, forwarder_id, indexer_ids):
+        '''
+        Turn on splunktcp compression, which has to be enabled on both the receiving and the sending side
+        '''
+        for container_id, conf, stanza in [(indexer_id, "inputs.conf", "[splunktcp://9997]") for indexer_id in indexer_ids] + \
+                                          [(forwarder_id, "outputs.conf", "[tcpout]")]:
+            command = "sh -c 'printf \"\\n{}\\ncompressed = true\\n\" >> $SPLUNK_HOME/etc/system/local/{} && $SPLUNK_HOME/bin/splunk restart'".format(stanza, conf)
+            exec_command = self.client.exec_create(container_id, command, user="splunk")
+            self.client.exec_start(exec_command)
+            assert self.wait_for_startup(container_id, time.time(), playbook_runs=0)[1] is not None
+
+    def count_events(self, container_id, sourcetype):
+        query = "| tstats count where index=main sourcetype={}".format(sourcetype)
+        meta, results = self._run_splunk_query(container_id, query, password=self.password)
+        return int(results["results"][0]["count"]) if results["results"] else 0
+
+    @pytest.mark.parametrize("topology_name", ["uf_1idx", "uf_2idx", "hf_2idx"])
+    @pytest.mark.parametrize("transport", ["splunktcp", "splunktcp_compressed", "splunktcp_ssl"])
+    def test_benchmark_forwarder_throughput(self, topology_name, transport):
+        store = benchmark.BenchmarkStore("forwarding")
+        spec, forwarder, search_head = self.FORWARDER_TOPOLOGIES[topology_name]
+        self.project_name = self.generate_random_string()
+        self.compose_file_name = self.generate_scenario(spec)
+        defaults_url = None
+        if transport == "splunktcp_ssl":
+            # Same s2s settings as the splunktcp_ssl tests, in a directory of our own under test_scenarios/defaults
+            cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, command="create-defaults")
+            self.client.start(cid.get("Id"))
+            output = self.get_container_logs(cid.get("Id"))
+            self.client.remove_container(cid.get("Id"), v=True, force=True)
+            self.DIR = os.path.join(self.DEFAULTS_DIR, self.project_name)
+            os.makedirs(self.DIR)
+            passphrase = "carolebaskindidit"
+            self.generate_self_signed_certs(self.DIR, passphrase)
+            output = re.sub(r'''  s2s:.*?ssl: false''', r'''  s2s:
+    ca: /tmp/defaults/{project}/ca.pem
+    cert: /tmp/defaults/{project}/cert.pem
+    enable: true
+    password: {pw}
+    port: 9997
+    ssl: true'''.format(project=self.project_name, pw=passphrase), output, flags=re.DOTALL)
+            with open(os.path.join(self.DIR, "default.yml"), "w") as f:
+                f.write(output)
+            defaults_url = "/tmp/defaults/{}/default.yml".format(self.project_name)
+        container_count, rc = self.compose_up(defaults_url=defaults_url)
+        assert rc == 0
+        assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name), timeout=900)
+        assert self.check_splunkd("admin", self.password)
+        forwarder_id = self.get_service_container(forwarder)
+        search_id = self.get_service_container(search_head)
+        indexer_ids = [self.get_service_container(name) for name in (["so1"] if search_head == "so1" else ["idx1", "idx2"])]
+        if transport == "splunktcp_compressed":
+            self.enable_s2s_compression(forwarder_id, indexer_ids)
+        image = self.UF_IMAGE_NAME if forwarder.startswith("uf") else self.SPLUNK_IMAGE_NAME
+        completion_samples, first_event_samples, eps_samples, mbps_samples = [], [], [], []
+        for _ in range(REPETITIONS):
+            # Every run lands in its own directory and sourcetype so that runs can be counted independently
+            run = uuid.uuid4().hex[:12]
+            root = "/tmp/fwdbench/{}".format(run)
+            sourcetype = "fwdbench_{}".format(run)
+            archive, total_bytes = self.build_file_tree(root, FORWARDER_FILES, FORWARDER_EVENTS)
+            assert self.client.put_archive(forwarder_id, "/", archive)
+            command = "sh -c '$SPLUNK_HOME/bin/splunk add monitor {} -index main -sourcetype {} -auth admin:{}'".format(root, sourcetype, self.password)
+            start = time.time()
+            exec_command = self.client.exec_create(forwarder_id, command, user="splunk")
+            self.client.exec_start(exec_command)
+            first_event, count = None, 0
+            while count < FORWARDER_EVENTS and time.time() - start < 900:
+                count = self.count_events(search_id, sourcetype)
+                if count and first_event is None:
+                    first_event = time.time() - start
+                if count < FORWARDER_EVENTS:
+                    time.sleep(2)
+            completion = time.time() - start
+            assert count == FORWARDER_EVENTS, "Only {} of {} events were searchable after {:.0f}s".format(count, FORWARDER_EVENTS, completion)
+            completion_samples.append(completion)
+            first_event_samples.append(first_event)
+            eps_samples.append(FORWARDER_EVENTS / completion)
+            mbps_samples.append(total_bytes / completion / (1024.0 * 1024.0))
+        case = "forwarding_{}_{}".format(topology_name, transport)
+        extra = {"topology": spec, "transport": transport, "events": FORWARDER_EVENTS, "files": FORWARDER_FILES}
+        self.record_benchmark(store, "{}_searchable_seconds".format(case), image, completion_samples, **extra)
+        self.record_benchmark(store, "{}_first_event_seconds".format(case), image, first_event_samples, **extra)
+        self.record_benchmark(store, "{}_events_per_second".format(case), image, eps_samples, unit="events/s", **extra)
+        self.record_benchmark(store, "{}_mb_per_second".format(case), image, mbps_samples, unit="MB/s", **extra)
+
+    def build_search_dataset(self, events, shards, seed=42):
+        '''
+        Seeded key=value access events over the last day, split round-robin into `shards` files. About 1 in 10000 events
+        carries the "needle" token for sparse searches.
+        '''
+        rng = random.Random(seed)
+        end = int(time.time())
+        shard_lines = [[] for _ in range(shards)]
+        for n in range(events):
+            timestamp = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(end - 86400 + n * 86400 // events))
+            line = "{} server=web{:02d} user=u{:04d} status={} bytes={} action={}{}\n".format(
+                timestamp, rng.randrange(50), rng.randrange(1000), rng.choice([200] * 8 + [302, 404, 500]),
+                rng.randrange(200, 20000), rng.choice(["view", "search", "cart", "purchase"]), " needle" if n % 10000 == 0 else "")
+            shard_lines[n % shards].append(line)
+        return ["".join(lines).encode("utf-8") for lines in shard_lines]
+
+    def load_dataset(self, indexer_ids, search_id, shards, sourcetype, events):
+        '''
+        Index one shard of a dataset directly on every indexer and wait until all `events` are searchable
+        '''
+        start = time.time()
+        for container_id, data in zip(indexer_ids, shards):
+            assert self.client.put_archive(container_id, "/", self.make_archive([("/tmp/benchdata/dataset.log", data)]))
+            command = "sh -c '$SPLUNK_HOME/bin/splunk add oneshot /tmp/benchdata/dataset.log -index main -sourcetype {} -auth admin:{}'".format(sourcetype, self.password)
+            exec_command = self.client.exec_create(container_id, command, user="splunk")
+            self.client.exec_start(exec_command)
+        count = 0
+        while count < events and time.time() - start < 900:
+            time.sleep(5)
+            count = self.count_events(search_id, sourcetype)
+        assert count == events, "Only {} of {} events were searchable after {:.0f}s".format(count, events, time.time() - start)
+        return time.time() - start
+
+    def run_search(self, container_id, query):
+        '''
+        Run a blocking search job and return its wall-clock latency, the job's own run duration and its searchProviders
+        '''
+        splunkd_port = self.client.port(container_id, 8089)[0]["HostPort"]
+        url = "https://localhost:{}/services/search/jobs".format(splunkd_port)
+        auth = ("admin", self.password)
+        start = time.time()
+        resp = requests.post(url, auth=auth, data={"search": query, "exec_mode": "blocking", "output_mode": "json"}, verify=False)
+        latency = time.time() - start
+        assert resp.status_code == 201
+        sid = json.loads(resp.content)["sid"]
+        resp = requests.get("{}/{}?output_mode=json".format(url, sid), auth=auth, verify=False)
+        assert resp.status_code == 200
+        content = json.loads(resp.content)["entry"][0]["content"]
+        requests.delete("{}/{}".format(url, sid), auth=auth, verify=False)
+        return latency, content["runDuration"], content["searchProviders"]
+
+    def run_search_load(self, search_ids, query, concurrency, iterations):
+        '''
+        Run `query` from `concurrency` parallel clients, spread over the search heads, `iterations` times each
+        '''
+        lock = threading.Lock()
+        results, errors = [], []
+        def client(n):
+            for i in range(iterations):
+                try:
+                    result = self.run_search(search_ids[(n + i) % len(search_ids)], query)
+                except Exception as e:
+                    with lock:
+                        errors.append(str(e))
+                    continue
+                with lock:
+                    results.append(result)
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors, errors
+        return results
+
+    @pytest.mark.parametrize("dispatch", ["volume", "tmpfs"])
+    @pytest.mark.parametrize("scenario,indexers,search_heads", [("2idx2sh1cm.yaml", 2, 2), ("3idx3sh1cm.yaml", 3, 3)])
+    def test_benchmark_search_latency(self, scenario, indexers, search_heads, dispatch):
+        store = benchmark.BenchmarkStore("search")
+        self.project_name = self.generate_random_string()
+        if dispatch == "tmpfs":
+            if not SEARCH_SCRATCH_MB:
+                pytest.skip("--search-scratch-mb is 0")
+            # Same scenario, with the search heads keeping their dispatch directory on a tmpfs (see SPLUNK_SCRATCH_DIR)
+            self.compose_file_name = self.generate_scratch_scenario(scenario, SEARCH_SCRATCH_MB)
+        else:
+            self.compose_file_name = scenario
+        container_count, rc = self.compose_up()
+        assert rc == 0
+        assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name), timeout=900)
+        assert self.check_splunkd("admin", self.password)
+        indexer_ids = [self.get_service_container("idx{}".format(n)) for n in range(1, indexers + 1)]
+        search_ids = [self.get_service_container("sh{}".format(n)) for n in range(1, search_heads + 1)]
+        load_seconds = self.load_dataset(indexer_ids, search_ids[0], self.build_search_dataset(SEARCH_EVENTS, indexers),
+                                         self.SEARCH_SOURCETYPE, SEARCH_EVENTS)
+        self.junit_properties["search_{}_dataset_load_seconds".format(scenario.replace(".yaml", ""))] = round(load_seconds, 2)
+        for name, query in self.SEARCH_CATALOG:
+            for concurrency in SEARCH_CONCURRENCY:
+                results = self.run_search_load(search_ids, query, concurrency, REPETITIONS)
+                fan_out = sorted(set(len(providers) for _, _, providers in results))
+                case = "search_{}_{}_conc{}".format(scenario.replace(".yaml", ""), name, concurrency)
+                if dispatch == "tmpfs":
+                    case = "{}_tmpfs".format(case)
+                self.record_benchmark(store, case, self.SPLUNK_IMAGE_NAME, [latency for latency, _, _ in results], query=query,
+                                      concurrency=concurrency, indexers=indexers, search_heads=search_heads, events=SEARCH_EVENTS, dispatch=dispatch,
+                                      run_duration=benchmark.summarize([duration for _, duration, _ in results]),
+                                      search_providers=fan_out)
+                self.junit_properties["{}_search_providers".format(case)] = max(fan_out)
+
+    def splunkd_post(self, container_id, path, data=None):
+        splunkd_port = self.client.port(container_id, 8089)[0]["HostPort"]
+        url = "https://localhost:{}{}".format(splunkd_port, path)
+        return requests.post(url, auth=("admin", self.password), data=data or {}, verify=False)
+
+    def directory_size(self, container_id, path, user="splunk"):
+        '''
+        Size in bytes of a directory within a container, or 0 if it does not exist (yet)
+        '''
+        exec_command = self.client.exec_create(container_id, "du -sb {}".format(path), user=user)
+        output = self.client.exec_start(exec_command)
+        if isinstance(output, bytes):
+            output = output.decode("utf-8", "replace")
+        match = re.match(r"^(\d+)\s", output)
+        return int(match.group(1)) if match else 0
+
+    def write_smartstore_defaults(self, cache_size_mb):
+        '''
+        Generate a default.yml that puts every index on the S3 stand-in, with a cache of `cache_size_mb` per indexer
+        '''
+        cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, command="create-defaults")
+        self.client.start(cid.get("Id"))
+        output = self.get_container_logs(cid.get("Id"))
+        self.client.remove_container(cid.get("Id"), v=True, force=True)
+        output = re.sub(r'  smartstore: null', r'''  smartstore:
+    cachemanager:
+      max_cache_size: {cache}
+    index:
+      - indexName: default
+        remoteName: remote_store
+        scheme: s3
+        remoteLocation: {bucket}
+        s3:
+          access_key: {access_key}
+          secret_key: {secret_key}
+          endpoint: http://s3:9000'''.format(cache=cache_size_mb, bucket=self.SMARTSTORE_BUCKET,
+                                              access_key=self.SMARTSTORE_ACCESS_KEY, secret_key=self.SMARTSTORE_SECRET_KEY), output)
+        self.DIR = os.path.join(self.DEFAULTS_DIR, self.project_name)
+        os.makedirs(self.DIR)
+        with open(os.path.join(self.DIR, "default.yml"), "w") as f:
+            f.write(output)
+        return "/tmp/defaults/{}/default.yml".format(self.project_name)
+
+    def wait_for_upload(self, s3_id, start, timeout=900, settle=3, interval=5):
+        '''
+        Poll the size of the bucket until it stops growing for `settle` polls in a row. Returns the bytes in the
+        bucket and the seconds from `start` until the last growth was seen.
+        '''
+        size, last_change, stable = 0, start, 0
+        while time.time() - start < timeout:
+            time.sleep(interval)
+            current = self.directory_size(s3_id, "/data/{}".format(self.SMARTSTORE_BUCKET), user="root")
+            if current != size:
+                size, last_change, stable = current, time.time(), 0
+            elif size:
+                stable += 1
+                if stable >= settle:
+                    break
+        return size, last_change - start
+
+    def evict_cache(self, indexer_ids):
+        '''
+        Ask every indexer to evict as much of its cache as it can. The cacheman endpoint is undocumented, so this is
+        best effort, and the local footprint is measured afterwards to tell whether it worked.
+        '''
+        for container_id in indexer_ids:
+            resp = self.splunkd_post(container_id, "/services/admin/cacheman/_evict", {"path": "/opt/splunk/var/lib/splunk", "mb": 1048576})
+            if resp.status_code not in (200, 201):
+                self.logger.warning("Cache eviction on {} returned {}: {}".format(container_id, resp.status_code, resp.content))
+
+    def cache_footprint_mb(self, indexer_ids):
+        return [self.directory_size(container_id, "/opt/splunk/var/lib/splunk/defaultdb") / (1024.0 * 1024.0) for container_id in indexer_ids]
+
+    def test_benchmark_smartstore(self, cache_size_mb):
+        store = benchmark.BenchmarkStore("smartstore")
+        self.compose_file_name = "2idx1cm_smartstore.yaml"
+        self.project_name = self.generate_random_string()
+        defaults_url = self.write_smartstore_defaults(cache_size_mb)
+        container_count, rc = self.compose_up(defaults_url=defaults_url)
+        assert rc == 0
+        assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name), timeout=900)
+        assert self.check_splunkd("admin", self.password)
+        s3_id = self.get_service_container("s3")
+        search_id = self.get_service_container("cm1")
+        indexer_ids = [self.get_service_container(name) for name in ["idx1", "idx2"]]
+        # Events end a minute ago, so that all of them are within the searched time range
+        generator = eventgen.EventGenerator("access_combined", start_time=time.time() - SMARTSTORE_EVENTS // 1000 - 60)
+        half = SMARTSTORE_EVENTS // 2
+        shards = [generator.chunk(0, half), generator.chunk(half, SMARTSTORE_EVENTS - half)]
+        dataset_mb = sum(len(data) for data in shards) / (1024.0 * 1024.0)
+        self.load_dataset(indexer_ids, search_id, shards, "access_combined", SMARTSTORE_EVENTS)
+        # Rolling the hot buckets to warm is what queues them for upload
+        start = time.time()
+        for container_id in indexer_ids:
+            assert self.splunkd_post(container_id, "/services/data/indexes/main/roll-hot-buckets").status_code == 200
+        uploaded, upload_seconds = self.wait_for_upload(s3_id, start)
+        assert uploaded, "Nothing was uploaded to the {} bucket".format(self.SMARTSTORE_BUCKET)
+        upload_mb = uploaded / (1024.0 * 1024.0)
+        miss_samples, hit_samples, evicted_mb, cached_mb = [], [], [], []
+        for _ in range(REPETITIONS):
+            self.evict_cache(indexer_ids)
+            evicted_mb.append(sum(self.cache_footprint_mb(indexer_ids)))
+            miss_samples.append(self.run_search(search_id, self.SMARTSTORE_QUERY)[0])
+            hit_samples.append(self.run_search(search_id, self.SMARTSTORE_QUERY)[0])
+            cached_mb.append(sum(self.cache_footprint_mb(indexer_ids)))
+        evictions = self._run_splunk_query(search_id, "search index=_internal sourcetype=splunkd component=CacheManager evict* | stats count",
+                                           password=self.password)[1]["results"]
+        case = "smartstore_cache{}mb".format(cache_size_mb)
+        extra = {"cache_size_mb": cache_size_mb, "events": SMARTSTORE_EVENTS, "dataset_mb": round(dataset_mb, 2),
+                 "uploaded_mb": round(upload_mb, 2), "evicted_footprint_mb": benchmark.summarize(evicted_mb),
+                 "cached_footprint_mb": benchmark.summarize(cached_mb),
+                 "eviction_log_lines": int(evictions[0]["count"]) if evictions else 0}
+        self.record_benchmark(store, "{}_search_miss".format(case), self.SPLUNK_IMAGE_NAME, miss_samples, query=self.SMARTSTORE_QUERY, **extra)
+        self.record_benchmark(store, "{}_search_hit".format(case), self.SPLUNK_IMAGE_NAME, hit_samples, query=self.SMARTSTORE_QUERY, **extra)
+        self.record_benchmark(store, "{}_upload_mb_per_second".format(case), self.SPLUNK_IMAGE_NAME,
+                              [upload_mb / max(upload_seconds, 1e-6)], unit="MB/s", upload_seconds=round(upload_seconds, 2), **extra)
+        self.junit_properties["{}_eviction_log_lines".format(case)] = extra["eviction_log_lines"]
+        self.junit_properties["{}_cached_footprint_mb".format(case)] = round(max(cached_mb), 2)
@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+# encoding: utf-8
+
+import io
+import os
+import sys
+import json
+import pytest
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from clair_to_junit_parser import JsonStream
+
+
+def read_all(stream):
+    return [(key, list(value) if hasattr(value, "__next__") or hasattr(value, "next") else value) for key, value in stream.items()]
+
+
+@pytest.mark.parametrize("chunk_size", range(1, 9))
+@pytest.mark.parametrize("document", [
+    u'{"k":[1,2.5e3]}',
+    u'{"k": [ -12.75E-2 , 3, true, 1e+5, null ]}',
+    u'{"image": "splunk/splunk:latest", "count": 100000, "vulnerabilities": [{"severity": "High", "score": 7.5}]}'
+])
+def test_json_stream_numbers_across_chunks(document, chunk_size):
+    # Numbers cut by a chunk boundary, ex. after the "." or the exponent marker, must decode whole
+    stream = JsonStream(io.StringIO(document), chunk_size=chunk_size)
+    assert read_all(stream) == list(json.loads(document).items())
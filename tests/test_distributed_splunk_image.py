@@ -5,9 +5,7 @@ import pytest
 import time
 import re
 import os
-import tarfile
 import requests
-import tarfile
 import docker
 import json
 import urllib
@@ -24,6 +22,8 @@ urllib3.disable_warnings(SubjectAltNameWarning)
 
 global PLATFORM
 PLATFORM = "debian-9"
+global STAGED_BRINGUP
+STAGED_BRINGUP = False
 OLD_SPLUNK_VERSION = "7.3.4"
 
 def pytest_generate_tests(metafunc):
@@ -32,12 +32,14 @@ def pytest_generate_tests(metafunc):
     option_value = metafunc.config.option.platform
     global PLATFORM
     PLATFORM = option_value
+    global STAGED_BRINGUP
+    STAGED_BRINGUP = metafunc.config.option.staged_bringup
 
 class TestDockerSplunk(Executor):
 
     @classmethod
     def setup_class(cls):
-        super(TestDockerSplunk, cls).setup_class(PLATFORM)
+        super(TestDockerSplunk, cls).setup_class(PLATFORM, staged_bringup=STAGED_BRINGUP)
 
     def setup_method(self, method):
         # Make sure all running containers are removed
@@ -47,14 +49,11 @@ class TestDockerSplunk(Executor):
         self.DIR = None
 
     def teardown_method(self, method):
+        self.stop_resource_sampler()
         if self.compose_file_name and self.project_name:
-            if self.DIR:
-                command = "docker-compose -p {} -f {} down --volumes --remove-orphans".format(self.project_name, os.path.join(self.DIR, self.compose_file_name))
-            else:
-                command = "docker-compose -p {} -f test_scenarios/{} down --volumes --remove-orphans".format(self.project_name, self.compose_file_name)
-            out, err, rc = self._run_command(command)
-            self._clean_docker_env()
-        if self.DIR:
+            compose_dir = self.DIR or self.SCENARIOS_DIR
+            self.teardown_stack(os.path.join(compose_dir, self.compose_file_name), paths=[self.DIR] if self.DIR else [])
+        elif self.DIR:
             try:
                 rmtree(self.DIR)
             except OSError:
@@ -137,13 +136,12 @@ class TestDockerSplunk(Executor):
         # Write the default.yml to a file
         with open(os.path.join(self.SCENARIOS_DIR, "defaults", "{}.yml".format(self.project_name)), "w") as f:
             f.write(output)
-        # Tar the app before spinning up the scenario
-        with tarfile.open(os.path.join(self.FIXTURES_DIR, "{}.tgz".format(self.project_name)), "w:gz") as tar:
-            tar.add(self.EXAMPLE_APP, arcname=os.path.basename(self.EXAMPLE_APP))
+        # Package the app before spinning up the scenario
+        _, apps_url = self.package_app()
         # Standup deployment
         try:
             self.compose_file_name = "1idx3sh1cm1dep.yaml"
-            container_count, rc = self.compose_up(defaults_url="/tmp/defaults/{}.yml".format(self.project_name), apps_url="http://appserver/{}.tgz".format(self.project_name))
+            container_count, rc = self.compose_up(defaults_url="/tmp/defaults/{}.yml".format(self.project_name), apps_url=apps_url)
             assert rc == 0
             # Wait for containers to come up
             assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name), timeout=600)
@@ -213,7 +211,6 @@ class TestDockerSplunk(Executor):
         finally:
             try:
                 os.remove(os.path.join(self.SCENARIOS_DIR, "defaults", "{}.yml".format(self.project_name)))
-                os.remove(os.path.join(self.FIXTURES_DIR, "{}.tgz".format(self.project_name)))
             except OSError as e:
                 pass
 
@@ -715,9 +712,8 @@ class TestDockerSplunk(Executor):
 
     def test_compose_1deployment1cm(self):
         self.project_name = self.generate_random_string()
-        # Tar the app before spinning up the scenario
-        with tarfile.open(os.path.join(self.FIXTURES_DIR, "{}.tgz".format(self.project_name)), "w:gz") as tar:
-            tar.add(self.EXAMPLE_APP, arcname=os.path.basename(self.EXAMPLE_APP))
+        # Package the app before spinning up the scenario
+        _, apps_url = self.package_app()
         # Generate default.yml
         cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, command="create-defaults")
         self.client.start(cid.get("Id"))
@@ -741,7 +737,7 @@ class TestDockerSplunk(Executor):
         # Standup deployment
         try:
             self.compose_file_name = "1deployment1cm.yaml"
-            container_count, rc = self.compose_up(defaults_url="/tmp/defaults/{}.yml".format(self.project_name), apps_url="http://appserver/{}.tgz".format(self.project_name))
+            container_count, rc = self.compose_up(defaults_url="/tmp/defaults/{}.yml".format(self.project_name), apps_url=apps_url)
             assert rc == 0
             # Wait for containers to come up
             assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name))
@@ -825,19 +821,17 @@ class TestDockerSplunk(Executor):
         finally:
             try:
                 os.remove(os.path.join(self.SCENARIOS_DIR, "defaults", "{}.yml".format(self.project_name)))
-                os.remove(os.path.join(self.FIXTURES_DIR, "{}.tgz".format(self.project_name)))
             except OSError as e:
                 pass
 
     def test_compose_1deployment1so(self):
         self.project_name = self.generate_random_string()
-        # Tar the app before spinning up the scenario
-        with tarfile.open(os.path.join(self.FIXTURES_DIR, "{}.tgz".format(self.project_name)), "w:gz") as tar:
-            tar.add(self.EXAMPLE_APP, arcname=os.path.basename(self.EXAMPLE_APP))
+        # Package the app before spinning up the scenario
+        _, apps_url = self.package_app()
         # Standup deployment
         try:
             self.compose_file_name = "1deployment1so.yaml"
-            container_count, rc = self.compose_up(apps_url="http://appserver/{}.tgz".format(self.project_name))
+            container_count, rc = self.compose_up(apps_url=apps_url)
             assert rc == 0
             # Wait for containers to come up
             assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name))
@@ -910,21 +904,15 @@ class TestDockerSplunk(Executor):
         except Exception as e:
             self.logger.error(e)
             raise e
-        finally:
-            try:
-                os.remove(os.path.join(self.FIXTURES_DIR, "{}.tgz".format(self.project_name)))
-            except OSError:
-                pass
 
     def test_compose_1deployment1uf(self):
         self.project_name = self.generate_random_string()
-        # Tar the app before spinning up the scenario
-        with tarfile.open(os.path.join(self.FIXTURES_DIR, "{}.tgz".format(self.project_name)), "w:gz") as tar:
-            tar.add(self.EXAMPLE_APP, arcname=os.path.basename(self.EXAMPLE_APP))
+        # Package the app before spinning up the scenario
+        _, apps_url = self.package_app()
         # Standup deployment
         try:
             self.compose_file_name = "1deployment1uf.yaml"
-            container_count, rc = self.compose_up(apps_url="http://appserver/{}.tgz".format(self.project_name))
+            container_count, rc = self.compose_up(apps_url=apps_url)
             assert rc == 0
             # Wait for containers to come up
             assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name))
@@ -998,11 +986,6 @@ class TestDockerSplunk(Executor):
         except Exception as e:
             self.logger.error(e)
             raise e
-        finally:
-            try:
-                os.remove(os.path.join(self.FIXTURES_DIR, "{}.tgz".format(self.project_name)))
-            except OSError:
-                pass
 
     def test_compose_3idx1cm_splunktcp_ssl(self):
         self.project_name = self.generate_random_string()
@@ -1104,4 +1087,169 @@ class TestDockerSplunk(Executor):
                         os.path.join(self.DEFAULTS_DIR, "cert.pem"),
                         os.path.join(self.DEFAULTS_DIR, "{}.yml".format(self.project_name))
                     ]
-            self.cleanup_files(files)
\ No newline at end of file
+            self.cleanup_files(files)
+
+    def test_compose_3idx3sh1cm_staged_bringup(self):
+        # Standup deployment one tier at a time
+        self.compose_file_name = "3idx3sh1cm.yaml"
+        self.project_name = self.generate_random_string()
+        container_count, rc = self.compose_up(staged=True)
+        assert rc == 0
+        # Tiers are started in dependency order
+        assert [(t["tier"], t["services"]) for t in self.tier_timings] == [("management", ["cm1"]),
+                                                                         ("indexers", ["idx1", "idx2", "idx3"]),
+                                                                         ("search", ["sh1", "sh2", "sh3"])]
+        # Wait for containers to come up
+        assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name), timeout=600)
+        # Check Splunkd on all the containers
+        assert self.check_splunkd("admin", self.password)
+        # All peers and search heads should be connected to the cluster master
+        status, content = self.handle_request_retry("GET", "https://localhost:{}/services/cluster/master/peers?output_mode=json".format(self.client.port("cm1", 8089)[0]["HostPort"]),
+                                                    {"auth": ("admin", self.password), "verify": False})
+        assert status == 200
+        peers = [idx["content"]["label"] for idx in json.loads(content)["entry"] if idx["content"]["status"] == "Up"]
+        assert sorted(peers) == ["idx1", "idx2", "idx3"]
+        self.logger.info("Staged bring-up tier timings: {}".format(self.tier_timings))
+
+    @pytest.mark.large
+    @pytest.mark.parametrize("backoff", [False, True])
+    def test_compose_massive_absolute_unit_cm_load(self, backoff):
+        self.project_name = self.generate_random_string()
+        # Generate default.yml, optionally with a retry backoff policy
+        env = {"SPLUNK_PASSWORD": self.password}
+        if backoff:
+            env.update({"SPLUNK_RETRY_BACKOFF_BASE": "2", "SPLUNK_RETRY_BACKOFF_CAP": "10", "SPLUNK_RETRY_BACKOFF_JITTER": "1"})
+        cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, command="create-defaults", environment=env)
+        self.client.start(cid.get("Id"))
+        output = self.get_container_logs(cid.get("Id"))
+        self.client.remove_container(cid.get("Id"), v=True, force=True)
+        if backoff:
+            assert "retry_backoff:" in output
+        with open(os.path.join(self.SCENARIOS_DIR, "defaults", "{}.yml".format(self.project_name)), "w") as f:
+            f.write(output)
+        # Standup deployment
+        try:
+            self.compose_file_name = "massive_absolute_unit.yaml"
+            start = int(time.time())
+            container_count, rc = self.compose_up(defaults_url="/tmp/defaults/{}.yml".format(self.project_name))
+            assert rc == 0
+            # Wait for all peers to join the cluster master
+            idx_list = ["idx{}".format(i) for i in range(1, 11)]
+            joined = []
+            while time.time() - start < 1200:
+                exec_command = self.client.exec_create("cm1", "curl -sk -u admin:{} https://localhost:8089/services/cluster/master/peers?output_mode=json".format(self.password))
+                try:
+                    output = json.loads(self.client.exec_start(exec_command))
+                    joined = [idx["content"]["label"] for idx in output["entry"] if idx["content"]["status"] == "Up"]
+                except (ValueError, KeyError):
+                    pass
+                if sorted(joined) == sorted(idx_list):
+                    break
+                time.sleep(5)
+            join_seconds = int(time.time()) - start
+            assert sorted(joined) == sorted(idx_list)
+            # Measure the load the peers put on the cluster master during bring-up
+            load = self.measure_request_load("cm1", since=start)
+            self.logger.info("Cluster master load with backoff={}: {}, peers joined in {}s".format(backoff, load, join_seconds))
+            self.junit_properties["peers_joined_seconds"] = join_seconds
+            for key, value in load.items():
+                self.junit_properties["cm_{}".format(key)] = value
+            assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name), timeout=600)
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            try:
+                os.remove(os.path.join(self.SCENARIOS_DIR, "defaults", "{}.yml".format(self.project_name)))
+            except OSError:
+                pass
+
+    def test_compose_generated_3idx1sh1cm(self):
+        self.project_name = self.generate_random_string()
+        self.compose_file_name = self.generate_scenario({"indexers": 3, "search_heads": 1})
+        try:
+            # Standup deployment
+            container_count, rc = self.compose_up()
+            assert rc == 0
+            assert container_count == 5
+            # Wait for containers to come up
+            assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name), timeout=600)
+            # Check the generated wiring
+            inventory_json = self.extract_json("{}_sh1_1".format(self.project_name))
+            self.check_common_keys(inventory_json, "sh")
+            assert inventory_json["splunk_indexer"]["hosts"] == ["idx1", "idx2", "idx3"]
+            assert inventory_json["splunk_cluster_master"]["hosts"] == ["cm1"]
+            # Check Splunkd on all the containers
+            assert self.check_splunkd("admin", self.password)
+            # All peers should be connected to the cluster master
+            splunkd_port = self.client.port("{}_cm1_1".format(self.project_name), 8089)[0]["HostPort"]
+            status, content = self.handle_request_retry("GET", "https://localhost:{}/services/cluster/master/peers?output_mode=json".format(splunkd_port),
+                                                        {"auth": ("admin", self.password), "verify": False})
+            assert status == 200
+            peers = [idx["content"]["label"] for idx in json.loads(content)["entry"] if idx["content"]["status"] == "Up"]
+            assert sorted(peers) == ["idx1", "idx2", "idx3"]
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            self.cleanup_files([os.path.join(self.SCENARIOS_DIR, self.compose_file_name)])
+
+    @pytest.mark.parametrize("drain", [False, True])
+    def test_compose_3idx1cm_rolling_restart_drain(self, drain):
+        self.project_name = self.generate_random_string()
+        self.compose_file_name = self.generate_scenario({"indexers": 3, "environment": {"SPLUNK_DRAIN_ON_STOP": "true" if drain else "false"}})
+        try:
+            # Standup deployment
+            container_count, rc = self.compose_up()
+            assert rc == 0
+            assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name), timeout=600)
+            assert self.check_splunkd("admin", self.password)
+            # Give every peer some buckets to replicate
+            for idx in ["idx1", "idx2", "idx3"]:
+                command = "sh -c 'seq 1 100000 | sed \"s/^/drain_test event=/\" > /tmp/drain.log && $SPLUNK_HOME/bin/splunk add oneshot /tmp/drain.log -index main -auth admin:{}'".format(self.password)
+                exec_command = self.client.exec_create("{}_{}_1".format(self.project_name, idx), command, user="splunk")
+                self.client.exec_start(exec_command)
+            splunkd_port = self.client.port("{}_cm1_1".format(self.project_name), 8089)[0]["HostPort"]
+            kwargs = {"auth": ("admin", self.password), "verify": False}
+            def peers_up():
+                status, content = self.handle_request_retry("GET", "https://localhost:{}/services/cluster/master/peers?output_mode=json".format(splunkd_port), kwargs)
+                return [idx["content"]["label"] for idx in json.loads(content)["entry"] if idx["content"]["status"] == "Up"]
+            def cluster_recovered():
+                peers = peers_up()
+                status, content = self.handle_request_retry("GET", "https://localhost:{}/services/cluster/master/generation?output_mode=json".format(splunkd_port), kwargs)
+                generation = json.loads(content)["entry"][0]["content"]
+                return len(peers) == 3 and str(generation.get("replication_factor_met")) in ("1", "True") and str(generation.get("search_factor_met")) in ("1", "True")
+            start = time.time()
+            while not cluster_recovered() and time.time() - start < 600:
+                time.sleep(5)
+            # Restart the peers one at a time, waiting for the cluster to recover from each
+            recovery_seconds = []
+            for idx in ["idx1", "idx2", "idx3"]:
+                container_name = "{}_{}_1".format(self.project_name, idx)
+                start = time.time()
+                self.client.stop(container_name, timeout=300)
+                self.client.start(container_name)
+                # Without a drain, the cluster master keeps the peer Up until its heartbeat times out. Wait until it
+                # noticed the restart, either by taking the peer down or by the peer registering again after provisioning
+                while time.time() - start < 900:
+                    if idx not in peers_up() or self.client.logs(container_name).count("Ansible playbook complete") >= 2:
+                        break
+                    time.sleep(5)
+                while not cluster_recovered() and time.time() - start < 900:
+                    time.sleep(5)
+                assert cluster_recovered(), "Cluster did not recover after restarting {}".format(idx)
+                recovery_seconds.append(int(time.time() - start))
+                # The container log spans both runs, with the drain at the end of the first one
+                output = self.client.logs(container_name)
+                if drain:
+                    assert "Drain finished in" in output
+                    self.junit_properties["{}_drain_seconds".format(idx)] = re.findall(r"Drain finished in (\d+)s", output)[-1]
+            self.logger.info("Rolling restart with drain={}: recovery took {}s per peer".format(drain, recovery_seconds))
+            self.junit_properties["rolling_restart_recovery_seconds"] = sum(recovery_seconds)
+            for idx, seconds in zip(["idx1", "idx2", "idx3"], recovery_seconds):
+                self.junit_properties["{}_recovery_seconds".format(idx)] = seconds
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            self.cleanup_files([os.path.join(self.SCENARIOS_DIR, self.compose_file_name)])
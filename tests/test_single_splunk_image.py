@@ -5,7 +5,6 @@ import pytest
 import time
 import re
 import os
-import tarfile
 import docker
 import json
 import urllib
@@ -23,6 +22,8 @@ urllib3.disable_warnings(SubjectAltNameWarning)
 
 global PLATFORM
 PLATFORM = "debian-9"
+global STAGED_BRINGUP
+STAGED_BRINGUP = False
 OLD_SPLUNK_VERSION = "7.3.4"
 
 def pytest_generate_tests(metafunc):
@@ -31,13 +32,15 @@ def pytest_generate_tests(metafunc):
     option_value = metafunc.config.option.platform
     global PLATFORM
     PLATFORM = option_value
+    global STAGED_BRINGUP
+    STAGED_BRINGUP = metafunc.config.option.staged_bringup
 
 
 class TestDockerSplunk(Executor):
 
     @classmethod
     def setup_class(cls):
-        super(TestDockerSplunk, cls).setup_class(PLATFORM)
+        super(TestDockerSplunk, cls).setup_class(PLATFORM, staged_bringup=STAGED_BRINGUP)
 
     def setup_method(self, method):
         # Make sure all running containers are removed
@@ -47,14 +50,11 @@ class TestDockerSplunk(Executor):
         self.DIR = None
 
     def teardown_method(self, method):
+        self.stop_resource_sampler()
         if self.compose_file_name and self.project_name:
-            if self.DIR:
-                command = "docker-compose -p {} -f {} down --volumes --remove-orphans".format(self.project_name, os.path.join(self.DIR, self.compose_file_name))
-            else:
-                command = "docker-compose -p {} -f test_scenarios/{} down --volumes --remove-orphans".format(self.project_name, self.compose_file_name)
-            out, err, rc = self._run_command(command)
-            self._clean_docker_env()
-        if self.DIR:
+            compose_dir = self.DIR or self.SCENARIOS_DIR
+            self.teardown_stack(os.path.join(compose_dir, self.compose_file_name), paths=[self.DIR] if self.DIR else [])
+        elif self.DIR:
             try:
                 rmtree(self.DIR)
             except OSError:
@@ -165,6 +165,250 @@ class TestDockerSplunk(Executor):
         if cid:
             self.client.remove_container(cid, v=True, force=True)
 
+    def test_splunk_entrypoint_preflight(self):
+        cid = None
+        try:
+            # Run container
+            cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, command="no-provision")
+            cid = cid.get("Id")
+            self.client.start(cid)
+            # Wait a bit
+            time.sleep(5)
+            # Run the preflight checks with a small probe file
+            exec_command = self.client.exec_create(cid, "bash -c 'SPLUNK_PREFLIGHT_PROBE_SIZE_MB=4 /sbin/entrypoint.sh preflight'")
+            std_out = self.client.exec_start(exec_command)
+            assert "Preflight ulimit_nofile:" in std_out
+            # Check the machine-readable report
+            exec_command = self.client.exec_create(cid, "cat /opt/container_artifact/preflight.json")
+            report = json.loads(self.client.exec_start(exec_command))
+            checks = {check["name"]: check for check in report["checks"]}
+            for name in ["transparent_hugepage_enabled", "ulimit_nofile", "ulimit_nproc", "cpu_quota", "sequential_write", "random_write"]:
+                assert name in checks
+            assert checks["ulimit_nproc"]["value"] == "unlimited"
+            assert checks["sequential_write"]["status"] != "skip"
+            assert report["fail_fast"] == False
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            if cid:
+                self.client.remove_container(cid, v=True, force=True)
+
+    def test_splunk_entrypoint_preflight_fail_fast(self):
+        # Run container with a threshold that can't be met
+        cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, command="start",
+                                           environment={
+                                                "SPLUNK_START_ARGS": "--accept-license",
+                                                "SPLUNK_PASSWORD": self.password,
+                                                "SPLUNK_PREFLIGHT": "true",
+                                                "SPLUNK_PREFLIGHT_FAIL_FAST": "true",
+                                                "SPLUNK_PREFLIGHT_PROBE_SIZE_MB": "0",
+                                                "SPLUNK_PREFLIGHT_MIN_CPUS": "100000"
+                                           })
+        self.client.start(cid.get("Id"))
+        output = self.get_container_logs(cid.get("Id"))
+        self.client.remove_container(cid.get("Id"), v=True, force=True)
+        assert "Preflight cpu_quota: fail" in output
+        assert "Preflight checks failed:" in output
+        assert "ansible-playbook" not in output
+
+    def test_splunk_entrypoint_reconcile_ownership(self):
+        cid = None
+        try:
+            # Run container
+            cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, command="no-provision")
+            cid = cid.get("Id")
+            self.client.start(cid)
+            # Wait a bit
+            time.sleep(5)
+            # Give root a subtree of var, which is what a volume from another host often looks like
+            exec_command = self.client.exec_create(cid, "bash -c 'mkdir -p /opt/splunk/var/restored/db && touch /opt/splunk/var/restored/db/{1..50} && chown -R root:root /opt/splunk/var/restored'", user="root")
+            self.client.exec_start(exec_command)
+            exec_command = self.client.exec_create(cid, "bash -c 'SPLUNK_OWNERSHIP_WORKERS=4 /sbin/entrypoint.sh reconcile-ownership'")
+            std_out = self.client.exec_start(exec_command)
+            assert "Ownership of /opt/splunk: changed 52 of" in std_out
+            exec_command = self.client.exec_create(cid, "find /opt/splunk/var/restored ! -user splunk", user="root")
+            assert not self.client.exec_start(exec_command).strip()
+            # Everything has the right owner now, so a second run only samples the volumes and the rest of the tree
+            exec_command = self.client.exec_create(cid, "/sbin/entrypoint.sh reconcile-ownership")
+            self.client.exec_start(exec_command)
+            exec_command = self.client.exec_create(cid, "cat /opt/container_artifact/ownership.json")
+            report = json.loads(self.client.exec_start(exec_command))
+            assert report["paths"][0]["changed"] == 0
+            assert report["paths"][0]["skipped_subtrees"] > 0
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            if cid:
+                self.client.remove_container(cid, v=True, force=True)
+
+    def test_splunk_entrypoint_supervisor(self):
+        splunk_container_name = self.generate_random_string()
+        cid = None
+        try:
+            cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, ports=[8089], name=splunk_container_name,
+                                               environment={
+                                                    "DEBUG": "true",
+                                                    "SPLUNK_START_ARGS": "--accept-license",
+                                                    "SPLUNK_PASSWORD": self.password,
+                                                    "SPLUNK_SUPERVISOR": "true",
+                                                    "SPLUNK_PREFLIGHT": "true",
+                                                    "SPLUNK_PREFLIGHT_PROBE_SIZE_MB": "4"
+                                               },
+                                               host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)}))
+            cid = cid.get("Id")
+            self.client.start(cid)
+            # Poll for the container to be ready
+            assert self.wait_for_containers(1, name=splunk_container_name)
+            assert self.check_splunkd("admin", self.password, name=splunk_container_name)
+            # The supervisor should have replaced the entrypoint as PID 1
+            exec_command = self.client.exec_create(cid, "cat /proc/1/cmdline")
+            std_out = self.client.exec_start(exec_command)
+            assert "supervisor.py" in std_out
+            # Check that every phase was timed, with the pre-start phases running side by side
+            exec_command = self.client.exec_create(cid, "cat /opt/container_artifact/supervisor.json")
+            report = json.loads(self.client.exec_start(exec_command))
+            phases = {phase["name"]: phase for phase in report["phases"]}
+            for name in ["prep_ansible", "seed_etc", "preflight", "ansible_site"]:
+                assert name in phases
+            # Overlapping phases each begin before the other one ends
+            assert phases["prep_ansible"]["start"] < phases["preflight"]["end"]
+            assert phases["preflight"]["start"] < phases["prep_ansible"]["end"]
+            assert phases["ansible_site"]["rc"] == 0
+            # Stop the container and check the shutdown stayed within its deadline
+            self.client.stop(cid, timeout=60)
+            output = self.get_container_logs(cid)
+            shutdown = re.search(r"Supervisor shutdown finished in ([0-9.]+)s", output)
+            assert shutdown and float(shutdown.group(1)) <= 25
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            if cid:
+                self.client.remove_container(cid, v=True, force=True)
+
+    def test_splunk_entrypoint_log_streamer(self):
+        splunk_container_name = self.generate_random_string()
+        cid = None
+        try:
+            cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, ports=[8089], name=splunk_container_name,
+                                               environment={
+                                                    "DEBUG": "true",
+                                                    "SPLUNK_START_ARGS": "--accept-license",
+                                                    "SPLUNK_PASSWORD": self.password,
+                                                    "SPLUNK_LOG_STREAMER": "true",
+                                                    "SPLUNK_LOG_STREAMER_FILES": "splunkd.log,/tmp/noisy/noisy.log",
+                                                    "SPLUNK_LOG_STREAMER_RATE": "10",
+                                                    "SPLUNK_LOG_STREAMER_BURST": "10",
+                                                    "SPLUNK_LOG_STREAMER_SAMPLE": "0",
+                                                    "SPLUNK_LOG_STREAMER_REPORT_INTERVAL": "2"
+                                               },
+                                               host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)}))
+            cid = cid.get("Id")
+            self.client.start(cid)
+            # Poll for the container to be ready
+            assert self.wait_for_containers(1, name=splunk_container_name)
+            assert self.check_splunkd("admin", self.password, name=splunk_container_name)
+            # Flood a followed file, which is created after the streamer started
+            exec_command = self.client.exec_create(cid, "sh -c 'mkdir -p /tmp/noisy && seq 1 5000 > /tmp/noisy/noisy.log'", user="splunk")
+            self.client.exec_start(exec_command)
+            time.sleep(5)
+            output = self.client.logs(cid)
+            records = []
+            for line in output.split("Ansible playbook complete", 1)[1].splitlines():
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+            assert [r for r in records if r["file"] == "/opt/splunk/var/log/splunk/splunkd.log" and r["level"]]
+            noisy = [r for r in records if r["file"] == "/tmp/noisy/noisy.log"]
+            # Only the burst gets through, the rest is counted as dropped
+            assert len([r for r in noisy if "dropped" not in r]) <= 20
+            assert sum(r["dropped"] for r in noisy if "dropped" in r) >= 4900
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            if cid:
+                self.client.remove_container(cid, v=True, force=True)
+
+    def test_splunk_entrypoint_log_streamer_missing_dir(self):
+        splunk_container_name = self.generate_random_string()
+        cid = None
+        try:
+            cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, ports=[8089], name=splunk_container_name,
+                                               environment={
+                                                    "DEBUG": "true",
+                                                    "SPLUNK_START_ARGS": "--accept-license",
+                                                    "SPLUNK_PASSWORD": self.password,
+                                                    "SPLUNK_LOG_STREAMER": "true",
+                                                    "SPLUNK_LOG_STREAMER_FILES": "splunkd.log,/tmp/later/later.log,/tmp/missing/missing.log"
+                                               },
+                                               host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)}))
+            cid = cid.get("Id")
+            self.client.start(cid)
+            # Poll for the container to be ready
+            assert self.wait_for_containers(1, name=splunk_container_name)
+            assert self.check_splunkd("admin", self.password, name=splunk_container_name)
+            # Create the directory of one followed file, while the other one stays missing
+            exec_command = self.client.exec_create(cid, "sh -c 'mkdir -p /tmp/later && echo \"INFO later marker\" > /tmp/later/later.log'", user="splunk")
+            self.client.exec_start(exec_command)
+            time.sleep(5)
+            output = self.client.logs(cid)
+            # A missing directory doesn't turn inotify off for the other files
+            assert "falling back to polling" not in output
+            assert "polling it instead" not in output
+            records = []
+            for line in output.split("Ansible playbook complete", 1)[1].splitlines():
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+            assert [r for r in records if r["file"] == "/opt/splunk/var/log/splunk/splunkd.log" and r["level"]]
+            assert [r for r in records if r["file"] == "/tmp/later/later.log" and r["message"] == "INFO later marker"]
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            if cid:
+                self.client.remove_container(cid, v=True, force=True)
+
+    def test_splunk_entrypoint_ansible_profile(self):
+        splunk_container_name = self.generate_random_string()
+        cid = None
+        try:
+            cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, ports=[8089], name=splunk_container_name,
+                                               environment={
+                                                    "DEBUG": "true",
+                                                    "SPLUNK_START_ARGS": "--accept-license",
+                                                    "SPLUNK_PASSWORD": self.password,
+                                                    "SPLUNK_ANSIBLE_PROFILE": "true"
+                                               },
+                                               host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)}))
+            cid = cid.get("Id")
+            self.client.start(cid)
+            # Poll for the container to be ready
+            assert self.wait_for_containers(1, name=splunk_container_name)
+            exec_command = self.client.exec_create(cid, "cat /opt/container_artifact/ansible_task_profile_site.json")
+            profile = json.loads(self.client.exec_start(exec_command))
+            assert profile["playbook"] == "site.yml"
+            assert profile["splunk_role"] == "splunk_standalone"
+            assert profile["tasks"]
+            for task in profile["tasks"]:
+                assert task["name"]
+                assert task["seconds"] >= 0
+                assert task["status"] in ("ok", "changed", "skipped", "ignored", "failed")
+            # Tasks run one after another, so together they can't take longer than the playbook
+            assert sum(task["seconds"] for task in profile["tasks"]) <= profile["seconds"] + 1
+            assert [task for task in profile["tasks"] if task["role"]]
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            if cid:
+                self.client.remove_container(cid, v=True, force=True)
+
     def test_compose_1so_trial(self):
         # Standup deployment
         self.compose_file_name = "1so_trial.yaml"
@@ -551,6 +795,28 @@ class TestDockerSplunk(Executor):
         status, content = self.handle_request_retry("POST", url, kwargs)
         assert status == 200
 
+    def test_compose_1so_hec_engine(self):
+        # Standup deployment in-process, regardless of --compose-engine
+        self.compose_file_name = "1so_hec.yaml"
+        self.project_name = self.generate_random_string()
+        assert self.compose_up_engine() == 0
+        assert sorted(self.containers) == ["so1"]
+        assert "engine_so1_create_seconds" in self.junit_properties
+        assert "engine_total_seconds" in self.junit_properties
+        # The stack carries the same labels and names as one brought up by docker-compose
+        assert self.wait_for_containers(1, label="com.docker.compose.project={}".format(self.project_name))
+        so1 = self.containers["so1"]
+        assert self.client.inspect_container(so1)["Name"] == "/{}_so1_1".format(self.project_name)
+        output = self.get_container_logs(so1)
+        self.check_ansible(output)
+        assert self.check_splunkd("admin", self.password)
+        # Check HEC works through the returned container handle - the token "abcd1234" is hard-coded within the 1so_hec.yaml compose
+        splunk_hec_port = self.client.port(so1, 8088)[0]["HostPort"]
+        url = "https://localhost:{}/services/collector/event".format(splunk_hec_port)
+        kwargs = {"json": {"event": "hello world"}, "verify": False, "headers": {"Authorization": "Splunk abcd1234"}}
+        status, content = self.handle_request_retry("POST", url, kwargs)
+        assert status == 200
+
     def test_adhoc_1so_preplaybook_with_sudo(self):
         # Create a splunk container
         cid = None
@@ -677,11 +943,9 @@ class TestDockerSplunk(Executor):
     def test_adhoc_1so_apps_location_in_default_yml(self):
         splunk_container_name = self.generate_random_string()
         self.DIR = os.path.join(self.FIXTURES_DIR, splunk_container_name)
-        DIR_EXAMPLE_APP = os.path.join(self.DIR, "splunk_app_example")
-        copytree(self.EXAMPLE_APP, DIR_EXAMPLE_APP)
-        self.EXAMPLE_APP_TGZ = os.path.join(self.DIR, "splunk_app_example.tgz")
-        with tarfile.open(self.EXAMPLE_APP_TGZ, "w:gz") as tar:
-            tar.add(DIR_EXAMPLE_APP, arcname=os.path.basename(DIR_EXAMPLE_APP))
+        os.mkdir(self.DIR)
+        # The packaged app is shared with other tests, so it gets mounted read-only next to the default.yml
+        app_tgz, _ = self.package_app()
         # Generate default.yml
         cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, command="create-defaults")
         self.client.start(cid.get("Id"))
@@ -693,7 +957,6 @@ class TestDockerSplunk(Executor):
         # Change repl factor & search factor
         output = re.sub(r'  user: splunk', r'  user: splunk\n  apps_location: /tmp/defaults/splunk_app_example.tgz', output)
         # Write the default.yml to a file
-        # os.mkdir(self.DIR)
         with open(os.path.join(self.DIR, "default.yml"), "w") as f:
             f.write(output)
         # Create the container and mount the default.yml
@@ -703,7 +966,8 @@ class TestDockerSplunk(Executor):
             cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, command="start-service", ports=[8089], 
                                             volumes=["/tmp/defaults/"], name=splunk_container_name,
                                             environment={"DEBUG": "true", "SPLUNK_START_ARGS": "--accept-license"},
-                                            host_config=self.client.create_host_config(binds=[self.DIR + ":/tmp/defaults/"],
+                                            host_config=self.client.create_host_config(binds=[self.DIR + ":/tmp/defaults/",
+                                                                                              app_tgz + ":/tmp/defaults/splunk_app_example.tgz:ro"],
                                                                                        port_bindings={8089: ("0.0.0.0",)})
                                             )
             cid = cid.get("Id")
@@ -732,7 +996,6 @@ class TestDockerSplunk(Executor):
             if cid:
                 self.client.remove_container(cid, v=True, force=True)
             try:
-                os.remove(self.EXAMPLE_APP_TGZ)
                 os.remove(os.path.join(self.DIR, "default.yml"))
             except OSError:
                 pass
@@ -831,6 +1094,98 @@ class TestDockerSplunk(Executor):
             if cid:
                 self.client.remove_container(cid, v=True, force=True)
 
+    def test_adhoc_1so_scratch_dispatch(self):
+        # Create a splunk container with its dispatch directory on a tmpfs
+        cid = None
+        try:
+            splunk_container_name = self.generate_random_string()
+            cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, ports=[8089], name=splunk_container_name,
+                                               environment={
+                                                            "DEBUG": "true",
+                                                            "SPLUNK_START_ARGS": "--accept-license",
+                                                            "SPLUNK_PASSWORD": self.password,
+                                                            "SPLUNK_SCRATCH_DIR": "/opt/splunk-scratch"
+                                                        },
+                                               host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)},
+                                                                                          tmpfs={"/opt/splunk-scratch": "size=6g,mode=1777"})
+                                            )
+            cid = cid.get("Id")
+            self.client.start(cid)
+            # Poll for the container to be ready
+            assert self.wait_for_containers(1, name=splunk_container_name)
+            # Run a search, which leaves its artifacts in the dispatch directory
+            splunkd_port = self.client.port(cid, 8089)[0]["HostPort"]
+            url = "https://localhost:{}/services/search/jobs".format(splunkd_port)
+            kwargs = {"auth": ("admin", self.password), "verify": False,
+                      "data": {"search": "search index=_internal | head 10", "exec_mode": "blocking", "output_mode": "json"}}
+            status, content = self.handle_request_retry("POST", url, kwargs)
+            assert status == 201
+            sid = json.loads(content)["sid"]
+            exec_command = self.client.exec_create(cid, "readlink /opt/splunk/var/run/splunk/dispatch")
+            assert "/opt/splunk-scratch/var/run/splunk/dispatch" in self.client.exec_start(exec_command)
+            exec_command = self.client.exec_create(cid, "ls /opt/splunk-scratch/var/run/splunk/dispatch")
+            assert sid in self.client.exec_start(exec_command)
+            exec_command = self.client.exec_create(cid, "cat /opt/container_artifact/scratch.json")
+            report = json.loads(self.client.exec_start(exec_command))
+            assert report["relocated"] == True
+            assert report["filesystem"] == "tmpfs"
+            # Splunk's own minFreeSpace is kept, and fits in the tmpfs
+            assert report["min_free_mb"] == 5000
+            exec_command = self.client.exec_create(cid, "ls /opt/splunk/etc/apps")
+            assert "splunk_scratch" not in self.client.exec_start(exec_command)
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            if cid:
+                self.client.remove_container(cid, v=True, force=True)
+
+    def test_adhoc_1so_scratch_existing_min_free_space(self):
+        # Create a splunk container with a tmpfs too small for Splunk's default minFreeSpace
+        cid = None
+        try:
+            splunk_container_name = self.generate_random_string()
+            cid = self.client.create_container(self.SPLUNK_IMAGE_NAME, tty=True, ports=[8089], name=splunk_container_name,
+                                               environment={
+                                                            "DEBUG": "true",
+                                                            "SPLUNK_START_ARGS": "--accept-license",
+                                                            "SPLUNK_PASSWORD": self.password,
+                                                            "SPLUNK_SCRATCH_DIR": "/opt/splunk-scratch"
+                                                        },
+                                               host_config=self.client.create_host_config(port_bindings={8089: ("0.0.0.0",)},
+                                                                                          tmpfs={"/opt/splunk-scratch": "size=256m,mode=1777"})
+                                            )
+            cid = cid.get("Id")
+            self.client.start(cid)
+            # Poll for the container to be ready
+            assert self.wait_for_containers(1, name=splunk_container_name)
+            # The global disk space guard isn't lowered to fit the tmpfs, so dispatch stays on the volume
+            exec_command = self.client.exec_create(cid, "cat /opt/container_artifact/scratch.json")
+            report = json.loads(self.client.exec_start(exec_command))
+            assert report["relocated"] == False
+            assert report["min_free_mb"] == 5000
+            # Configure a minFreeSpace that fits, and restart to relocate with it
+            exec_command = self.client.exec_create(cid, "sh -c 'printf \"\\n[diskUsage]\\nminFreeSpace = 100\\n\" >> /opt/splunk/etc/system/local/server.conf'", user="splunk")
+            self.client.exec_start(exec_command)
+            self.client.restart(cid, timeout=60)
+            assert self.wait_for_containers(1, name=splunk_container_name)
+            exec_command = self.client.exec_create(cid, "cat /opt/container_artifact/scratch.json")
+            report = json.loads(self.client.exec_start(exec_command))
+            assert report["relocated"] == True
+            assert report["min_free_mb"] == 100
+            # The existing setting is left alone, and not overridden by an app
+            exec_command = self.client.exec_create(cid, "/opt/splunk/bin/splunk btool server list diskUsage --debug", user="splunk")
+            std_out = self.client.exec_start(exec_command)
+            assert re.search(r"system/local/server.conf\s+minFreeSpace = 100", std_out)
+            exec_command = self.client.exec_create(cid, "ls /opt/splunk/etc/apps")
+            assert "splunk_scratch" not in self.client.exec_start(exec_command)
+        except Exception as e:
+            self.logger.error(e)
+            raise e
+        finally:
+            if cid:
+                self.client.remove_container(cid, v=True, force=True)
+
     def test_adhoc_1so_declarative_password(self):
         """
         This test is intended to check how the container gets provisioned with declarative passwords
@@ -1618,6 +1973,9 @@ disabled = 1''' in std_out
             cid = None
             splunk_container_name = self.generate_random_string()
             user, password = "admin", self.generate_random_string()
+            # Create the named volumes up front so they are labeled and removed with the test
+            for volume in ("opt-splunk-etc", "opt-splunk-var"):
+                self.client.create_volume(name=volume)
             cid = self.client.create_container("splunk/splunk:{}".format(OLD_SPLUNK_VERSION), tty=True, ports=[8089, 8088], hostname="splunk",
                                             name=splunk_container_name, environment={"DEBUG": "true", "SPLUNK_HEC_TOKEN": "qwerty", "SPLUNK_PASSWORD": password, "SPLUNK_START_ARGS": "--accept-license"},
                                             host_config=self.client.create_host_config(mounts=[Mount("/opt/splunk/etc", "opt-splunk-etc"), Mount("/opt/splunk/var", "opt-splunk-var")],
@@ -1719,12 +2077,11 @@ disabled = 1''' in std_out
 
     def test_compose_1so_apps(self):
         self.project_name = self.generate_random_string()
-        # Tar the app before spinning up the scenario
-        with tarfile.open(os.path.join(self.FIXTURES_DIR, "{}.tgz".format(self.project_name)), "w:gz") as tar:
-            tar.add(self.EXAMPLE_APP, arcname=os.path.basename(self.EXAMPLE_APP))
+        # Package the app before spinning up the scenario
+        _, apps_url = self.package_app()
         # Standup deployment
         self.compose_file_name = "1so_apps.yaml"
-        container_count, rc = self.compose_up(apps_url="http://appserver/{}.tgz".format(self.project_name))
+        container_count, rc = self.compose_up(apps_url=apps_url)
         assert rc == 0
         # Wait for containers to come up
         assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name))
@@ -1732,7 +2089,7 @@ disabled = 1''' in std_out
         log_json = self.extract_json("{}_so1_1".format(self.project_name))
         self.check_common_keys(log_json, "so")
         try:
-            assert log_json["all"]["vars"]["splunk"]["apps_location"][0] == "http://appserver/{}.tgz".format(self.project_name)
+            assert log_json["all"]["vars"]["splunk"]["apps_location"][0] == apps_url
             assert log_json["all"]["vars"]["splunk"]["app_paths"]["default"] == "/opt/splunk/etc/apps"
             assert log_json["all"]["vars"]["splunk"]["app_paths"]["deployment"] == "/opt/splunk/etc/deployment-apps"
             assert log_json["all"]["vars"]["splunk"]["app_paths"]["httpinput"] == "/opt/splunk/etc/apps/splunk_httpinput"
@@ -1760,10 +2117,6 @@ disabled = 1''' in std_out
             # Let's go further and check app version
             output = json.loads(content)
             assert output["entry"][0]["content"]["version"] == "0.0.1"
-        try:
-            os.remove(os.path.join(self.FIXTURES_DIR, "{}.tgz".format(self.project_name)))
-        except OSError:
-            pass
 
     def test_adhoc_1so_custom_conf(self):
         splunk_container_name = self.generate_random_string()
@@ -1828,12 +2181,11 @@ disabled = 1''' in std_out
 
     def test_compose_1uf_apps(self):
         self.project_name = self.generate_random_string()
-         # Tar the app before spinning up the scenario
-        with tarfile.open(os.path.join(self.FIXTURES_DIR, "{}.tgz".format(self.project_name)), "w:gz") as tar:
-            tar.add(self.EXAMPLE_APP, arcname=os.path.basename(self.EXAMPLE_APP))
+         # Package the app before spinning up the scenario
+        _, apps_url = self.package_app()
         # Standup deployment
         self.compose_file_name = "1uf_apps.yaml"
-        container_count, rc = self.compose_up(apps_url="http://appserver/{}.tgz".format(self.project_name))
+        container_count, rc = self.compose_up(apps_url=apps_url)
         assert rc == 0
         # Wait for containers to come up
         assert self.wait_for_containers(container_count, label="com.docker.compose.project={}".format(self.project_name))
@@ -1841,7 +2193,7 @@ disabled = 1''' in std_out
         log_json = self.extract_json("{}_uf1_1".format(self.project_name))
         self.check_common_keys(log_json, "uf")
         try:
-            assert log_json["all"]["vars"]["splunk"]["apps_location"][0] == "http://appserver/{}.tgz".format(self.project_name)
+            assert log_json["all"]["vars"]["splunk"]["apps_location"][0] == apps_url
             assert log_json["all"]["vars"]["splunk"]["app_paths"]["default"] == "/opt/splunkforwarder/etc/apps"
             assert log_json["all"]["vars"]["splunk"]["app_paths"]["deployment"] == "/opt/splunkforwarder/etc/deployment-apps"
             assert log_json["all"]["vars"]["splunk"]["app_paths"]["httpinput"] == "/opt/splunkforwarder/etc/apps/splunk_httpinput"
@@ -1869,10 +2221,6 @@ disabled = 1''' in std_out
             # Let's go further and check app version
             output = json.loads(content)
             assert output["entry"][0]["content"]["version"] == "0.0.1"
-        try:
-            os.remove(os.path.join(self.FIXTURES_DIR, "{}.tgz".format(self.project_name)))
-        except OSError:
-            pass
 
     def test_uf_entrypoint_help(self):
         # Run container
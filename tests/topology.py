@@ -0,0 +1,321 @@
+#!/usr/bin/env python
+# encoding: utf-8
+"""
+Generate docker-compose scenarios and Kubernetes manifests from a compact topology spec.
+
+A spec is a YAML file (or a comma-separated list of key=value pairs) such as:
+
+    indexers: 50
+    search_heads: 3
+    deployer: true
+    sites: 2
+    heavy_forwarders: 2
+    universal_forwarders: 4
+    dmc: true
+
+Examples:
+    python tests/topology.py spec.yml --compose test_scenarios/50idx3sh1cm.yaml
+    python tests/topology.py indexers=50,search_heads=3,deployer=true --kubernetes /tmp/50idx3shc
+"""
+
+import os
+import re
+import sys
+import yaml
+import argparse
+
+
+SPLUNK_IMAGE = "${SPLUNK_IMAGE:-splunk/splunk:latest}"
+UF_IMAGE = "${UF_IMAGE:-splunk/universalforwarder:latest}"
+DEFAULTS = {
+    "indexers": 0,
+    "search_heads": 0,
+    "cluster_master": None,
+    "deployer": False,
+    "license_master": False,
+    "deployment_server": False,
+    "heavy_forwarders": 0,
+    "universal_forwarders": 0,
+    "dmc": False,
+    "sites": 1,
+    "site_replication_factor": 1,
+    "site_search_factor": 1,
+    "environment": {},
+    "kubernetes": {}
+}
+KUBERNETES_DEFAULTS = {
+    "namespace": "splunk",
+    "image": "splunk/splunk:latest",
+    "uf_image": "splunk/universalforwarder:latest",
+    "defaults_url": "http://splunk-defaults/default.yml",
+    "password": "helloworld"
+}
+PORTS = {
+    "splunk_indexer": [8000, 8088, 8089, 9997, 4001],
+    "splunk_universal_forwarder": [8089],
+    "splunk_heavy_forwarder": [8000, 8088, 8089],
+    "default": [8000, 8089, 8191]
+}
+
+
+class Group(object):
+    """
+    A set of identical Splunk nodes, which maps onto one or more compose services and onto a single Kubernetes workload
+    """
+
+    def __init__(self, role, compose_names, kubernetes_name, count=1, site=None, pool=False, uf=False):
+        self.role = role
+        self.compose_names = compose_names
+        self.kubernetes_name = kubernetes_name
+        self.count = count
+        self.site = site
+        # Pools are StatefulSets on Kubernetes, which address their pods as <name>-<ordinal>.<name>
+        self.pool = pool
+        self.uf = uf
+
+    @property
+    def kubernetes_hosts(self):
+        # <pod>.<service> resolves through the namespace's own search domain, so pods don't
+        # need a DNS search domain per pool, which would run into the resolver's limit
+        if self.pool:
+            return ["{0}-{1}.{0}".format(self.kubernetes_name, i) for i in range(self.count)]
+        return [self.kubernetes_name]
+
+
+def parse_spec(value):
+    if isinstance(value, dict):
+        spec = dict(value)
+    elif os.path.isfile(value):
+        with open(value, "r") as f:
+            spec = yaml.safe_load(f) or {}
+    else:
+        spec = {}
+        for item in value.split(","):
+            if item.strip():
+                key, _, raw = item.partition("=")
+                spec[key.strip()] = yaml.safe_load(raw)
+    unknown = set(spec) - set(DEFAULTS)
+    if unknown:
+        raise ValueError("Unknown topology keys: {}".format(", ".join(sorted(unknown))))
+    topology = dict(DEFAULTS)
+    topology.update(spec)
+    if topology["cluster_master"] is None:
+        topology["cluster_master"] = topology["indexers"] > 1
+    if topology["sites"] > 1 and not topology["cluster_master"]:
+        raise ValueError("Multisite topologies require a cluster master")
+    if topology["deployer"] and topology["search_heads"] < 2:
+        raise ValueError("Search head clustering with a deployer requires at least 2 search heads")
+    return topology
+
+def natural_key(name):
+    return [int(part) if part.isdigit() else part for part in re.split(r"(\d+)", name)]
+
+def spread(names, sites):
+    """
+    Assign members round-robin to sites, returning {site: [names]}
+    """
+    by_site = {}
+    for i, name in enumerate(names):
+        by_site.setdefault(i % sites + 1, []).append(name)
+    return by_site
+
+def build_groups(topology):
+    groups = []
+    sites = topology["sites"]
+    if topology["cluster_master"]:
+        groups.append(Group("splunk_cluster_master", ["cm1"], "master", site=1 if sites > 1 else None))
+    if topology["license_master"]:
+        groups.append(Group("splunk_license_master", ["lm1"], "license-master"))
+    if topology["deployer"]:
+        groups.append(Group("splunk_deployer", ["dep1"], "deployer"))
+    if topology["deployment_server"]:
+        groups.append(Group("splunk_deployment_server", ["ds1"], "deployment-server"))
+    # Indexers and search heads are split across sites in multisite topologies
+    indexers = ["idx{}".format(i) for i in range(1, topology["indexers"] + 1)]
+    for site, names in sorted(spread(indexers, sites).items()):
+        name = "indexer" if sites == 1 else "indexer-site{}".format(site)
+        groups.append(Group("splunk_indexer", names, name, count=len(names), site=site if sites > 1 else None, pool=True))
+    search_heads = ["sh{}".format(i) for i in range(1, topology["search_heads"] + 1)]
+    if topology["deployer"]:
+        groups.append(Group("splunk_search_head_captain", search_heads[:1], "captain", site=1 if sites > 1 else None))
+        search_heads = search_heads[1:]
+    for site, names in sorted(spread(search_heads, sites).items()):
+        name = "search" if sites == 1 else "search-site{}".format(site)
+        groups.append(Group("splunk_search_head", names, name, count=len(names), site=site if sites > 1 else None, pool=True))
+    if not topology["indexers"] and not topology["search_heads"]:
+        groups.append(Group("splunk_standalone", ["so1"], "standalone"))
+    if topology["heavy_forwarders"]:
+        names = ["hf{}".format(i) for i in range(1, topology["heavy_forwarders"] + 1)]
+        groups.append(Group("splunk_heavy_forwarder", names, "heavy-forwarder", count=len(names), pool=True))
+    if topology["universal_forwarders"]:
+        names = ["uf{}".format(i) for i in range(1, topology["universal_forwarders"] + 1)]
+        groups.append(Group("splunk_universal_forwarder", names, "forwarder", count=len(names), pool=True, uf=True))
+    if topology["dmc"]:
+        groups.append(Group("splunk_monitor", ["dmc"], "monitor"))
+    return groups
+
+def get_url_environment(topology, groups, kubernetes=False):
+    """
+    Build the SPLUNK_*_URL variables that wire all members of the topology together
+    """
+    hosts = {}
+    for group in groups:
+        names = group.kubernetes_hosts if kubernetes else group.compose_names
+        hosts.setdefault(group.role, []).extend(names)
+    env = []
+    mapping = [
+        ("SPLUNK_STANDALONE_URL", "splunk_standalone"),
+        ("SPLUNK_INDEXER_URL", "splunk_indexer"),
+        ("SPLUNK_SEARCH_HEAD_URL", "splunk_search_head"),
+        ("SPLUNK_SEARCH_HEAD_CAPTAIN_URL", "splunk_search_head_captain"),
+        ("SPLUNK_CLUSTER_MASTER_URL", "splunk_cluster_master"),
+        ("SPLUNK_DEPLOYER_URL", "splunk_deployer"),
+        ("SPLUNK_LICENSE_MASTER_URL", "splunk_license_master"),
+        ("SPLUNK_DEPLOYMENT_SERVER", "splunk_deployment_server"),
+        ("SPLUNK_HEAVY_FORWARDER_URL", "splunk_heavy_forwarder")
+    ]
+    for key, role in mapping:
+        if hosts.get(role):
+            names = hosts[role] if kubernetes else sorted(hosts[role], key=natural_key)
+            env.append((key, ",".join(names)))
+    if topology["sites"] > 1:
+        env.append(("SPLUNK_MULTISITE_MASTER", hosts["splunk_cluster_master"][0]))
+    return env
+
+def get_member_environment(topology, group):
+    env = [("SPLUNK_ROLE", group.role)]
+    if group.site:
+        env.append(("SPLUNK_SITE", "site{}".format(group.site)))
+    if group.role == "splunk_cluster_master" and topology["sites"] > 1:
+        env.append(("SPLUNK_ALL_SITES", ",".join("site{}".format(i) for i in range(1, topology["sites"] + 1))))
+        for key in ["REPLICATION_FACTOR", "SEARCH_FACTOR"]:
+            origin = topology["site_{}".format(key.lower())]
+            env.append(("SPLUNK_MULTISITE_{}_ORIGIN".format(key), origin))
+            env.append(("SPLUNK_MULTISITE_{}_TOTAL".format(key), min(origin * topology["sites"], topology["indexers"])))
+    return env
+
+def generate_compose(topology):
+    groups = build_groups(topology)
+    wiring = get_url_environment(topology, groups)
+    extra = sorted((topology["environment"] or {}).items())
+    services = {}
+    for group in groups:
+        for name in group.compose_names:
+            environment = ["SPLUNK_START_ARGS=--accept-license"]
+            environment += ["{}={}".format(k, v) for k, v in wiring + get_member_environment(topology, group) + extra]
+            environment += ["SPLUNK_LICENSE_URI", "DEBUG=true", "SPLUNK_PASSWORD", "SPLUNK_DEFAULTS_URL"]
+            services[name] = {
+                "networks": {"splunknet": {"aliases": [name]}},
+                "image": UF_IMAGE if group.uf else SPLUNK_IMAGE,
+                "command": "start",
+                "hostname": name,
+                "environment": environment,
+                "ports": [8089] if group.uf else [8000, 8089],
+                "volumes": ["./defaults:/tmp/defaults"]
+            }
+    return {
+        "version": "3.6",
+        "networks": {"splunknet": {"driver": "bridge", "attachable": True}},
+        "services": services
+    }
+
+def generate_kubernetes(topology):
+    """
+    Returns a list of (filename, [documents]) in the layout of test_scenarios/kubernetes
+    """
+    settings = dict(KUBERNETES_DEFAULTS)
+    settings.update(topology["kubernetes"] or {})
+    groups = build_groups(topology)
+    wiring = get_url_environment(topology, groups, kubernetes=True)
+    extra = sorted((topology["environment"] or {}).items())
+    files = []
+    for group in groups:
+        labels = {"app": "splunk", "role": group.role, "tier": group.kubernetes_name}
+        env = [("SPLUNK_HOME", "/opt/splunkforwarder" if group.uf else "/opt/splunk"),
+               ("SPLUNK_DEFAULTS_URL", settings["defaults_url"]),
+               ("SPLUNK_START_ARGS", "--accept-license"),
+               ("SPLUNK_PASSWORD", settings["password"])]
+        env += wiring + get_member_environment(topology, group) + extra + [("DEBUG", "true")]
+        ports = PORTS.get(group.role, PORTS["default"])
+        home = "/opt/splunkforwarder" if group.uf else "/opt/splunk"
+        pod = {
+            "metadata": {"labels": dict(labels)},
+            "spec": {
+                "dnsPolicy": "ClusterFirst",
+                "containers": [{
+                    "name": group.kubernetes_name,
+                    "image": settings["uf_image"] if group.uf else settings["image"],
+                    "env": [{"name": k, "value": str(v)} for k, v in env],
+                    "ports": [{"containerPort": port} for port in ports],
+                    "volumeMounts": [
+                        {"name": "{}-config".format(group.kubernetes_name), "mountPath": "{}/etc".format(home)},
+                        {"name": "{}-data".format(group.kubernetes_name), "mountPath": "{}/var".format(home)}
+                    ]
+                }],
+                "volumes": [
+                    {"name": "{}-config".format(group.kubernetes_name), "emptyDir": {}},
+                    {"name": "{}-data".format(group.kubernetes_name), "emptyDir": {}}
+                ]
+            }
+        }
+        workload = {
+            "apiVersion": "apps/v1",
+            "kind": "StatefulSet" if group.pool else "Deployment",
+            "metadata": {"name": group.kubernetes_name, "labels": dict(labels)},
+            "spec": {
+                "selector": {"matchLabels": dict(labels)},
+                "replicas": group.count,
+                "template": pod
+            }
+        }
+        if group.pool:
+            workload["spec"]["serviceName"] = group.kubernetes_name
+            kind = "statefulset"
+        else:
+            pod["spec"]["hostname"] = group.kubernetes_name
+            kind = "deploy"
+        service = {
+            "apiVersion": "v1",
+            "kind": "Service",
+            "metadata": {"name": group.kubernetes_name, "labels": dict(labels)},
+            "spec": {
+                "selector": dict(labels),
+                "ports": [{"name": "port-{}".format(port), "port": port, "targetPort": port} for port in ports],
+                "clusterIP": "None"
+            }
+        }
+        files.append(("splunk-{}-{}-emptydir.yaml".format(group.kubernetes_name, kind), [workload]))
+        files.append(("splunk-{}-service.yaml".format(group.kubernetes_name), [service]))
+    return files
+
+def write_compose(topology, path):
+    with open(path, "w") as f:
+        yaml.safe_dump(generate_compose(topology), f, default_flow_style=False, sort_keys=False)
+
+def write_kubernetes(topology, directory):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    for filename, documents in generate_kubernetes(topology):
+        with open(os.path.join(directory, filename), "w") as f:
+            yaml.safe_dump_all(documents, f, default_flow_style=False, sort_keys=False)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate compose scenarios and Kubernetes manifests from a topology spec")
+    parser.add_argument("spec", type=str, help="Path to a topology YAML file, or comma-separated key=value pairs")
+    parser.add_argument("--compose", type=str, default=None, help="Path of the docker-compose file to write")
+    parser.add_argument("--kubernetes", type=str, default=None, help="Directory to write Kubernetes manifests into")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    topology = parse_spec(args.spec)
+    if not args.compose and not args.kubernetes:
+        yaml.safe_dump(generate_compose(topology), sys.stdout, default_flow_style=False, sort_keys=False)
+    if args.compose:
+        write_compose(topology, args.compose)
+    if args.kubernetes:
+        write_kubernetes(topology, args.kubernetes)
+
+
+if __name__ == "__main__":
+    main()